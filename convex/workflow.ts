@@ -1,5 +1,5 @@
 import { createOpenAI } from "@ai-sdk/openai";
-import { WorkflowManager } from "@convex-dev/workflow";
+import { WorkflowManager, type WorkflowStep } from "@convex-dev/workflow";
 import { generateObject, generateText } from "ai";
 import { v } from "convex/values";
 import { z } from "zod";
@@ -264,9 +264,10 @@ export const generateCourseWorkflow = workflow.define({
             blocks: summarizedBlocks,
           };
 
-          const { r2_filename } = await step.runAction(
-            internal.workflow.generateVideoCourseAction,
+          const { r2_filename } = await generateVideo(
+            step,
             payload,
+            firstSection.userId,
           );
 
           await step.runMutation(internal.workflow.updateSectionVideoUrl, {
@@ -472,9 +473,10 @@ export const generateBlocksWorkflow = workflow.define({
         blocks: summarizedBlocks,
       };
 
-      const { r2_filename } = await step.runAction(
-        internal.workflow.generateVideoCourseAction,
+      const { r2_filename } = await generateVideo(
+        step,
         payload,
+        section.userId,
       );
 
       await step.runMutation(internal.workflow.updateSectionVideoUrl, {
@@ -1096,44 +1098,171 @@ export const summarizeBlocksAction = internalAction({
 // Generate Video API
 
 const API_KEY = process.env.API_KEY as string;
+const VIDEO_API_URL =
+  "https://chrisdadev13--manim-course-generator-fastapi-app.modal.run";
+const VIDEO_JOB_POLL_INTERVAL_MS = 15_000;
+// Renders can take up to 15 minutes after queueing; each poll is its own short
+// scheduled step, so this is not bounded by the action time limit
+const VIDEO_JOB_TIMEOUT_MS = 45 * 60 * 1000;
+const VIDEO_RETRY_STATUSES = [429, 502, 503, 504];
+
+type VideoJobStatus = "queued" | "running" | "succeeded" | "failed" | "cancelled";
+
+interface VideoJob {
+  job_id: string;
+  status: VideoJobStatus;
+  error?: string;
+  result?: {
+    r2_url: string;
+    r2_filename: string;
+  };
+}
+
+type VideoPoll =
+  | { done: false; retryAfterMs: number }
+  | { done: true; r2_url: string; r2_filename: string };
 
 /**
- * Internal action to generate video course via external API
+ * Milliseconds to wait before retrying a throttled request, from its
+ * Retry-After header (seconds or an HTTP date) or the poll interval
  */
-export const generateVideoCourseAction = internalAction({
+function retryAfterMs(response: Response): number {
+  const header = response.headers.get("Retry-After");
+  if (header) {
+    const seconds = Number(header);
+    if (Number.isFinite(seconds)) {
+      return Math.max(seconds * 1000, 1000);
+    }
+    const date = Date.parse(header);
+    if (!Number.isNaN(date)) {
+      return Math.max(date - Date.now(), 1000);
+    }
+  }
+  return VIDEO_JOB_POLL_INTERVAL_MS;
+}
+
+/**
+ * Generates a section video as a sequence of short workflow steps
+ *
+ * Submitting the job and every status check are separate actions scheduled
+ * with runAfter, so a render that outlives the action time limit is still
+ * followed to the end. 429s (rate limit or full render queue) and transient
+ * gateway errors wait for Retry-After before trying again. Jobs are submitted
+ * under the user's id so the API rate limits each user separately.
+ */
+async function generateVideo(
+  step: WorkflowStep,
+  payload: { title: string; subject: string; blocks: string[] },
+  userId: string,
+) {
+  // Workflow code is replayed, so track the scheduled delays instead of the clock
+  let waitedMs = 0;
+
+  let jobId: string | undefined;
+  let submitAfterMs = 0;
+  while (!jobId) {
+    if (waitedMs > VIDEO_JOB_TIMEOUT_MS) {
+      throw new Error("Video generation could not be submitted in time");
+    }
+    const submitted = await step.runAction(
+      internal.workflow.submitVideoJobAction,
+      { ...payload, clientId: userId },
+      { runAfter: submitAfterMs },
+    );
+    jobId = submitted.jobId;
+    submitAfterMs = submitted.retryAfterMs;
+    waitedMs += submitAfterMs;
+  }
+
+  let poll: VideoPoll = {
+    done: false,
+    retryAfterMs: VIDEO_JOB_POLL_INTERVAL_MS,
+  };
+  while (!poll.done) {
+    if (waitedMs > VIDEO_JOB_TIMEOUT_MS) {
+      throw new Error(`Video generation timed out (job ${jobId})`);
+    }
+    waitedMs += poll.retryAfterMs;
+    poll = await step.runAction(
+      internal.workflow.checkVideoJobAction,
+      { jobId },
+      { runAfter: poll.retryAfterMs },
+    );
+  }
+  return { r2_url: poll.r2_url, r2_filename: poll.r2_filename };
+}
+
+/**
+ * Submits a video generation job, returning its id or how long to wait
+ * before submitting again when the API is throttling
+ */
+export const submitVideoJobAction = internalAction({
   args: {
     title: v.string(),
     subject: v.string(),
     blocks: v.array(v.string()),
+    clientId: v.string(),
   },
-  handler: async (_, args) => {
-    const response = await fetch(
-      "https://chrisdadev13--manim-course-generator-fastapi-app.modal.run/generate",
-      {
-        method: "POST",
-        headers: {
-          "Content-Type": "application/json",
-          "X-API-Key": API_KEY,
-        },
-        body: JSON.stringify({
-          title: args.title,
-          subject: args.subject,
-          blocks: args.blocks,
-        }),
+  handler: async (
+    _,
+    args,
+  ): Promise<{ jobId?: string; retryAfterMs: number }> => {
+    const response = await fetch(`${VIDEO_API_URL}/generate`, {
+      method: "POST",
+      headers: {
+        "Content-Type": "application/json",
+        "X-API-Key": API_KEY,
+        "X-Client-Id": args.clientId,
       },
-    );
+      body: JSON.stringify({
+        title: args.title,
+        subject: args.subject,
+        blocks: args.blocks,
+      }),
+    });
 
+    if (VIDEO_RETRY_STATUSES.includes(response.status)) {
+      return { retryAfterMs: retryAfterMs(response) };
+    }
     if (!response.ok) {
       throw new Error(`Video generation failed: ${response.statusText}`);
     }
 
-    const data = await response.json();
-    const { r2_url, r2_filename } = data as {
-      r2_url: string;
-      r2_filename: string;
-    };
+    const { job_id } = (await response.json()) as VideoJob;
+    return { jobId: job_id, retryAfterMs: VIDEO_JOB_POLL_INTERVAL_MS };
+  },
+});
 
-    return { r2_url, r2_filename };
+/**
+ * Checks a video generation job once
+ */
+export const checkVideoJobAction = internalAction({
+  args: {
+    jobId: v.string(),
+  },
+  handler: async (_, args): Promise<VideoPoll> => {
+    const response = await fetch(`${VIDEO_API_URL}/jobs/${args.jobId}`, {
+      headers: { "X-API-Key": API_KEY },
+    });
+
+    if (VIDEO_RETRY_STATUSES.includes(response.status)) {
+      return { done: false, retryAfterMs: retryAfterMs(response) };
+    }
+    if (!response.ok) {
+      throw new Error(`Video job status check failed: ${response.statusText}`);
+    }
+
+    const job = (await response.json()) as VideoJob;
+    if (job.status === "succeeded" && job.result) {
+      const { r2_url, r2_filename } = job.result;
+      return { done: true, r2_url, r2_filename };
+    }
+    if (job.status === "failed" || job.status === "cancelled") {
+      throw new Error(
+        `Video generation ${job.status}: ${job.error ?? "Unknown error"}`,
+      );
+    }
+    return { done: false, retryAfterMs: VIDEO_JOB_POLL_INTERVAL_MS };
   },
 });
 
@@ -0,0 +1,593 @@
+"""
+Offline benchmark for the video generation pipeline
+
+Runs a fixed corpus of CourseScene programs through the real pipeline
+(prompt assembly, static check, sandboxed dry run and render, faststart
+encode, multipart upload) with Gemini, ElevenLabs and R2 swapped for local
+stubs, so it needs no network or API keys - only the packages and system
+tools from the Modal image (manim, manim-voiceover, google-generativeai,
+modal, ffmpeg, LaTeX).
+
+Usage:
+    python benchmark.py                       # Run the corpus and compare against the baseline
+    python benchmark.py --save-baseline       # Record the current numbers as the new baseline
+    python benchmark.py --scenes cs_arrays --repeat 3
+    python benchmark.py --modal --save-baseline   # Measure inside the Modal image, record locally
+
+Results carry the environment they were measured in (runner, CPU model and
+count, Python and Manim versions). Timings are only compared against a
+baseline recorded in the same environment; with no baseline, or one from
+another environment, the run is in recording mode: it prints and writes its
+results and exits 0 without comparing anything. No baseline is committed,
+so record one where the comparisons will run.
+"""
+
+import argparse
+import hashlib
+import json
+import math
+import os
+import platform
+import resource
+import shutil
+import struct
+import sys
+import time
+import types
+import wave
+
+import cache
+import config
+import jobs
+import main
+import sandbox
+import upload
+
+BENCH_DIR = "/tmp/manim-benchmark"
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+DEFAULT_THRESHOLD = 0.10  # Flag metrics more than 10% worse than the baseline
+TTS_SAMPLE_RATE = 22050
+TTS_WORDS_PER_SECOND = 2.5
+
+VOICEOVER_HEADER = '''from manim import *
+from manim_voiceover import VoiceoverScene
+from manim_voiceover.services.elevenlabs import ElevenLabsService
+'''
+
+CORPUS = {
+    "math_equations": {
+        "title": "Completing the Square",
+        "subject": "Mathematics",
+        "blocks": [
+            "A quadratic equation can be solved by rewriting it as a perfect square plus a constant.",
+            "The roots are where the parabola crosses the x-axis.",
+        ],
+        "code": VOICEOVER_HEADER + r'''
+class CourseScene(VoiceoverScene):
+    def construct(self):
+        # Initialize ElevenLabs voiceover service
+        self.set_speech_service(
+            ElevenLabsService(
+                voice_id="KHla1Z0y3pZPYrqfub7h",
+                voice_settings={"stability": 0.001, "similarity_boost": 0.25},
+                transcription_model=None,
+            )
+        )
+
+        # Title at the top of the frame
+        title = Text("Completing the Square", font_size=44).to_edge(UP)
+        with self.voiceover(text="Let's solve a quadratic equation by completing the square.") as tracker:
+            self.play(Write(title), run_time=tracker.duration)
+
+        # Rewrite the equation step by step
+        eq1 = MathTex("x^2", "+", "6x", "+", "5", "=", "0")
+        eq2 = MathTex("(x+3)^2", "-", "4", "=", "0")
+        eq3 = MathTex("x", "=", "-3", "\\pm", "2")
+        with self.voiceover(text="We start with x squared plus six x plus five equals zero.") as tracker:
+            self.play(Write(eq1), run_time=tracker.duration)
+        with self.voiceover(text="Half of six is three, so this is x plus three, squared, minus four.") as tracker:
+            self.play(TransformMatchingTex(eq1, eq2), run_time=tracker.duration)
+        with self.voiceover(text="Taking square roots gives x equals minus three plus or minus two.") as tracker:
+            self.play(TransformMatchingTex(eq2, eq3), run_time=tracker.duration)
+        self.play(eq3.animate.scale(0.8).next_to(title, DOWN))
+
+        # Plot the parabola and mark its roots
+        axes = Axes(x_range=[-6, 1, 1], y_range=[-5, 6, 2], x_length=6, y_length=4).to_edge(DOWN)
+        graph = axes.plot(lambda x: x ** 2 + 6 * x + 5, color=BLUE)
+        roots = VGroup(*[Dot(axes.c2p(x, 0), color=YELLOW) for x in (-5, -1)])
+        with self.voiceover(text="The parabola crosses the x-axis exactly at minus five and minus one.") as tracker:
+            self.play(Create(axes), Create(graph), run_time=tracker.duration * 0.7)
+            self.play(FadeIn(roots), run_time=tracker.duration * 0.3)
+        self.wait(1)
+''',
+    },
+    "cs_arrays": {
+        "title": "Arrays and Swapping",
+        "subject": "Computer Science",
+        "blocks": [
+            "Arrays store elements in contiguous memory and are accessed by index.",
+            "Bubble sort repeatedly swaps adjacent elements that are out of order.",
+        ],
+        "code": VOICEOVER_HEADER + r'''
+class CourseScene(VoiceoverScene):
+    def construct(self):
+        # Initialize ElevenLabs voiceover service
+        self.set_speech_service(
+            ElevenLabsService(
+                voice_id="KHla1Z0y3pZPYrqfub7h",
+                voice_settings={"stability": 0.001, "similarity_boost": 0.25},
+                transcription_model=None,
+            )
+        )
+
+        title = Text("Arrays", font_size=48).to_edge(UP)
+        values = [5, 2, 8, 1, 9, 3]
+
+        # Build the array as a row of cells with their values inside
+        cells = VGroup(*[Square(side_length=1, color=BLUE) for _ in values]).arrange(RIGHT, buff=0)
+        labels = [Text(str(value), font_size=36).move_to(cell) for value, cell in zip(values, cells)]
+        indices = VGroup(*[
+            Text(str(i), font_size=24, color=GRAY).next_to(cell, DOWN)
+            for i, cell in enumerate(cells)
+        ])
+        with self.voiceover(text="An array stores its elements side by side in memory.") as tracker:
+            self.play(Write(title), Create(cells), *[FadeIn(label) for label in labels], run_time=tracker.duration)
+        with self.voiceover(text="Each element is reached directly by its index, starting from zero.") as tracker:
+            self.play(FadeIn(indices), run_time=tracker.duration)
+
+        # One pass of bubble sort over the array
+        with self.voiceover(text="Bubble sort walks the array and swaps neighbours that are out of order.") as tracker:
+            self.play(Indicate(cells[0]), Indicate(cells[1]), run_time=tracker.duration)
+        for i in range(len(values) - 1):
+            self.play(cells[i].animate.set_color(YELLOW), cells[i + 1].animate.set_color(YELLOW), run_time=0.3)
+            if values[i] > values[i + 1]:
+                # Swap the values and the labels that show them
+                values[i], values[i + 1] = values[i + 1], values[i]
+                self.play(Swap(labels[i], labels[i + 1]), run_time=0.6)
+                labels[i], labels[i + 1] = labels[i + 1], labels[i]
+            self.play(cells[i].animate.set_color(BLUE), cells[i + 1].animate.set_color(BLUE), run_time=0.3)
+
+        with self.voiceover(text="After one pass, the largest value has bubbled to the end.") as tracker:
+            self.play(cells[-1].animate.set_fill(GREEN, opacity=0.5), run_time=tracker.duration)
+        self.wait(1)
+''',
+    },
+    # Matches the array scene template, so --templates times the fast path against this canned code
+    "cs_array_insert": {
+        "title": "Inserting Into an Array",
+        "subject": "Computer Science",
+        "blocks": [
+            "Take the array [5, 2, 8, 1].",
+            "To insert 7 at index 1, every element from index 1 onwards shifts one cell to the right.",
+        ],
+        "code": VOICEOVER_HEADER + r'''
+class CourseScene(VoiceoverScene):
+    def construct(self):
+        # Initialize ElevenLabs voiceover service
+        self.set_speech_service(
+            ElevenLabsService(
+                voice_id="KHla1Z0y3pZPYrqfub7h",
+                voice_settings={"stability": 0.001, "similarity_boost": 0.25},
+                transcription_model=None,
+            )
+        )
+
+        # Build the array as a row of cells with their values inside
+        cells = VGroup(*[
+            VGroup(Square(side_length=1, color=BLUE), Text(str(value), font_size=36))
+            for value in [5, 2, 8, 1]
+        ]).arrange(RIGHT, buff=0)
+        with self.voiceover(text="Take the array five, two, eight, one.") as tracker:
+            self.play(Create(cells), run_time=tracker.duration)
+
+        # Open a gap at index 1 and drop the new element into it
+        new_cell = VGroup(Square(side_length=1, color=GREEN), Text("7", font_size=36)).next_to(cells[1], UP)
+        with self.voiceover(text="To insert seven at index one, the elements after it shift right.") as tracker:
+            self.play(FadeIn(new_cell, shift=DOWN), cells[1:].animate.shift(RIGHT), run_time=tracker.duration * 0.5)
+            self.play(new_cell.animate.move_to(cells[1].get_center() + LEFT), run_time=tracker.duration * 0.5)
+        self.wait(1)
+''',
+    },
+    "physics_vectors": {
+        "title": "Adding Force Vectors",
+        "subject": "Physics",
+        "blocks": [
+            "Forces are vectors with a magnitude and a direction.",
+            "Vectors add head to tail, and the resultant points from the first tail to the last head.",
+        ],
+        "code": VOICEOVER_HEADER + r'''
+class CourseScene(VoiceoverScene):
+    def construct(self):
+        # Initialize ElevenLabs voiceover service
+        self.set_speech_service(
+            ElevenLabsService(
+                voice_id="KHla1Z0y3pZPYrqfub7h",
+                voice_settings={"stability": 0.001, "similarity_boost": 0.25},
+                transcription_model=None,
+            )
+        )
+
+        # Coordinate plane for the vectors
+        plane = NumberPlane(x_range=[-1, 7, 1], y_range=[-1, 5, 1], x_length=8, y_length=6)
+        with self.voiceover(text="Forces are vectors, so they have both a size and a direction.") as tracker:
+            self.play(Create(plane), run_time=tracker.duration)
+
+        # Two forces drawn from the origin
+        origin = plane.c2p(0, 0)
+        force_a = Arrow(origin, plane.c2p(4, 1), buff=0, color=RED)
+        force_b = Arrow(origin, plane.c2p(1, 3), buff=0, color=BLUE)
+        label_a = MathTex("\\vec{F}_1", color=RED).next_to(force_a.get_end(), RIGHT)
+        label_b = MathTex("\\vec{F}_2", color=BLUE).next_to(force_b.get_end(), LEFT)
+        with self.voiceover(text="Here are two forces acting on the same point.") as tracker:
+            self.play(GrowArrow(force_a), GrowArrow(force_b), Write(label_a), Write(label_b), run_time=tracker.duration)
+
+        # Move the second force to the head of the first
+        with self.voiceover(text="To add them, slide the second vector so its tail sits on the first one's head.") as tracker:
+            self.play(
+                force_b.animate.shift(plane.c2p(4, 1) - origin),
+                label_b.animate.shift(plane.c2p(4, 1) - origin),
+                run_time=tracker.duration,
+            )
+
+        # The resultant runs from the first tail to the last head
+        resultant = Arrow(origin, plane.c2p(5, 4), buff=0, color=GREEN)
+        label_r = MathTex("\\vec{F}_1 + \\vec{F}_2", color=GREEN).next_to(resultant.get_center(), UL)
+        with self.voiceover(text="The resultant force points from the first tail to the final head.") as tracker:
+            self.play(GrowArrow(resultant), Write(label_r), run_time=tracker.duration)
+        self.wait(1)
+''',
+    },
+}
+
+
+class CannedResponse:
+    def __init__(self, text: str, prompt):
+        self.text = text
+        prompt = prompt if isinstance(prompt, str) else json.dumps(prompt)  # Multi-turn retries send a list of turns
+        # Rough token estimate so spans carry realistic-looking counts
+        self.usage_metadata = types.SimpleNamespace(
+            prompt_token_count=len(prompt) // 4,
+            candidates_token_count=len(text) // 4,
+            total_token_count=(len(prompt) + len(text)) // 4,
+        )
+
+
+class CannedModel:
+    """Stand-in for genai.GenerativeModel that always answers with the same scene code"""
+
+    def __init__(self, code: str):
+        self.code = code
+        self.calls = 0
+
+    def generate_content(self, prompt, generation_config=None):
+        self.calls += 1
+        return CannedResponse(self.code, prompt)
+
+
+def write_tone(path: str, seconds: float, waveform: str):
+    """Write a mono 16-bit WAV with a quiet 220 Hz tone, or silence"""
+    frames = int(seconds * TTS_SAMPLE_RATE)
+    amplitude = 3000 if waveform == "sine" else 0
+    with wave.open(path, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(TTS_SAMPLE_RATE)
+        f.writeframes(b"".join(
+            struct.pack("<h", int(amplitude * math.sin(2 * math.pi * 220 * i / TTS_SAMPLE_RATE)))
+            for i in range(frames)
+        ))
+
+
+def make_tone_speech_service():
+    """Speech service with ElevenLabsService's constructor and cache behaviour that synthesizes tones locally"""
+    from manim_voiceover.services.base import SpeechService
+
+    class ToneSpeechService(SpeechService):
+        def __init__(self, voice_id: str = None, voice_name: str = None, voice_settings: dict = None, model: str = None, **kwargs):
+            kwargs["transcription_model"] = None  # No Whisper offline
+            super().__init__(**kwargs)
+
+        def generate_from_text(self, text: str, cache_dir: str = None, path: str = None, **kwargs) -> dict:
+            if cache_dir is None:
+                cache_dir = self.cache_dir
+
+            waveform = os.environ.get("BENCH_TTS_WAVEFORM", "sine")
+            input_data = {"input_text": text, "service": "benchmark", "waveform": waveform}
+            cached_result = self.get_cached_result(input_data, cache_dir)
+            if cached_result is not None:
+                return cached_result
+
+            audio_path = path or self.get_audio_basename(input_data) + ".wav"
+            seconds = max(1.0, len(text.split()) / TTS_WORDS_PER_SECOND)
+            write_tone(os.path.join(cache_dir, audio_path), seconds, waveform)
+            return {"input_text": text, "input_data": input_data, "original_audio": audio_path}
+
+    ToneSpeechService.__name__ = "ElevenLabsService"
+    return ToneSpeechService
+
+
+class LocalPaginator:
+    def __init__(self, client):
+        self.client = client
+
+    def paginate(self, Bucket, Key, UploadId):
+        return [{"Parts": self.client.list_parts(Bucket=Bucket, Key=Key, UploadId=UploadId)["Parts"]}]
+
+
+class LocalStorageClient:
+    """The subset of the boto3 S3 client the uploaders use, backed by a local directory"""
+
+    def __init__(self, root: str):
+        self.root = root
+        self.uploads = {}
+
+    def _path(self, bucket: str, key: str) -> str:
+        path = os.path.join(self.root, bucket, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    def create_multipart_upload(self, Bucket, Key, ContentType=None):
+        upload_id = f"upload-{len(self.uploads) + 1}"
+        self.uploads[upload_id] = {}
+        return {"UploadId": upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body, ContentMD5=None):
+        self.uploads[UploadId][PartNumber] = bytes(Body)
+        return {"ETag": f'"{hashlib.md5(Body).hexdigest()}"'}
+
+    def list_parts(self, Bucket, Key, UploadId):
+        return {"Parts": [
+            {"PartNumber": number, "ETag": f'"{hashlib.md5(body).hexdigest()}"', "Size": len(body)}
+            for number, body in sorted(self.uploads[UploadId].items())
+        ]}
+
+    def get_paginator(self, operation):
+        return LocalPaginator(self)
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        parts = self.uploads.pop(UploadId)
+        numbers = [part["PartNumber"] for part in MultipartUpload["Parts"]]
+        with open(self._path(Bucket, Key), "wb") as f:
+            for number in numbers:
+                f.write(parts[number])
+        composite = hashlib.md5(b"".join(hashlib.md5(parts[number]).digest() for number in numbers))
+        return {"ETag": f'"{composite.hexdigest()}-{len(numbers)}"'}
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.uploads.pop(UploadId, None)
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        with open(self._path(Bucket, Key), "wb") as f:
+            f.write(Body)
+
+    def head_object(self, Bucket, Key):
+        return {"ContentLength": os.path.getsize(self._path(Bucket, Key))}
+
+
+def install_offline_stubs():
+    """
+    Point the pipeline at the local TTS stub and cache directory
+
+    This runs at import time so the sandbox fork server, which imports this
+    module as __mp_main__, installs the same stubs its children inherit.
+    """
+    cache.TTS_CACHE_DIR = f"{BENCH_DIR}/tts"
+    os.makedirs(cache.TTS_CACHE_DIR, exist_ok=True)
+    cache.RENDER_CACHE_DIR = f"{BENCH_DIR}/render-cache"
+    os.makedirs(cache.RENDER_CACHE_DIR, exist_ok=True)
+
+    try:
+        import manim_voiceover.services.elevenlabs as elevenlabs_module
+    except ImportError:
+        # The elevenlabs client is not needed offline, so stand in for the whole module
+        elevenlabs_module = types.ModuleType("manim_voiceover.services.elevenlabs")
+        sys.modules["manim_voiceover.services.elevenlabs"] = elevenlabs_module
+    elevenlabs_module.ElevenLabsService = make_tone_speech_service()
+
+
+install_offline_stubs()
+
+
+def run_scene(name: str, scene: dict, storage: LocalStorageClient, warm_tts: bool, render_profile: str = config.DEFAULT_RENDER_PROFILE, use_templates: bool = False) -> dict:
+    """Run one corpus entry through the pipeline and return its measurements"""
+    # Start from empty media and render cache dirs so Manim's partial movie cache doesn't skew repeats
+    shutil.rmtree(config.MEDIA_DIR, ignore_errors=True)
+    shutil.rmtree(cache.RENDER_CACHE_DIR, ignore_errors=True)
+    os.makedirs(cache.RENDER_CACHE_DIR, exist_ok=True)
+    if not warm_tts:
+        shutil.rmtree(cache.TTS_CACHE_DIR, ignore_errors=True)
+        os.makedirs(cache.TTS_CACHE_DIR, exist_ok=True)
+
+    course_content = main.build_course_content(scene["title"], scene["subject"], scene["blocks"])
+    model = CannedModel(scene["code"])
+
+    run_start = time.time()
+    # Scenes a template matches skip the canned code, so the template fast path can be timed too
+    template = main.classify_course(scene["title"], scene["subject"], scene["blocks"]) if use_templates else None
+    if template:
+        template.update(title=scene["title"], blocks=scene["blocks"])
+    render_info = main.generate_and_render_scene(
+        course_content, max_attempts=1, use_voiceover=True, model=model, subject=scene["subject"],
+        render_profile=render_profile, template=template,
+    )
+    spans = render_info["spans"]
+
+    video_path = render_info["video_path"]
+    faststart_path = f"{os.path.splitext(video_path)[0]}_faststart.mp4"
+    with jobs.stage_span(spans, "encode", step="faststart"):
+        main.faststart_mp4(video_path, faststart_path)
+    with jobs.stage_span(spans, "upload"):
+        upload.upload_to_r2(faststart_path, f"benchmark/{name}.mp4", s3_client=storage)
+    total_seconds = time.time() - run_start
+
+    stages = {}
+    for span in spans:
+        stages[span["stage"]] = round(stages.get(span["stage"], 0.0) + span["seconds"], 3)
+
+    return {
+        "route": render_info["route"],
+        "total_seconds": round(total_seconds, 3),
+        "stages": stages,
+        "peak_rss_bytes": max([span.get("peak_rss_bytes", 0) for span in spans] + [0]),
+        "output_bytes": os.path.getsize(faststart_path),
+        "tts_cache": render_info["tts_cache"],
+        "render_cache": render_info["render_cache"],
+        "tts_prefetch": render_info["tts_prefetch"],
+    }
+
+
+def summarize(runs: list) -> dict:
+    """Best-of-N wall times (least noisy) and worst-case memory across repeats"""
+    stage_names = sorted({stage for run in runs for stage in run["stages"]})
+    return {
+        "total_seconds": min(run["total_seconds"] for run in runs),
+        "stages": {stage: min(run["stages"].get(stage, 0.0) for run in runs) for stage in stage_names},
+        "peak_rss_bytes": max(run["peak_rss_bytes"] for run in runs),
+        "output_bytes": runs[-1]["output_bytes"],
+        "route": runs[-1]["route"],
+        "repeats": len(runs),
+    }
+
+
+def flatten_metrics(summary: dict) -> dict:
+    metrics = {
+        "total_seconds": summary["total_seconds"],
+        "peak_rss_bytes": summary["peak_rss_bytes"],
+        "output_bytes": summary["output_bytes"],
+    }
+    for stage, seconds in summary["stages"].items():
+        metrics[f"{stage}_seconds"] = seconds
+    return metrics
+
+
+def compare_to_baseline(results: dict, baseline: dict, threshold: float) -> list:
+    """Print each metric next to its baseline and return the regressions beyond the threshold"""
+    regressions = []
+    for name, summary in results.items():
+        if name not in baseline:
+            print(f"  {name}: no baseline entry")
+            continue
+
+        print(f"\n{name}:")
+        current = flatten_metrics(summary)
+        previous = flatten_metrics(baseline[name])
+        for metric, value in current.items():
+            before = previous.get(metric)
+            if not before:
+                print(f"  {metric:<28} {value:>14}")
+                continue
+            change = (value - before) / before
+            marker = "✗" if change > threshold else "✓"
+            print(f"  {marker} {metric:<26} {value:>14} (baseline {before}, {change:+.1%})")
+            if change > threshold:
+                regressions.append(f"{name}.{metric} {change:+.1%}")
+    return regressions
+
+
+def benchmark_environment(runner: str) -> dict:
+    """Where the numbers were measured; baselines are only compared within one environment"""
+    import manim
+    
+    cpu = platform.processor() or platform.machine()
+    if os.path.exists("/proc/cpuinfo"):
+        with open("/proc/cpuinfo") as f:
+            models = [line.split(":", 1)[1].strip() for line in f if line.startswith("model name")]
+        cpu = models[0] if models else cpu
+    return {
+        "runner": runner,
+        "cpu": cpu,
+        "cpu_count": os.cpu_count(),
+        "python": platform.python_version(),
+        "manim": manim.__version__,
+    }
+
+
+def measure(scenes: list, repeat: int = 1, tts: str = "sine", warm_tts: bool = False, profile: str = config.DEFAULT_RENDER_PROFILE, templates: bool = False) -> dict:
+    """Run corpus entries through the pipeline and return their summaries, keyed by name"""
+    # Read by the TTS stub inside the sandboxes, which inherit this environment
+    os.environ["BENCH_TTS_WAVEFORM"] = tts
+    os.environ.setdefault("R2_STORAGE_BUCKET_NAME", "benchmark")
+    os.environ.setdefault("R2_STORAGE_BASE_URL", f"file://{BENCH_DIR}/storage/benchmark")
+
+    # Have the fork server import this module too (as a script or via main.run_benchmark), so sandboxed scenes get the stubs
+    context = sandbox.get_sandbox_context()
+    context.set_forkserver_preload(["manim", "manim_voiceover", "manim_voiceover.services.elevenlabs", "main", __name__])
+    sandbox.start_sandbox_pool()
+
+    storage = LocalStorageClient(f"{BENCH_DIR}/storage")
+    results = {}
+    for name in scenes:
+        print(f"\n=== {name} ===")
+        runs = [run_scene(name, CORPUS[name], storage, warm_tts, profile, templates) for _ in range(repeat)]
+        results[name] = summarize(runs)
+        print(f"✓ {name}: {results[name]['total_seconds']}s, {results[name]['output_bytes']} bytes ({results[name]['route']} route)")
+
+    harness_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    print(f"\nHarness peak RSS: {harness_rss / (1024 * 1024):.0f} MB")
+    return results
+
+
+def run():
+    parser = argparse.ArgumentParser(description="Offline benchmark of the video generation pipeline")
+    parser.add_argument("--scenes", nargs="+", choices=sorted(CORPUS), default=sorted(CORPUS), help="Corpus entries to run")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per scene (best wall time is kept)")
+    parser.add_argument("--tts", choices=("sine", "silent"), default="sine", help="Stub TTS waveform")
+    parser.add_argument("--warm-tts", action="store_true", help="Keep the TTS cache between runs")
+    parser.add_argument("--profile", choices=sorted(config.RENDER_PROFILES), default=config.DEFAULT_RENDER_PROFILE, help="Render profile")
+    parser.add_argument("--templates", action="store_true", help="Route scenes a template matches through the template fast path")
+    parser.add_argument("--modal", action="store_true", help="Measure in the Modal image (main.run_benchmark) instead of on this machine")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Baseline JSON to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="Write the results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="Allowed regression as a fraction")
+    parser.add_argument("--output", default=f"{BENCH_DIR}/results.json", help="Where to write the results")
+    args = parser.parse_args()
+
+    options = {
+        "scenes": args.scenes,
+        "repeat": args.repeat,
+        "tts": args.tts,
+        "warm_tts": args.warm_tts,
+        "profile": args.profile,
+        "templates": args.templates,
+    }
+    if args.modal:
+        import modal
+
+        with modal.enable_output(), main.app.run():
+            report = main.run_benchmark.remote(options)
+    else:
+        report = {"environment": benchmark_environment("local"), "scenes": measure(**options)}
+
+    os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"✓ Results written to {args.output}")
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"✓ Baseline saved to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"⚠ No baseline at {args.baseline}: recording only, nothing compared (save one with --save-baseline)")
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline.get("environment") != report["environment"]:
+        # Timings from another machine or toolchain say nothing about this change
+        print("⚠ Baseline was measured in a different environment: recording only, nothing compared")
+        print(f"  baseline: {json.dumps(baseline.get('environment'), sort_keys=True)}")
+        print(f"  this run: {json.dumps(report['environment'], sort_keys=True)}")
+        return 0
+    regressions = compare_to_baseline(report["scenes"], baseline["scenes"], args.threshold)
+    if regressions:
+        print(f"\n✗ {len(regressions)} regression(s) beyond {args.threshold:.0%}: {', '.join(regressions)}")
+        return 1
+    print("\n✓ No regressions against the baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(run())
@@ -0,0 +1,617 @@
+"""Result cache, TTS cache, partial-movie render cache and segment store"""
+
+import modal
+from contextlib import contextmanager
+import hashlib
+import json
+import threading
+import time
+
+from config import DEFAULT_RENDER_PROFILE, PROMPT_VERSION, RENDER_PROFILES, RENDER_SETTINGS
+from prompts import segment_role
+from templates import TEMPLATE_VERSION, classify_course
+
+# Shared storage for per-block segments rendered in parallel containers
+segment_volume = modal.Volume.from_name("manim-segments", create_if_missing=True)
+SEGMENTS_DIR = "/segments"
+SEGMENT_STORE_DIR = f"{SEGMENTS_DIR}/blocks"  # Content-addressed segments reused when a course is edited
+SEGMENT_STORE_MAX_BYTES = 10 * 1024 * 1024 * 1024  # 10 GB, evicted least-recently-used first
+
+# Durable ElevenLabs audio cache shared by all containers, evicted least-recently-used first
+tts_cache_volume = modal.Volume.from_name("manim-tts-cache", create_if_missing=True)
+TTS_CACHE_DIR = "/cache/tts"
+TTS_CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024  # 2 GB
+TTS_CACHE_JSON = "cache.json"  # manim-voiceover's single-file index, migrated to TTS_INDEX_DIR on prune
+TTS_INDEX_DIR = "index"  # One file per cache entry, so containers never rewrite a shared index
+
+# Durable Manim caches shared by all containers: partial movie files (one per play() call) and compiled Tex/Text SVGs
+render_cache_volume = modal.Volume.from_name("manim-render-cache", create_if_missing=True)
+RENDER_CACHE_DIR = "/cache/manim"
+RENDER_CACHE_MAX_BYTES = 20 * 1024 * 1024 * 1024  # 20 GB
+RENDER_CACHE_COUNTERS = ("partial_hits", "partial_misses", "tex_hits", "tex_misses")
+
+# Persistent cache of finished videos, keyed by a hash of the course payload
+result_cache = modal.Dict.from_name("manim-result-cache", create_if_missing=True)
+RESULT_CACHE_TTL_SECONDS = 7 * 24 * 60 * 60  # 7 days
+
+
+def normalize_course_data(course_data: dict) -> dict:
+    """Normalize a course payload so cosmetic whitespace changes hash the same"""
+    return {
+        "title": " ".join(str(course_data.get("title", "Course")).split()),
+        "subject": " ".join(str(course_data.get("subject", "")).split()),
+        "blocks": [" ".join(str(block).split()) for block in course_data.get("blocks", [])],
+    }
+
+
+def result_cache_key(course_data: dict, render_mode: str = "single", output_format: str = "mp4", render_profile: str = DEFAULT_RENDER_PROFILE, use_templates: bool = False, upload_mode: str = "faststart") -> str:
+    """Content address of a course payload, prompt version and render settings"""
+    key_material = {
+        "course": normalize_course_data(course_data),
+        "prompt_version": PROMPT_VERSION,
+        "template_version": TEMPLATE_VERSION if use_templates else None,
+        "render_settings": {
+            **RENDER_SETTINGS,
+            "render_mode": render_mode,
+            "output_format": output_format,
+            "use_templates": use_templates,
+            "upload_mode": upload_mode,
+            "render_profile": {"name": render_profile, **RENDER_PROFILES[render_profile]},
+        },
+    }
+    encoded = json.dumps(key_material, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+
+def get_cached_result(cache_key: str):
+    """Return a cached result dict if present and not expired, evicting stale entries"""
+    try:
+        entry = result_cache.get(cache_key)
+    except Exception as e:
+        print(f"  ✗ Result cache lookup failed: {e}")
+        return None
+    
+    if not entry:
+        return None
+    
+    age = time.time() - entry.get("cached_at", 0)
+    if age > RESULT_CACHE_TTL_SECONDS:
+        print(f"  Result cache entry expired ({age:.0f}s old), evicting...")
+        try:
+            result_cache.pop(cache_key, None)
+        except Exception as e:
+            print(f"  ✗ Result cache eviction failed: {e}")
+        return None
+    
+    return entry
+
+
+def store_cached_result(cache_key: str, result: dict):
+    """Store a successful result in the persistent result cache"""
+    try:
+        result_cache[cache_key] = {
+            "result": result,
+            "cached_at": time.time(),
+        }
+        print(f"✓ Stored result in cache: {cache_key[:12]}...")
+    except Exception as e:
+        print(f"  ✗ Failed to store result in cache: {e}")
+
+
+def make_cached_speech_service(service_class, stats: dict):
+    """
+    Subclass a manim-voiceover speech service so it uses the shared TTS cache volume
+    
+    manim-voiceover already keys its cache by the input text and the full voice
+    config (voice_id + voice_settings + model), so only the location changes.
+    Hits, misses and the time spent producing speech are counted into stats.
+    """
+    import os
+    
+    class CachedSpeechService(service_class):
+        def __init__(self, *args, **kwargs):
+            kwargs["cache_dir"] = TTS_CACHE_DIR
+            super().__init__(*args, **kwargs)
+        
+        def generate_from_text(self, *args, **kwargs):
+            tts_start = time.time()
+            try:
+                return super().generate_from_text(*args, **kwargs)
+            finally:
+                stats["seconds"] += time.time() - tts_start
+        
+        def get_cached_result(self, input_data, cache_dir):
+            cached = read_tts_index_entry(str(cache_dir), input_data)
+            if cached is None:
+                stats["misses"] += 1
+                return None
+            
+            stats["hits"] += 1
+            # Refresh mtimes so LRU eviction keeps recently used audio
+            for audio in tts_entry_audio(cached):
+                os.utime(os.path.join(cache_dir, audio))
+            return cached
+    
+    CachedSpeechService.__name__ = service_class.__name__
+    CachedSpeechService.__qualname__ = service_class.__qualname__
+    return CachedSpeechService
+
+
+def tts_index_entry_path(cache_dir: str, input_data: dict) -> str:
+    """Index file of the TTS cache entry for input_data, named by a hash of it"""
+    import os
+    
+    digest = hashlib.sha256(json.dumps(input_data, sort_keys=True).encode("utf-8")).hexdigest()
+    return os.path.join(cache_dir, TTS_INDEX_DIR, f"{digest}.json")
+
+
+def tts_entry_audio(entry: dict) -> list:
+    """Audio files a TTS cache entry points to"""
+    return [entry[key] for key in ("original_audio", "final_audio") if entry.get(key)]
+
+
+def read_tts_index_entry(cache_dir: str, input_data: dict):
+    """The TTS cache entry for input_data, or None unless it and all of its audio are on disk"""
+    import os
+    
+    try:
+        with open(tts_index_entry_path(cache_dir, input_data)) as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return None
+    audio = tts_entry_audio(entry)
+    if not audio or not all(os.path.exists(os.path.join(cache_dir, name)) for name in audio):
+        return None
+    return entry
+
+
+def append_tts_index_entry(json_file, data: dict):
+    """
+    Replacement for manim-voiceover's append_to_json_file that writes one index file per entry
+    
+    Containers share the cache through a Volume, where a lock only serializes
+    one container and commits merge file by file, so a single index rewritten
+    by several containers loses entries. Each entry is renamed into place whole.
+    """
+    import os
+    
+    path = tts_index_entry_path(os.path.dirname(str(json_file)), data["input_data"])
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp_path, "w") as f:
+        json.dump(data, f)
+    os.replace(temp_path, path)
+
+
+def prune_tts_cache(max_bytes: int = TTS_CACHE_MAX_BYTES):
+    """
+    Evict least recently used audio until the cache fits in max_bytes
+    
+    An entry's index file is removed before its audio and lookups check the
+    audio exists, so no container ever serves an entry whose audio is gone.
+    """
+    import os
+    
+    index_dir = os.path.join(TTS_CACHE_DIR, TTS_INDEX_DIR)
+    os.makedirs(index_dir, exist_ok=True)
+    
+    # Move the entries of a single-file index left by an older deployment into index files
+    legacy_path = os.path.join(TTS_CACHE_DIR, TTS_CACHE_JSON)
+    if os.path.exists(legacy_path):
+        try:
+            with open(legacy_path) as f:
+                for entry in json.load(f):
+                    if entry.get("input_data") is not None:
+                        append_tts_index_entry(legacy_path, entry)
+            os.remove(legacy_path)
+        except (OSError, ValueError) as e:
+            print(f"  ✗ Failed to migrate the TTS cache index: {e}")
+    
+    index_files = {}  # Audio file -> index files of the entries pointing to it
+    for name in os.listdir(index_dir):
+        path = os.path.join(index_dir, name)
+        if not name.endswith(".json"):
+            continue  # A concurrent writer's temporary file
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            continue
+        for audio in tts_entry_audio(entry):
+            index_files.setdefault(audio, []).append(path)
+    
+    audio_files = []
+    for name in os.listdir(TTS_CACHE_DIR):
+        path = os.path.join(TTS_CACHE_DIR, name)
+        if not name.startswith(TTS_CACHE_JSON) and os.path.isfile(path):
+            stat = os.stat(path)
+            audio_files.append((stat.st_mtime, stat.st_size, name))
+    
+    total_bytes = sum(size for _, size, _ in audio_files)
+    evicted = 0
+    for _, size, name in sorted(audio_files):
+        if total_bytes <= max_bytes:
+            break
+        for path in index_files.pop(name, []):
+            if os.path.exists(path):
+                os.remove(path)
+        os.remove(os.path.join(TTS_CACHE_DIR, name))
+        total_bytes -= size
+        evicted += 1
+    
+    if evicted:
+        print(f"  Evicted {evicted} TTS cache file(s), {total_bytes / (1024 * 1024):.1f} MB remaining")
+
+
+# Jobs in this container currently using each shared cache volume, keyed by volume name
+_volume_users = {}
+_volume_users_lock = threading.Lock()
+VOLUME_RELOAD_ATTEMPTS = 5  # Reloads fail while another job has files open, so retry with backoff
+VOLUME_RELOAD_DELAY_SECONDS = 0.5
+
+
+def reload_volume(volume, name: str) -> bool:
+    """Reload a volume, retrying while it is busy; returns False (and logs) if every attempt failed"""
+    for attempt in range(VOLUME_RELOAD_ATTEMPTS):
+        try:
+            volume.reload()
+            return True
+        except Exception as e:
+            if attempt == VOLUME_RELOAD_ATTEMPTS - 1:
+                print(f"  ✗ Failed to reload {name} after {VOLUME_RELOAD_ATTEMPTS} attempts: {e}")
+                return False
+            time.sleep(VOLUME_RELOAD_DELAY_SECONDS * (2 ** attempt))
+
+
+@contextmanager
+def shared_volume_session(volume, name: str, prune):
+    """
+    Reload a shared cache volume when the first job in this container starts using it and commit on exit
+    
+    Reloading fails while files are open, so jobs that join a session already in
+    progress skip it, and pruning waits for the last job so it never evicts files
+    a concurrent job is still reading.
+    """
+    with _volume_users_lock:
+        if not _volume_users.get(name):
+            reload_volume(volume, name)
+        _volume_users[name] = _volume_users.get(name, 0) + 1
+    
+    try:
+        yield
+    finally:
+        with _volume_users_lock:
+            _volume_users[name] -= 1
+            try:
+                if not _volume_users[name]:
+                    prune()
+            except Exception as e:
+                print(f"  ✗ Failed to prune {name}: {e}")
+            finally:
+                try:
+                    volume.commit()
+                except Exception as e:
+                    print(f"  ✗ Failed to persist {name}: {e}")
+
+
+@contextmanager
+def persistent_tts_cache():
+    """
+    Sync the shared TTS cache volume around a render
+    
+    Sandboxed scenes read and write the cache directly (see make_cached_speech_service).
+    On exit the cache is pruned and committed so other containers see the new audio.
+    """
+    import os
+    
+    with shared_volume_session(tts_cache_volume, "TTS cache", prune_tts_cache):
+        os.makedirs(TTS_CACHE_DIR, exist_ok=True)
+        yield
+
+
+def route_voiceover_cache_index():
+    """
+    Route manim-voiceover's cache index appends through append_tts_index_entry (idempotent)
+    
+    The stock helper reads the shared index and rewrites it in place, so
+    concurrent writers lose entries and a reader can load a truncated file and
+    fail with a JSONDecodeError that would be fed back to Gemini as a code error.
+    """
+    import manim_voiceover.services.base as base_module
+    
+    # The helper was renamed between manim-voiceover releases
+    for name in ("append_voiceover_cache_entry", "append_to_json_file"):
+        if getattr(base_module, name, None) is not None:
+            setattr(base_module, name, append_tts_index_entry)
+
+
+def summarize_tts_prefetch(reports: list) -> dict:
+    """Combine prefetch reports from several candidates or segments"""
+    summary = {"lines": 0, "cached": 0, "synthesized": 0, "failed": 0, "skipped": 0, "wall_seconds": 0.0, "line_seconds": [], "overlap": None}
+    for report in reports:
+        for key in ("lines", "cached", "synthesized", "failed", "skipped"):
+            summary[key] += report[key]
+        summary["wall_seconds"] += report["wall_seconds"]
+        summary["line_seconds"].extend(report["line_seconds"])
+    summary["wall_seconds"] = round(summary["wall_seconds"], 3)
+    if summary["wall_seconds"] > 0:
+        summary["overlap"] = round(sum(summary["line_seconds"]) / summary["wall_seconds"], 2)
+    return summary
+
+
+def install_render_cache(stats: dict) -> str:
+    """
+    Point Manim's partial movie and Tex lookups at the shared render cache volume
+    
+    Call inside a sandbox subprocess once quality is configured. Manim names each
+    partial movie after a hash of the play() call (animations, mobjects, camera),
+    so a cached file is exactly what an identical call would render. Cached files
+    are symlinked into the scene's own partial movie directory on lookup, hits and
+    misses are counted into stats. Returns the shared partial movie directory.
+    """
+    import os
+    from manim import config
+    from manim.scene.scene_file_writer import SceneFileWriter
+    import manim.mobject.text.tex_mobject as tex_mobject
+    import manim.utils.tex_file_writing as tex_file_writing
+    
+    # Partial movies from one resolution/frame rate are useless at another
+    partial_dir = os.path.join(
+        RENDER_CACHE_DIR, "partial_movies", f"{config.pixel_width}x{config.pixel_height}@{int(config.frame_rate)}"
+    )
+    os.makedirs(partial_dir, exist_ok=True)
+    config.tex_dir = os.path.join(RENDER_CACHE_DIR, "tex")
+    config.text_dir = os.path.join(RENDER_CACHE_DIR, "texts")
+    # Eviction is by size across the whole volume (prune_render_cache), not Manim's per-scene file count
+    config.max_files_cached = -1
+    
+    original_is_already_cached = SceneFileWriter.is_already_cached
+    
+    def is_already_cached(self, hash_invocation):
+        if not hasattr(self, "partial_movie_directory"):
+            return original_is_already_cached(self, hash_invocation)
+        
+        filename = f"{hash_invocation}{config.movie_file_extension}"
+        local_path = os.path.join(self.partial_movie_directory, filename)
+        shared_path = os.path.join(partial_dir, filename)
+        if os.path.islink(local_path) and not os.path.exists(local_path):
+            os.remove(local_path)  # Evicted since it was linked
+        if os.path.exists(shared_path):
+            if not os.path.lexists(local_path):
+                os.symlink(shared_path, local_path)
+            os.utime(shared_path)
+        
+        cached = original_is_already_cached(self, hash_invocation)
+        stats["partial_hits" if cached else "partial_misses"] += 1
+        return cached
+    
+    SceneFileWriter.is_already_cached = is_already_cached
+    
+    # tex_to_svg_file returns early when the SVG exists, so a compile inside it means a miss
+    original_compile_tex = tex_file_writing.compile_tex
+    original_tex_to_svg_file = tex_file_writing.tex_to_svg_file
+    compiled = []
+    
+    def compile_tex(*args, **kwargs):
+        compiled.append(True)
+        return original_compile_tex(*args, **kwargs)
+    
+    def tex_to_svg_file(*args, **kwargs):
+        compiled.clear()
+        svg_file = original_tex_to_svg_file(*args, **kwargs)
+        stats["tex_misses" if compiled else "tex_hits"] += 1
+        os.utime(svg_file)
+        return svg_file
+    
+    tex_file_writing.compile_tex = compile_tex
+    tex_file_writing.tex_to_svg_file = tex_to_svg_file
+    tex_mobject.tex_to_svg_file = tex_to_svg_file
+    
+    return partial_dir
+
+
+def publish_partial_movies(partial_movie_directory: str, partial_dir: str) -> int:
+    """Copy partial movies rendered in this process into the shared cache, returns how many were new"""
+    import os
+    import shutil
+    
+    published = 0
+    for name in os.listdir(partial_movie_directory):
+        local_path = os.path.join(partial_movie_directory, name)
+        shared_path = os.path.join(partial_dir, name)
+        if os.path.islink(local_path) or not os.path.isfile(local_path) or not name.endswith(".mp4"):
+            continue
+        if os.path.exists(shared_path):
+            continue
+        # Write under a temporary name so concurrent renders never link a half-copied file
+        temp_path = f"{shared_path}.{os.getpid()}.tmp"
+        shutil.copyfile(local_path, temp_path)
+        os.replace(temp_path, shared_path)
+        published += 1
+    return published
+
+
+def summarize_render_cache(stats: dict) -> dict:
+    """Render cache counters plus hit rates per kind"""
+    summary = {counter: stats.get(counter, 0) for counter in RENDER_CACHE_COUNTERS}
+    for kind in ("partial", "tex"):
+        lookups = summary[f"{kind}_hits"] + summary[f"{kind}_misses"]
+        summary[f"{kind}_hit_rate"] = round(summary[f"{kind}_hits"] / lookups, 3) if lookups else None
+    return summary
+
+
+def prune_render_cache(max_bytes: int = RENDER_CACHE_MAX_BYTES):
+    """Evict least recently used partial movies and Tex files until the render cache fits in max_bytes"""
+    import os
+    
+    cached_files = []
+    for directory, _, names in os.walk(RENDER_CACHE_DIR):
+        for name in names:
+            path = os.path.join(directory, name)
+            stat = os.stat(path)
+            cached_files.append((stat.st_mtime, stat.st_size, path))
+    
+    total_bytes = sum(size for _, size, _ in cached_files)
+    evicted = 0
+    for _, size, path in sorted(cached_files):
+        if total_bytes <= max_bytes:
+            break
+        os.remove(path)
+        total_bytes -= size
+        evicted += 1
+    
+    if evicted:
+        print(f"  Evicted {evicted} render cache file(s), {total_bytes / (1024 * 1024):.1f} MB remaining")
+
+
+@contextmanager
+def persistent_render_cache():
+    """
+    Sync the shared Manim render cache volume around a render
+    
+    Sandboxed scenes look up and publish partial movies and Tex SVGs directly
+    (see install_render_cache). On exit the cache is pruned and committed so
+    later attempts in other containers and later jobs reuse them.
+    """
+    import os
+    
+    with shared_volume_session(render_cache_volume, "render cache", prune_render_cache):
+        os.makedirs(RENDER_CACHE_DIR, exist_ok=True)
+        yield
+
+
+def block_hashes(course_data: dict) -> list:
+    """Content hash of each normalized block, stored with results so an edited course can be diffed block by block"""
+    return [
+        hashlib.sha256(block.encode("utf-8")).hexdigest()[:16]
+        for block in normalize_course_data(course_data)["blocks"]
+    ]
+
+
+def segment_key(course_data: dict, index: int, use_voiceover: bool, render_profile: str = DEFAULT_RENDER_PROFILE, use_templates: bool = False) -> str:
+    """
+    Content address of one block's segment in a parallel render
+    
+    Covers the block, its position role and the render settings but not the
+    other blocks, so editing one block leaves every other segment reusable.
+    Adding or removing blocks only changes a segment through its role; the
+    length target drift and a recap that predates a middle-block edit are
+    accepted. Template scenes carry state across blocks (e.g. array contents),
+    so for those the whole template match is part of the key.
+    """
+    course = normalize_course_data(course_data)
+    total = len(course["blocks"])
+    role = segment_role(index, total)
+    template = classify_course(course["title"], course["subject"], course["blocks"]) if use_templates else None
+    key_material = {
+        "block": course["blocks"][index - 1],
+        "role": role,
+        # Only the first segment shows the title screen
+        "title": course["title"] if role in ("first", "only") else None,
+        "subject": course["subject"],
+        "template": {**template, "segment": [index, total]} if template else None,
+        "use_voiceover": use_voiceover,
+        "prompt_version": PROMPT_VERSION,
+        "template_version": TEMPLATE_VERSION if template else None,
+        "render_settings": {
+            **RENDER_SETTINGS,
+            "render_profile": {"name": render_profile, **RENDER_PROFILES[render_profile]},
+        },
+    }
+    encoded = json.dumps(key_material, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+
+def store_segment(key: str, video_path: str, metadata: dict) -> str:
+    """Publish a rendered segment under its content address; the metadata file marks it reusable"""
+    import os
+    import shutil
+    import uuid
+    
+    os.makedirs(SEGMENT_STORE_DIR, exist_ok=True)
+    segment_path = f"{SEGMENT_STORE_DIR}/{key}.mp4"
+    # Write then rename so a concurrent job never splices a half-copied file
+    partial_path = f"{segment_path}.{uuid.uuid4().hex[:8]}.partial"
+    shutil.copyfile(video_path, partial_path)
+    os.replace(partial_path, segment_path)
+    with open(f"{partial_path}.json", "w") as f:
+        json.dump(metadata, f)
+    os.replace(f"{partial_path}.json", f"{SEGMENT_STORE_DIR}/{key}.json")
+    return segment_path
+
+
+def load_stored_segment(key: str, index: int):
+    """Return a segment entry for a previously rendered segment, or None if there is none to reuse"""
+    import os
+    
+    segment_path = f"{SEGMENT_STORE_DIR}/{key}.mp4"
+    try:
+        with open(f"{SEGMENT_STORE_DIR}/{key}.json") as f:
+            metadata = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not os.path.exists(segment_path):
+        return None
+    # Refresh the mtime so LRU pruning keeps segments that are still being reused
+    os.utime(segment_path)
+    
+    # Nothing was generated or rendered for this segment in this job
+    return {
+        "index": index,
+        "segment_path": segment_path,
+        "segment_key": key,
+        "reused": True,
+        "route": "reused",
+        "template": None,
+        "has_voiceover": metadata["has_voiceover"],
+        "rendered_at": metadata.get("rendered_at"),
+        "attempts_used": 0,
+        "warnings": [],
+        "tts_cache": {"hits": 0, "misses": 0, "seconds": 0.0},
+        "render_cache": {counter: 0 for counter in RENDER_CACHE_COUNTERS},
+        "tts_prefetch": summarize_tts_prefetch([]),
+        "timings": {"static_check_seconds": 0.0, "dry_run_seconds": 0.0, "render_seconds": 0.0},
+        "error_history": [],
+        "spans": [],
+        "voiceover_fallbacks": 0,
+        "auto_repairs": {"attempts_saved": 0, "repairs": []},
+        "few_shot_examples": [],
+        "container": None,
+    }
+
+
+def prune_segment_store(max_bytes: int = SEGMENT_STORE_MAX_BYTES):
+    """
+    Evict least recently used segments until the segment store fits in max_bytes
+    
+    A segment's .mp4, .json and leftover .partial files are evicted together;
+    voiceover-fallback copies ({key}-{workspace}.mp4) are never reused, so they
+    age out on their own.
+    """
+    import os
+    
+    if not os.path.isdir(SEGMENT_STORE_DIR):
+        return
+    entries = {}
+    for name in os.listdir(SEGMENT_STORE_DIR):
+        path = os.path.join(SEGMENT_STORE_DIR, name)
+        if not os.path.isfile(path):
+            continue
+        stat = os.stat(path)
+        entry = entries.setdefault(name.split(".")[0], {"mtime": 0, "size": 0, "paths": []})
+        entry["mtime"] = max(entry["mtime"], stat.st_mtime)
+        entry["size"] += stat.st_size
+        entry["paths"].append(path)
+    
+    total_bytes = sum(entry["size"] for entry in entries.values())
+    evicted = 0
+    for entry in sorted(entries.values(), key=lambda entry: entry["mtime"]):
+        if total_bytes <= max_bytes:
+            break
+        for path in entry["paths"]:
+            os.remove(path)
+        total_bytes -= entry["size"]
+        evicted += 1
+    
+    if evicted:
+        print(f"  Evicted {evicted} stored segment(s), {total_bytes / (1024 * 1024):.1f} MB remaining")
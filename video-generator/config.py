@@ -0,0 +1,42 @@
+"""Render, output and model settings shared by the generator modules"""
+
+# Bump whenever the prompts or the generation pipeline change in a way that
+# should invalidate previously rendered videos
+PROMPT_VERSION = "2026-10-18"
+GEMINI_MODEL = "gemini-2.5-pro"
+
+MEDIA_DIR = "/tmp/manim"  # Default media dir for direct (workspace-less) calls such as the benchmark
+
+# Per-job scratch directories (Manim media, generated code, upload state) so concurrent jobs never collide
+WORKSPACE_ROOT = "/tmp/jobs"
+WORKSPACE_MAX_AGE_SECONDS = 6 * 60 * 60  # Workspaces left behind by crashed jobs are removed after this
+
+GENERATED_CODE_FILENAME = "<course_scene>"  # Shows up in tracebacks from generated code
+
+# Render settings that affect the output video (part of the result cache key)
+RENDER_SETTINGS = {
+    "gemini_model": GEMINI_MODEL,
+}
+
+# Manim resolution and frame rate. Manim 0.19 always encodes partial movies as libx264 at
+# crf 23; the final movie, concatenated segments and HLS are stream copies of those, so
+# resolution and frame rate are what a profile trades for speed.
+RENDER_PROFILES = {
+    "draft": {"pixel_width": 854, "pixel_height": 480, "frame_rate": 15},
+    "mobile": {"pixel_width": 1280, "pixel_height": 720, "frame_rate": 30},
+    "standard": {"pixel_width": 1920, "pixel_height": 1080, "frame_rate": 60},
+    "hq": {"pixel_width": 2560, "pixel_height": 1440, "frame_rate": 60},
+}
+DEFAULT_RENDER_PROFILE = "standard"
+UPGRADE_RENDER_PROFILE = "hq"  # Target of the optional background re-render after a quick draft
+
+# "single" renders the whole course as one scene, "parallel" renders one scene per block concurrently
+RENDER_MODES = ("single", "parallel")
+
+# Output formats: a single MP4, or that plus an fMP4 HLS playlist published segment by segment.
+# HLS needs render_mode "parallel": a single-mode render has no segment to publish until it has finished.
+OUTPUT_FORMATS = ("mp4", "hls")
+# How the MP4 reaches R2: streamed while the encoder writes it (moov atom left at the end),
+# or remuxed with +faststart after the render and then uploaded. stream_upload picks the first.
+UPLOAD_MODES = ("stream", "faststart")
+HLS_SEGMENT_SECONDS = 4
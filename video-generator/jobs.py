@@ -0,0 +1,342 @@
+"""Job records, progress events, in-flight claims and Prometheus metrics"""
+
+import modal
+from contextlib import contextmanager
+import copy
+import hashlib
+import json
+import threading
+import time
+
+from config import PROMPT_VERSION
+from prompts import MANIM_DOCS_SUBJECT_MODULES
+from cache import RENDER_CACHE_COUNTERS, normalize_course_data
+
+# Status records for asynchronous /generate jobs, keyed by job id
+job_store = modal.Dict.from_name("manim-jobs", create_if_missing=True)
+JOB_TERMINAL_STATUSES = ("succeeded", "failed", "cancelled")
+
+# Progress events of running jobs, keyed "{job_id}:{seq}" and streamed by GET /jobs/{job_id}/events;
+# only the final event of a finished job is kept (see JobEvents.close)
+job_events = modal.Dict.from_name("manim-job-events", create_if_missing=True)
+JOB_EVENT_FINAL_STAGES = ("done", "failed")
+JOB_EVENT_POLL_SECONDS = 0.5  # How often the SSE stream looks for the next event
+JOB_EVENT_STATUS_SECONDS = 5  # How often it checks whether the job ended without a final event
+JOB_EVENT_KEEPALIVE_SECONDS = 15
+
+# Claims on in-flight /generate payloads, keyed by payload hash, so identical requests share one job
+inflight_store = modal.Dict.from_name("manim-inflight", create_if_missing=True)
+INFLIGHT_TTL_SECONDS = 60 * 60  # Claims older than this are treated as abandoned
+INFLIGHT_JOIN_SECONDS = 10  # How long to wait for a fresh claim's owner to spawn its worker
+
+# Per-container metric shards, summed by the /metrics endpoint
+metrics_store = modal.Dict.from_name("manim-metrics", create_if_missing=True)
+METRICS_SHARD_TTL_SECONDS = 24 * 60 * 60  # Shards not republished for this long are dropped with their container
+METRICS_BUCKETS = (0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 900)
+
+
+def inflight_key(course_data: dict, options: dict) -> str:
+    """Hash of a normalized /generate payload and its options, used to coalesce identical in-flight requests"""
+    key_material = {
+        "course": normalize_course_data(course_data),
+        "prompt_version": PROMPT_VERSION,
+        "options": options,
+    }
+    encoded = json.dumps(key_material, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+
+def waiter_prefix(key: str, job_id: str) -> str:
+    """Prefix of the keys counting the coalesced requests that joined job_id's claim on key"""
+    return f"{key}:waiter:{job_id}:"
+
+
+def takeover_key(key: str, job_id: str) -> str:
+    """Marker created by the one request allowed to replace job_id's stale claim on key"""
+    return f"{key}:takeover:{job_id}"
+
+
+async def take_over_claim(store, key: str, stale: dict, claim: dict) -> bool:
+    """
+    Replace the stale claim on key with claim, returning False if another request got there first
+    
+    Modal Dicts have no compare-and-swap, so contenders race to create a marker
+    named after the stale claim with skip_if_exists and only its creator
+    overwrites the claim. The marker is dropped when the new claim is released
+    or itself taken over, long after any contender that saw the stale claim.
+    """
+    if not await store.put.aio(takeover_key(key, stale["job_id"]), claim["job_id"], skip_if_exists=True):
+        return False
+    if stale.get("took_over"):
+        await store.pop.aio(takeover_key(key, stale["took_over"]), None)
+    await store.put.aio(key, {**claim, "took_over": stale["job_id"]})
+    return True
+
+
+def release_inflight_claim(job_id: str):
+    """Drop the coalescing claim and waiters of a finished job so later identical requests start fresh"""
+    if not job_id:
+        return
+    try:
+        key = (job_store.get(job_id) or {}).get("inflight_key")
+        if not key:
+            return
+        claim = inflight_store.get(key) or {}
+        if claim.get("job_id") == job_id:
+            inflight_store.pop(key)
+            if claim.get("took_over"):
+                inflight_store.pop(takeover_key(key, claim["took_over"]), None)
+        for waiter in [k for k in inflight_store.keys() if k.startswith(waiter_prefix(key, job_id))]:
+            inflight_store.pop(waiter, None)
+    except Exception as e:
+        print(f"  ✗ Failed to release in-flight claim for job {job_id}: {e}")
+
+
+def update_job(job_id: str, **fields):
+    """Merge fields into a job record (no-op for direct, job-less invocations)"""
+    if not job_id:
+        return
+    try:
+        job = job_store.get(job_id) or {"job_id": job_id}
+        job.update(fields)
+        job["updated_at"] = time.time()
+        job_store[job_id] = job
+    except Exception as e:
+        print(f"  ✗ Failed to update job {job_id}: {e}")
+
+
+class JobEvents:
+    """
+    Ordered progress events of one job, written to job_events by a background thread
+    
+    publish() only queues the event, so the pipeline never waits on the Dict.
+    Each event gets the next sequence number, which the SSE stream uses as its
+    event id. A no-op for direct, job-less invocations.
+    """
+    
+    def __init__(self, job_id: str = None):
+        import queue
+        
+        self.job_id = job_id
+        self.seq = 0
+        self.last_stage = None
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+    
+    def publish(self, stage: str, **fields):
+        if not self.job_id:
+            return
+        with self._lock:
+            self._queue.put({"seq": self.seq, "stage": stage, "at": round(time.time(), 3), **fields})
+            self.seq += 1
+            self.last_stage = stage
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._write_events, daemon=True)
+                self._thread.start()
+    
+    def _write_events(self):
+        while True:
+            event = self._queue.get()
+            if event is None:
+                return
+            try:
+                job_events[f"{self.job_id}:{event['seq']}"] = event
+            except Exception as e:
+                print(f"  ✗ Failed to publish {event['stage']} event for job {self.job_id}: {e}")
+    
+    def close(self):
+        """Write out every queued event, stop the writer thread and trim the events of a finished job"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+            if thread:
+                self._queue.put(None)
+        if thread:
+            thread.join(timeout=30)
+            if self.last_stage in JOB_EVENT_FINAL_STAGES:
+                self._trim()
+    
+    def _trim(self):
+        """Drop every event but the final one, which streams opened later skip ahead to (final_event_seq)"""
+        final_seq = self.seq - 1
+        update_job(self.job_id, final_event_seq=final_seq)
+        try:
+            for seq in range(final_seq):
+                job_events.pop(f"{self.job_id}:{seq}", None)
+        except Exception as e:
+            print(f"  ✗ Failed to trim events of job {self.job_id}: {e}")
+
+
+@contextmanager
+def stage_span(spans: list, stage: str, **attributes):
+    """Time a pipeline stage and append it to spans, marking it with the error type if it raises"""
+    span = {"stage": stage, "start": round(time.time(), 3), **attributes}
+    stage_start = time.time()
+    try:
+        yield span
+    except BaseException as e:
+        span["error_type"] = getattr(e, "error_type", type(e).__name__)
+        raise
+    finally:
+        span["seconds"] = round(time.time() - stage_start, 3)
+        spans.append(span)
+
+
+# Cumulative metrics of this container: {"counters"|"histograms": {name: {label string: value}}}
+_metrics = {"counters": {}, "histograms": {}}
+_metrics_lock = threading.Lock()  # Jobs running concurrently in one container share the shard
+
+
+def metric_labels(**labels) -> str:
+    """Render labels in Prometheus exposition syntax, escaping backslash, double quote and newline in values"""
+    def escape(value):
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    
+    return ",".join(f'{name}="{escape(value)}"' for name, value in sorted(labels.items()))
+
+
+def increment_counter(name: str, value: float = 1, **labels):
+    with _metrics_lock:
+        series = _metrics["counters"].setdefault(name, {})
+        key = metric_labels(**labels)
+        series[key] = series.get(key, 0) + value
+
+
+def observe_histogram(name: str, value: float, **labels):
+    with _metrics_lock:
+        series = _metrics["histograms"].setdefault(name, {})
+        histogram = series.setdefault(metric_labels(**labels), {"buckets": [0] * len(METRICS_BUCKETS), "sum": 0.0, "count": 0})
+        for i, bound in enumerate(METRICS_BUCKETS):
+            if value <= bound:
+                histogram["buckets"][i] += 1
+        histogram["sum"] += value
+        histogram["count"] += 1
+
+
+def metrics_shard() -> dict:
+    """Copy of this container's metrics stamped with last_seen, to publish as its shard"""
+    with _metrics_lock:
+        shard = copy.deepcopy(_metrics)
+    shard["last_seen"] = time.time()
+    return shard
+
+
+def subject_bucket(subject: str) -> str:
+    """
+    Map a free-form course subject to a bounded metric label
+    
+    Uses the first keyword of the MANIM_DOCS_SUBJECT_MODULES group it matches
+    (e.g. "math", "physic"), or "other".
+    """
+    subject = (subject or "").lower()
+    for keywords in MANIM_DOCS_SUBJECT_MODULES:
+        if any(keyword in subject for keyword in keywords):
+            return keywords[0]
+    return "other"
+
+
+def record_job_metrics(status: str, seconds: float, result: dict = None, error_history: list = None):
+    """Fold a finished job into this container's metrics and publish them as its shard"""
+    import os
+    
+    result = result or {}
+    cache = result.get("cache", "none")
+    increment_counter("video_jobs_total", status=status, cache=cache)
+    observe_histogram("video_job_seconds", seconds, status=status, cache=cache)
+    
+    # Cache hits replay the stored result, so its retries and stage work were already counted
+    if cache != "hit":
+        for error in result.get("error_history", error_history) or []:
+            increment_counter("video_retries_total", error_type=error["error_type"])
+        
+        for span in result.get("spans", []):
+            observe_histogram("video_stage_seconds", span["seconds"], stage=span["stage"])
+            if span["stage"] == "gemini":
+                for kind in ("prompt", "cached", "completion"):
+                    increment_counter("video_gemini_tokens_total", span.get(f"{kind}_tokens", 0), kind=kind)
+        
+        if result.get("voiceover_fallbacks"):
+            increment_counter("video_voiceover_fallbacks_total", result["voiceover_fallbacks"])
+        
+        # Average attempts per subject = attempts_used_total / generations_total
+        if "attempts_used" in result:
+            subject = subject_bucket(str(result.get("subject") or ""))
+            few_shot = "true" if result.get("few_shot_examples") else "false"
+            increment_counter("video_generations_total", subject=subject, few_shot=few_shot)
+            increment_counter("video_attempts_used_total", result["attempts_used"], subject=subject, few_shot=few_shot)
+        
+        if result.get("auto_repairs"):
+            increment_counter("video_attempts_saved_by_repair_total", result["auto_repairs"]["attempts_saved"])
+        
+        # Template hit rate = route="template" / all scenes; parallel renders route each segment separately
+        # and segments spliced in unchanged from an earlier render count as route="reused"
+        for scene in result.get("segments") or [result]:
+            if scene.get("route"):
+                increment_counter("video_scene_routes_total", route=scene["route"], template=scene.get("template") or "none")
+        if result.get("route"):
+            observe_histogram("video_route_seconds", seconds, status=status, route=result["route"])
+        
+        for counter in ("hits", "misses"):
+            increment_counter("video_tts_cache_total", result.get("tts_cache", {}).get(counter, 0), result=counter)
+        
+        prefetch = result.get("tts_prefetch", {})
+        for outcome in ("cached", "synthesized", "failed", "skipped"):
+            increment_counter("video_tts_prefetch_lines_total", prefetch.get(outcome, 0), result=outcome)
+        for seconds in prefetch.get("line_seconds", []):
+            observe_histogram("video_tts_line_seconds", seconds)
+        
+        # Hit rate per kind = hit / (hit + miss)
+        for counter in RENDER_CACHE_COUNTERS:
+            kind, outcome = counter.split("_")
+            increment_counter("video_render_cache_total", result.get("render_cache", {}).get(counter, 0), kind=kind, result="hit" if outcome == "hits" else "miss")
+    
+    # One writer per shard, so no read-modify-write races between containers
+    try:
+        metrics_store[os.environ.get("MODAL_TASK_ID", "local")] = metrics_shard()
+    except Exception as e:
+        print(f"  ✗ Failed to publish metrics: {e}")
+
+
+def render_prometheus_metrics(shards: list, gauges: dict = None) -> str:
+    """
+    Sum metric shards from all containers into the Prometheus text exposition format
+    
+    gauges are point-in-time values ({name: {labels: value}}) read live by the
+    caller, since a shard can outlive the container that published it.
+    """
+    counters = {}
+    histograms = {}
+    for shard in shards:
+        for name, series in shard.get("counters", {}).items():
+            for labels, value in series.items():
+                counters.setdefault(name, {})
+                counters[name][labels] = counters[name].get(labels, 0) + value
+        for name, series in shard.get("histograms", {}).items():
+            for labels, histogram in series.items():
+                total = histograms.setdefault(name, {}).setdefault(
+                    labels, {"buckets": [0] * len(METRICS_BUCKETS), "sum": 0.0, "count": 0}
+                )
+                total["buckets"] = [a + b for a, b in zip(total["buckets"], histogram["buckets"])]
+                total["sum"] += histogram["sum"]
+                total["count"] += histogram["count"]
+    
+    lines = []
+    for name, series in sorted(counters.items()):
+        lines.append(f"# TYPE {name} counter")
+        for labels, value in sorted(series.items()):
+            lines.append(f"{name}{{{labels}}} {value}" if labels else f"{name} {value}")
+    for name, series in sorted(histograms.items()):
+        lines.append(f"# TYPE {name} histogram")
+        for labels, histogram in sorted(series.items()):
+            prefix = f"{labels}," if labels else ""
+            for bound, count in zip(METRICS_BUCKETS, histogram["buckets"]):
+                lines.append(f'{name}_bucket{{{prefix}le="{bound}"}} {count}')
+            lines.append(f'{name}_bucket{{{prefix}le="+Inf"}} {histogram["count"]}')
+            suffix = f"{{{labels}}}" if labels else ""
+            lines.append(f"{name}_sum{suffix} {round(histogram['sum'], 3)}")
+            lines.append(f"{name}_count{suffix} {histogram['count']}")
+    for name, series in sorted((gauges or {}).items()):
+        lines.append(f"# TYPE {name} gauge")
+        for labels, value in sorted(series.items()):
+            lines.append(f"{name}{{{labels}}} {value}" if labels else f"{name} {value}")
+    return "\n".join(lines) + "\n"
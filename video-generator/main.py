@@ -1,6 +1,33 @@
 import modal
+from contextlib import contextmanager
 from datetime import datetime
+import hashlib
+import json
+import threading
 import time
+import uuid
+
+from config import (
+    DEFAULT_RENDER_PROFILE, GEMINI_MODEL, MEDIA_DIR, OUTPUT_FORMATS, PROMPT_VERSION, RENDER_MODES,
+    RENDER_PROFILES, UPGRADE_RENDER_PROFILE, WORKSPACE_MAX_AGE_SECONDS, WORKSPACE_ROOT,
+)
+from prompts import SYSTEM_PROMPT, SYSTEM_PROMPT_NO_VOICEOVER, segment_instructions, trim_manim_docs
+from templates import classify_course, render_scene_template
+from cache import (
+    RENDER_CACHE_COUNTERS, RENDER_CACHE_DIR, SEGMENT_STORE_DIR, SEGMENTS_DIR, TTS_CACHE_DIR,
+    block_hashes, get_cached_result, load_stored_segment, route_voiceover_cache_index,
+    make_cached_speech_service, persistent_render_cache, persistent_tts_cache, prune_segment_store,
+    reload_volume, render_cache_volume, result_cache_key, segment_key, segment_volume,
+    shared_volume_session, store_cached_result, store_segment, summarize_render_cache,
+    summarize_tts_prefetch, tts_cache_volume,
+)
+from jobs import JobEvents, record_job_metrics, release_inflight_claim, stage_span, update_job
+from sandbox import (
+    DRY_RUN_LIMITS, RENDER_LIMITS, CandidateCancelled, ResourceLimitExceeded, SceneExecutionError,
+    render_output_path, run_scene_in_sandbox, start_sandbox_pool,
+)
+from upload import HlsPublisher, create_r2_client, upload_to_r2
+from web import BATCH_TIMEOUT_SECONDS, create_web_app
 
 # Create a Modal app
 app = modal.App("manim-course-generator")
@@ -17,407 +44,322 @@ image = (
         "sox",
     )
     .pip_install(
-        "manim", 
-        "manim-voiceover[elevenlabs,transcribe]",
+        # Pinned: the sandbox patches SceneFileWriter, CairoRenderer and tex_file_writing internals of this release
+        "manim==0.19.0",
+        "manim-voiceover[elevenlabs,transcribe]==0.3.4.post1",
         "boto3",
         "fastapi[standard]",
         "google-generativeai",
     )
+    .add_local_python_source("config", "prompts", "templates", "cache", "jobs", "sandbox", "upload", "web")
 )
 
-manimDocs = """
-## Manim Index Documentation
+# Mobjects that load external files and always fail in generated code
+FORBIDDEN_MOBJECTS = ("SVGMobject", "ImageMobject")
 
-This reference list details modules, functions, and variables included in Manim, describing what they are and what they do.
+# Built-in primitives that stand in for forbidden mobjects during auto-repair
+FORBIDDEN_MOBJECT_REPLACEMENTS = {
+    "SVGMobject": "Square(side_length=2)",
+    "ImageMobject": "Rectangle(width=3, height=2)",
+}
 
-- [Animations](reference_index/animations.html)
-  - [animation](reference/manim.animation.animation.html)
-    - [Animation](reference/manim.animation.animation.Animation.html)
-    - [Wait](reference/manim.animation.animation.Wait.html)
-    - [override_animation()](reference/manim.animation.animation.html#manim.animation.animation.override_animation)
-    - [prepare_animation()](reference/manim.animation.animation.html#manim.animation.animation.prepare_animation)
-  - [changing](reference/manim.animation.changing.html)
-    - [AnimatedBoundary](reference/manim.animation.changing.AnimatedBoundary.html)
-    - [TracedPath](reference/manim.animation.changing.TracedPath.html)
-  - [composition](reference/manim.animation.composition.html)
-    - [AnimationGroup](reference/manim.animation.composition.AnimationGroup.html)
-    - [LaggedStart](reference/manim.animation.composition.LaggedStart.html)
-    - [LaggedStartMap](reference/manim.animation.composition.LaggedStartMap.html)
-    - [Succession](reference/manim.animation.composition.Succession.html)
-  - [creation](reference/manim.animation.creation.html)
-    - [AddTextLetterByLetter](reference/manim.animation.creation.AddTextLetterByLetter.html)
-    - [AddTextWordByWord](reference/manim.animation.creation.AddTextWordByWord.html)
-    - [Create](reference/manim.animation.creation.Create.html)
-    - [DrawBorderThenFill](reference/manim.animation.creation.DrawBorderThenFill.html)
-    - [RemoveTextLetterByLetter](reference/manim.animation.creation.RemoveTextLetterByLetter.html)
-    - [ShowIncreasingSubsets](reference/manim.animation.creation.ShowIncreasingSubsets.html)
-    - [ShowPartial](reference/manim.animation.creation.ShowPartial.html)
-    - [ShowSubmobjectsOneByOne](reference/manim.animation.creation.ShowSubmobjectsOneByOne.html)
-    - [SpiralIn](reference/manim.animation.creation.SpiralIn.html)
-    - [Uncreate](reference/manim.animation.creation.Uncreate.html)
-    - [Unwrite](reference/manim.animation.creation.Unwrite.html)
-    - [Write](reference/manim.animation.creation.Write.html)
-  - [fading](reference/manim.animation.fading.html)
-    - [FadeIn](reference/manim.animation.fading.FadeIn.html)
-    - [FadeOut](reference/manim.animation.fading.FadeOut.html)
-  - [growing](reference/manim.animation.growing.html)
-    - [GrowArrow](reference/manim.animation.growing.GrowArrow.html)
-    - [GrowFromCenter](reference/manim.animation.growing.GrowFromCenter.html)
-    - [GrowFromEdge](reference/manim.animation.growing.GrowFromEdge.html)
-    - [GrowFromPoint](reference/manim.animation.growing.GrowFromPoint.html)
-    - [SpinInFromNothing](reference/manim.animation.growing.SpinInFromNothing.html)
-  - [indication](reference/manim.animation.indication.html)
-    - [ApplyWave](reference/manim.animation.indication.ApplyWave.html)
-    - [Circumscribe](reference/manim.animation.indication.Circumscribe.html)
-    - [Flash](reference/manim.animation.indication.Flash.html)
-    - [FocusOn](reference/manim.animation.indication.FocusOn.html)
-    - [Indicate](reference/manim.animation.indication.Indicate.html)
-    - [ShowPassingFlash](reference/manim.animation.indication.ShowPassingFlash.html)
-    - [ShowPassingFlashWithThinningStrokeWidth](reference/manim.animation.indication.ShowPassingFlashWithThinningStrokeWidth.html)
-    - [Wiggle](reference/manim.animation.indication.Wiggle.html)
-  - [movement](reference/manim.animation.movement.html)
-    - [ComplexHomotopy](reference/manim.animation.movement.ComplexHomotopy.html)
-    - [Homotopy](reference/manim.animation.movement.Homotopy.html)
-    - [MoveAlongPath](reference/manim.animation.movement.MoveAlongPath.html)
-    - [PhaseFlow](reference/manim.animation.movement.PhaseFlow.html)
-    - [SmoothedVectorizedHomotopy](reference/manim.animation.movement.SmoothedVectorizedHomotopy.html)
-  - [numbers](reference/manim.animation.numbers.html)
-    - [ChangeDecimalToValue](reference/manim.animation.numbers.ChangeDecimalToValue.html)
-    - [ChangingDecimal](reference/manim.animation.numbers.ChangingDecimal.html)
-  - [rotation](reference/manim.animation.rotation.html)
-    - [Rotate](reference/manim.animation.rotation.Rotate.html)
-    - [Rotating](reference/manim.animation.rotation.Rotating.html)
-  - [specialized](reference/manim.animation.specialized.html)
-    - [Broadcast](reference/manim.animation.specialized.Broadcast.html)
-  - [speedmodifier](reference/manim.animation.speedmodifier.html)
-    - [ChangeSpeed](reference/manim.animation.speedmodifier.ChangeSpeed.html)
-  - [transform](reference/manim.animation.transform.html)
-    - [ApplyComplexFunction](reference/manim.animation.transform.ApplyComplexFunction.html)
-    - [ApplyFunction](reference/manim.animation.transform.ApplyFunction.html)
-    - [ApplyMatrix](reference/manim.animation.transform.ApplyMatrix.html)
-    - [ApplyMethod](reference/manim.animation.transform.ApplyMethod.html)
-    - [ApplyPointwiseFunction](reference/manim.animation.transform.ApplyPointwiseFunction.html)
-    - [ApplyPointwiseFunctionToCenter](reference/manim.animation.transform.ApplyPointwiseFunctionToCenter.html)
-    - [ClockwiseTransform](reference/manim.animation.transform.ClockwiseTransform.html)
-    - [CounterclockwiseTransform](reference/manim.animation.transform.CounterclockwiseTransform.html)
-    - [CyclicReplace](reference/manim.animation.transform.CyclicReplace.html)
-    - [FadeToColor](reference/manim.animation.transform.FadeToColor.html)
-    - [FadeTransform](reference/manim.animation.transform.FadeTransform.html)
-    - [FadeTransformPieces](reference/manim.animation.transform.FadeTransformPieces.html)
-    - [MoveToTarget](reference/manim.animation.transform.MoveToTarget.html)
-    - [ReplacementTransform](reference/manim.animation.transform.ReplacementTransform.html)
-    - [Restore](reference/manim.animation.transform.Restore.html)
-    - [ScaleInPlace](reference/manim.animation.transform.ScaleInPlace.html)
-    - [ShrinkToCenter](reference/manim.animation.transform.ShrinkToCenter.html)
-    - [Swap](reference/manim.animation.transform.Swap.html)
-    - [Transform](reference/manim.animation.transform.Transform.html)
-    - [TransformAnimations](reference/manim.animation.transform.TransformAnimations.html)
-    - [TransformFromCopy](reference/manim.animation.transform.TransformFromCopy.html)
-  - [transform_matching_parts](reference/manim.animation.transform_matching_parts.html)
-    - [TransformMatchingAbstractBase](reference/manim.animation.transform_matching_parts.TransformMatchingAbstractBase.html)
-    - [TransformMatchingShapes](reference/manim.animation.transform_matching_parts.TransformMatchingShapes.html)
-    - [TransformMatchingTex](reference/manim.animation.transform_matching_parts.TransformMatchingTex.html)
-  - [updaters](reference/manim.animation.updaters.html)
-    - [Modules](reference/manim.animation.updaters.html#modules)
-- [Cameras](reference_index/cameras.html)
-  - [camera](reference/manim.camera.camera.html)
-    - [BackgroundColoredVMobjectDisplayer](reference/manim.camera.camera.BackgroundColoredVMobjectDisplayer.html)
-    - [Camera](reference/manim.camera.camera.Camera.html)
-  - [mapping_camera](reference/manim.camera.mapping_camera.html)
-    - [MappingCamera](reference/manim.camera.mapping_camera.MappingCamera.html)
-    - [OldMultiCamera](reference/manim.camera.mapping_camera.OldMultiCamera.html)
-    - [SplitScreenCamera](reference/manim.camera.mapping_camera.SplitScreenCamera.html)
-  - [moving_camera](reference/manim.camera.moving_camera.html)
-    - [MovingCamera](reference/manim.camera.moving_camera.MovingCamera.html)
-  - [multi_camera](reference/manim.camera.multi_camera.html)
-    - [MultiCamera](reference/manim.camera.multi_camera.MultiCamera.html)
-  - [three_d_camera](reference/manim.camera.three_d_camera.html)
-    - [ThreeDCamera](reference/manim.camera.three_d_camera.ThreeDCamera.html)
-- [Configuration](reference_index/configuration.html)
-  - [Module Index](reference_index/configuration.html#module-index)
-    - [\_config](reference/manim._config.html)
-    - [utils](reference/manim._config.utils.html)
-    - [logger_utils](reference/manim._config.logger_utils.html)
-- [Mobjects](reference_index/mobjects.html)
-  - [frame](reference/manim.mobject.frame.html)
-    - [FullScreenRectangle](reference/manim.mobject.frame.FullScreenRectangle.html)
-    - [ScreenRectangle](reference/manim.mobject.frame.ScreenRectangle.html)
-  - [geometry](reference/manim.mobject.geometry.html)
-    - [Modules](reference/manim.mobject.geometry.html#modules)
-  - [graph](reference/manim.mobject.graph.html)
-    - [NxGraph](reference/manim.mobject.graph.html#manim.mobject.graph.NxGraph)
-    - [DiGraph](reference/manim.mobject.graph.DiGraph.html)
-    - [GenericGraph](reference/manim.mobject.graph.GenericGraph.html)
-    - [Graph](reference/manim.mobject.graph.Graph.html)
-    - [LayoutFunction](reference/manim.mobject.graph.LayoutFunction.html)
-  - [graphing](reference/manim.mobject.graphing.html)
-    - [Modules](reference/manim.mobject.graphing.html#modules)
-  - [logo](reference/manim.mobject.logo.html)
-    - [ManimBanner](reference/manim.mobject.logo.ManimBanner.html)
-  - [matrix](reference/manim.mobject.matrix.html)
-    - [DecimalMatrix](reference/manim.mobject.matrix.DecimalMatrix.html)
-    - [IntegerMatrix](reference/manim.mobject.matrix.IntegerMatrix.html)
-    - [Matrix](reference/manim.mobject.matrix.Matrix.html)
-    - [MobjectMatrix](reference/manim.mobject.matrix.MobjectMatrix.html)
-    - [get_det_text()](reference/manim.mobject.matrix.html#manim.mobject.matrix.get_det_text)
-    - [matrix_to_mobject()](reference/manim.mobject.matrix.html#manim.mobject.matrix.matrix_to_mobject)
-    - [matrix_to_tex_string()](reference/manim.mobject.matrix.html#manim.mobject.matrix.matrix_to_tex_string)
-  - [mobject](reference/manim.mobject.mobject.html)
-    - [TimeBasedUpdater](reference/manim.mobject.mobject.html#manim.mobject.mobject.TimeBasedUpdater)
-    - [NonTimeBasedUpdater](reference/manim.mobject.mobject.html#manim.mobject.mobject.NonTimeBasedUpdater)
-    - [Updater](reference/manim.mobject.mobject.html#manim.mobject.mobject.Updater)
-    - [Group](reference/manim.mobject.mobject.Group.html)
-    - [Mobject](reference/manim.mobject.mobject.Mobject.html)
-    - [override_animate()](reference/manim.mobject.mobject.html#manim.mobject.mobject.override_animate)
-  - [svg](reference/manim.mobject.svg.html)
-    - [Modules](reference/manim.mobject.svg.html#modules)
-  - [table](reference/manim.mobject.table.html)
-    - [DecimalTable](reference/manim.mobject.table.DecimalTable.html)
-    - [IntegerTable](reference/manim.mobject.table.IntegerTable.html)
-    - [MathTable](reference/manim.mobject.table.MathTable.html)
-    - [MobjectTable](reference/manim.mobject.table.MobjectTable.html)
-    - [Table](reference/manim.mobject.table.Table.html)
-  - [text](reference/manim.mobject.text.html)
-    - [Modules](reference/manim.mobject.text.html#modules)
-  - [three_d](reference/manim.mobject.three_d.html)
-    - [Modules](reference/manim.mobject.three_d.html#modules)
-  - [types](reference/manim.mobject.types.html)
-    - [Modules](reference/manim.mobject.types.html#modules)
-  - [utils](reference/manim.mobject.utils.html)
-    - [get_mobject_class()](reference/manim.mobject.utils.html#manim.mobject.utils.get_mobject_class)
-    - [get_point_mobject_class()](reference/manim.mobject.utils.html#manim.mobject.utils.get_point_mobject_class)
-    - [get_vectorized_mobject_class()](reference/manim.mobject.utils.html#manim.mobject.utils.get_vectorized_mobject_class)
-  - [value_tracker](reference/manim.mobject.value_tracker.html)
-    - [ComplexValueTracker](reference/manim.mobject.value_tracker.ComplexValueTracker.html)
-    - [ValueTracker](reference/manim.mobject.value_tracker.ValueTracker.html)
-  - [vector_field](reference/manim.mobject.vector_field.html)
-    - [ArrowVectorField](reference/manim.mobject.vector_field.ArrowVectorField.html)
-    - [StreamLines](reference/manim.mobject.vector_field.StreamLines.html)
-    - [VectorField](reference/manim.mobject.vector_field.VectorField.html)
-- [Scenes](reference_index/scenes.html)
-  - [moving_camera_scene](reference/manim.scene.moving_camera_scene.html)
-    - [MovingCameraScene](reference/manim.scene.moving_camera_scene.MovingCameraScene.html)
-  - [section](reference/manim.scene.section.html)
-    - [DefaultSectionType](reference/manim.scene.section.DefaultSectionType.html)
-    - [Section](reference/manim.scene.section.Section.html)
-  - [scene](reference/manim.scene.scene.html)
-    - [RerunSceneHandler](reference/manim.scene.scene.RerunSceneHandler.html)
-    - [Scene](reference/manim.scene.scene.Scene.html)
-  - [scene_file_writer](reference/manim.scene.scene_file_writer.html)
-    - [SceneFileWriter](reference/manim.scene.scene_file_writer.SceneFileWriter.html)
-  - [three_d_scene](reference/manim.scene.three_d_scene.html)
-    - [SpecialThreeDScene](reference/manim.scene.three_d_scene.SpecialThreeDScene.html)
-    - [ThreeDScene](reference/manim.scene.three_d_scene.ThreeDScene.html)
-  - [vector_space_scene](reference/manim.scene.vector_space_scene.html)
-    - [LinearTransformationScene](reference/manim.scene.vector_space_scene.LinearTransformationScene.html)
-    - [VectorScene](reference/manim.scene.vector_space_scene.VectorScene.html)
-  - [zoomed_scene](reference/manim.scene.zoomed_scene.html)
-    - [ZoomedScene](reference/manim.scene.zoomed_scene.ZoomedScene.html)
-- [Utilities and other modules](reference_index/utilities_misc.html)
-  - [Module Index](reference_index/utilities_misc.html#module-index)
-    - [bezier](reference/manim.utils.bezier.html)
-    - [color](reference/manim.utils.color.html)
-    - [commands](reference/manim.utils.commands.html)
-    - [config_ops](reference/manim.utils.config_ops.html)
-    - [constants](reference/manim.constants.html)
-    - [debug](reference/manim.utils.debug.html)
-    - [deprecation](reference/manim.utils.deprecation.html)
-    - [docbuild](reference/manim.utils.docbuild.html)
-    - [hashing](reference/manim.utils.hashing.html)
-    - [images](reference/manim.utils.images.html)
-    - [ipython_magic](reference/manim.utils.ipython_magic.html)
-    - [iterables](reference/manim.utils.iterables.html)
-    - [paths](reference/manim.utils.paths.html)
-    - [rate_functions](reference/manim.utils.rate_functions.html)
-    - [simple_functions](reference/manim.utils.simple_functions.html)
-    - [sounds](reference/manim.utils.sounds.html)
-    - [space_ops](reference/manim.utils.space_ops.html)
-    - [testing](reference/manim.utils.testing.html)
-    - [tex](reference/manim.utils.tex.html)
-    - [tex_file_writing](reference/manim.utils.tex_file_writing.html)
-    - [tex_templates](reference/manim.utils.tex_templates.html)
-    - [typing](reference/manim.typing.html)
-"""
+# Sampling settings (temperature, top_p) for speculative candidates, most conservative first
+SPECULATIVE_SAMPLING = ((0.1, None), (0.4, 0.95), (0.7, 0.95), (0.9, 0.9), (1.0, 0.9))
+MAX_SPECULATIVE_CANDIDATES = len(SPECULATIVE_SAMPLING)
 
-# System prompt for generating Manim animations with voiceover
-SYSTEM_PROMPT = """
-You are an expert educational animator specializing in creating clear, engaging Manim animations for STEM subjects.
+JOBS_PER_CONTAINER = 2  # Concurrent generate/render_segment inputs per worker container
 
-# CRITICAL REQUIREMENTS
+TTS_PREFETCH_CONCURRENCY = 4  # Narration lines synthesized at once before the dry run
 
-1. **Class Name**: MUST be named exactly `CourseScene` (not GenScene, MyScene, or anything else)
-2. **Duration**: Total video MUST be approximately 60 seconds
-3. **Code Only**: Return ONLY executable Python code - NO markdown fences, NO explanations, NO text before/after
-4. **No External Files**: NEVER reference images, SVGs, or external assets that don't exist
-
-# REQUIRED CODE STRUCTURE
-
-```python
-from manim import *
-from manim_voiceover import VoiceoverScene
-from manim_voiceover.services.elevenlabs import ElevenLabsService
-
-class CourseScene(VoiceoverScene):
-    def construct(self):
-        # Initialize ElevenLabs voiceover service
-        self.set_speech_service(
-            ElevenLabsService(
-                voice_id="KHla1Z0y3pZPYrqfub7h",
-                voice_settings={"stability": 0.001, "similarity_boost": 0.25},
-                transcription_model=None,
-            )
-        )
-        
-        # Animation code with synchronized voiceovers
-        with self.voiceover(text="Your narration here") as tracker:
-            self.play(Create(object), run_time=tracker.duration)
-```
-
-# Visual Representations by Subject
-
-Mathematics: Use MathTex for equations, Axes for graphs, geometric shapes (Circle, Square, Polygon), NumberLine, coordinate systems
-Physics: Arrow for forces/vectors, Dot/Circle for particles, Line for waves, motion paths, vector fields
-Chemistry: Circle for atoms (connected with Line), Transform for reactions, Tex for chemical formulas
-Biology: Custom shapes using VGroup, Line for DNA helixes, Rectangle/Circle for cell structures
-Computer Science: Rectangle for arrays, Dot+Line for trees/graphs, Text with arrows for algorithms
-Engineering: Rectangle/Line for diagrams, Circle+Line for circuits, Arrow for flowcharts
-
-ABSOLUTE PROHIBITIONS - WILL CAUSE FAILURE
-NEVER use these - they reference external files that don't exist:
-
-❌ SVGMobject() - FORBIDDEN
-❌ ImageMobject() - FORBIDDEN
-❌ Any file paths or asset references
-❌ .svg, .png, .jpg files
-
-If you need icons/images, use ONLY built-in Manim basic primitives
-
-# Programming Rules
-
-Always use comments to explain what the next line does:
-Example: # Create a sphere of color BLUE for the Earth
-earth = Sphere(radius=1, checkerboard_colors=[BLUE_D, BLUE_E])
-Use TODO comments to mark places that could be improved:
-Example: # TODO: Add more detail to the molecular structure
-Comment on camera movements or significant object movements:
-Example: # This movement shows the relationship between both equations
-self.play(equation1.animate.shift(LEFT2), equation2.animate.shift(RIGHT2))
-NEVER reference external files that don't exist (images, SVGs, textures, etc.):
-WRONG: texture = ImageMobject("assets/random_texture.jpg")
-CORRECT: texture = Rectangle(fill_color=BLUE, fill_opacity=0.5)
-Always use CourseScene as the class name (not GenScene or anything else).
-
-# Critical Constraints
-
-60-Second Duration Rule:
-* Condense ALL provided content into approximately 60 seconds
-* Prioritize the most important concepts
-* Skip secondary details if needed
-* Each voiceover should be 1-2 sentences maximum
-* Use multiple short voiceovers rather than long ones
-
-API Usage - FOLLOW EXACTLY:
-* NEVER use .get_part_by_tex() with 'index' parameter - it does NOT accept this argument
-* To select parts of MathTex/Tex: use indexing like equation[0], equation[1:3], etc.
-* CORRECT: equation.get_part_by_tex("E") (no index parameter)
-* WRONG: equation.get_part_by_tex("E", index=0)
-* Use direct indexing: my_tex[0], my_tex[1], my_tex[-1]
-
-Forbidden Features:
-* DO NOT use SVGMobject or any external SVG files
-* DO NOT reference external image files
-* Only use built-in Manim objects and primitives
-
-# Output Format
-* ONLY return the Python code for the CourseScene class
-* DO NOT include markdown code fences (no ```python)
-* DO NOT include explanations or comments outside the code
-* DO NOT include any text before or after the code
-* The code should be ready to run directly
-
-# Animation Structure Template
-Recommended flow:
-* Title screen (3-5 seconds): Introduce the topic
-* Main content (45-50 seconds): Explain concepts with synchronized voiceovers
-* Summary/conclusion (5-7 seconds): Recap key points
-
-# Example structure:
-## Title
-with self.voiceover(text="Today we'll explore [topic]") as tracker:
-            self.play(Write(title), run_time=tracker.duration)
-## Main concept 1
-        with self.voiceover(text="First, let's understand [concept]") as tracker:
-self.play(Create(visual1), run_time=tracker.duration)
-## Main concept 2
-        with self.voiceover(text="Next, we see how [concept] relates") as tracker:
-self.play(Transform(visual1, visual2), run_time=tracker.duration)
-## Conclusion
-        with self.voiceover(text="In summary, [key takeaway]") as tracker:
-self.play(FadeOut(visuals), run_time=tracker.duration)
-
-# Manim Library Reference
-{manimDocs}
-
-"""
-
-# Fallback system prompt for non-voiceover version
-SYSTEM_PROMPT_NO_VOICEOVER = """
-You are an expert at creating SIMPLE, CLEAR educational Manim animations for STEM subjects WITHOUT voiceover.
-
-CRITICAL: The class MUST be named exactly 'CourseScene' - do not use any other name!
-
-Generate a regular Manim Scene (NOT VoiceoverScene) that uses visual animations with appropriate timing.
-
-IMPORTANT: 
-- Inherit from Scene, NOT VoiceoverScene
-- Do NOT use self.voiceover() context managers
-- Use self.play() with explicit run_time parameters
-- Use self.wait() for pauses between animations
-- Keep each concept on screen for 3-5 seconds
-- THE CLASS MUST be named exactly 'CourseScene' - do not use any other name!
-
-Example structure:
-```python
-class CourseScene(Scene):
-    def construct(self):
-        # Title slide
-        title = Text("Your Topic", font_size=48)
-        self.play(FadeIn(title), run_time=2)
-        self.wait(2)
-        self.play(FadeOut(title), run_time=1)
-        
-        # Concept slide
-        concept = Text("Key Concept", font_size=36)
-        visual = Circle(radius=1, color=BLUE)
-        group = VGroup(concept, visual).arrange(DOWN)
-        
-        self.play(FadeIn(group), run_time=2)
-        self.wait(3)
-        self.play(FadeOut(group), run_time=1)
-```
-
-Use the same visual guidelines and constraints as the voiceover version, but with explicit timing.
-"""
+# Library of successfully rendered scenes, one JSON file per scene, searched with BM25 for few-shot examples
+scene_library_volume = modal.Volume.from_name("manim-scene-library", create_if_missing=True)
+SCENE_LIBRARY_DIR = "/library"
+SCENE_LIBRARY_MAX_ENTRIES = 2000
+SCENE_LIBRARY_TOP_K = 2
+BM25_K1 = 1.5
+BM25_B = 0.75
 
 
-@app.function(
-    image=image,
-    secrets=[
-        modal.Secret.from_name("elevenlabs-api-key"),
-        modal.Secret.from_name("r2-credentials"),
-        modal.Secret.from_name("gemini-api-key")
-    ],
-    timeout=900,
-)
-def generate_and_render_video(course_data: dict, max_retries: int = 3):
-    import os
-    import boto3
-    import google.generativeai as genai
-    from manim import config, Scene
-    from manim_voiceover import VoiceoverScene
-    from manim_voiceover.services.elevenlabs import ElevenLabsService
+def extract_voiceover_lines(manim_code: str):
+    """
+    Find the ElevenLabsService config and every literal voiceover text in generated scene code
+    
+    Returns (service_kwargs, texts, skipped): service_kwargs is None unless the code
+    builds an ElevenLabsService from literal keyword arguments, texts are unique and in
+    source order, and skipped counts voiceover() calls whose text or options are not
+    literals (those are synthesized during the render as before).
+    """
+    import ast
+    
+    try:
+        tree = ast.parse(manim_code)
+    except SyntaxError:
+        return None, [], 0
+    
+    service_kwargs = None
+    lines = []
+    skipped = 0
+    for node in ast.walk(tree):
+        if not isinstance(node, ast.Call):
+            continue
+        name = node.func.id if isinstance(node.func, ast.Name) else getattr(node.func, "attr", None)
+        
+        if name == "ElevenLabsService" and service_kwargs is None:
+            if not node.args and all(keyword.arg for keyword in node.keywords):
+                try:
+                    service_kwargs = {keyword.arg: ast.literal_eval(keyword.value) for keyword in node.keywords}
+                except ValueError:
+                    pass
+        elif name == "voiceover" and isinstance(node.func, ast.Attribute):
+            text = node.args[0] if node.args else next((k.value for k in node.keywords if k.arg == "text"), None)
+            # Other options (e.g. ssml) change the request, so only plain text lines are prefetched
+            if isinstance(text, ast.Constant) and isinstance(text.value, str) and len(node.args) <= 1 and all(k.arg == "text" for k in node.keywords):
+                lines.append((node.lineno, text.value))
+            else:
+                skipped += 1
+    
+    texts = list(dict.fromkeys(text for _, text in sorted(lines)))
+    return service_kwargs, texts, skipped
+
+
+def prefetch_voiceovers(manim_code: str, concurrency: int = TTS_PREFETCH_CONCURRENCY, cancel: threading.Event = None) -> dict:
+    """
+    Synthesize every literal narration line in the scene concurrently, seeding the shared TTS cache
+    
+    Runs in the worker before the dry run, so the sandboxed scene finds all of its
+    audio in the cache instead of calling ElevenLabs line by line. Failures are
+    only counted: the scene retries those lines itself and surfaces any error.
+    Lines not yet started when cancel is set are counted as skipped. Returns
+    per-line latencies and overlap (summed line latency / wall time).
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    import manim_voiceover.services.elevenlabs as elevenlabs_module
+    
+    service_kwargs, texts, skipped = extract_voiceover_lines(manim_code)
+    report = {"lines": len(texts), "cached": 0, "synthesized": 0, "failed": 0, "skipped": skipped, "wall_seconds": 0.0, "line_seconds": [], "overlap": None}
+    if service_kwargs is None or not texts:
+        return report
+    
+    route_voiceover_cache_index()
+    line_state = threading.local()
+    
+    class PrefetchSpeechService(make_cached_speech_service(elevenlabs_module.ElevenLabsService, {"hits": 0, "misses": 0, "seconds": 0.0})):
+        def get_cached_result(self, input_data, cache_dir):
+            cached = super().get_cached_result(input_data, cache_dir)
+            line_state.cached = cached is not None
+            return cached
+    
+    def synthesize(text):
+        if cancel is not None and cancel.is_set():
+            return "skipped", 0.0
+        line_start = time.time()
+        line_state.cached = False
+        try:
+            service._wrap_generate_from_text(text)
+            outcome = "cached" if line_state.cached else "synthesized"
+        except Exception as e:
+            print(f"  ✗ TTS prefetch failed for {text[:40]!r}: {e}")
+            outcome = "failed"
+        return outcome, time.time() - line_start
+    
+    prefetch_start = time.time()
+    try:
+        service = PrefetchSpeechService(**service_kwargs)
+    except Exception as e:
+        print(f"  ✗ TTS prefetch skipped, could not create the speech service: {e}")
+        report["failed"] = len(texts)
+        return report
+    
+    with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(texts)))) as executor:
+        for outcome, seconds in executor.map(synthesize, texts):
+            report[outcome] += 1
+            if outcome != "skipped":
+                report["line_seconds"].append(round(seconds, 3))
+    
+    report["wall_seconds"] = round(time.time() - prefetch_start, 3)
+    if report["wall_seconds"] > 0:
+        report["overlap"] = round(sum(report["line_seconds"]) / report["wall_seconds"], 2)
+    print(
+        f"  ✓ Prefetched {len(texts)} narration line(s) in {report['wall_seconds']}s "
+        f"({report['synthesized']} synthesized, {report['cached']} cached, {report['failed']} failed, overlap {report['overlap']}x)"
+    )
+    return report
+
+
+@contextmanager
+def job_workspace(name: str = None):
+    """
+    Create an isolated scratch directory for one job and delete it once the job is done
+    
+    Manim media, generated code and upload state all live in the workspace, so
+    concurrent jobs in a container never see each other's files. Workspaces left
+    behind by crashed jobs are garbage collected here too, so /tmp does not grow
+    across warm reuses of a container.
+    """
+    import os
+    import shutil
+    
+    os.makedirs(WORKSPACE_ROOT, exist_ok=True)
+    now = time.time()
+    for entry in os.listdir(WORKSPACE_ROOT):
+        path = os.path.join(WORKSPACE_ROOT, entry)
+        try:
+            if now - os.path.getmtime(path) > WORKSPACE_MAX_AGE_SECONDS:
+                shutil.rmtree(path, ignore_errors=True)
+                print(f"  Removed stale workspace {path}")
+        except OSError:
+            pass  # Removed by a concurrent job
+    
+    suffix = uuid.uuid4().hex[:12]
+    workspace = os.path.join(WORKSPACE_ROOT, f"{name}-{suffix}" if name else suffix)
+    os.makedirs(workspace)
+    try:
+        yield workspace
+    finally:
+        shutil.rmtree(workspace, ignore_errors=True)
+
+
+# Scene library entries loaded by this container, keyed by filename
+_scene_library = {}
+_scene_library_lock = threading.Lock()
+
+
+def tokenize(text: str) -> list:
+    import re
+    
+    return re.findall(r"[a-z0-9]+", text.lower())
+
+
+def load_scene_library() -> list:
+    """Reload the library volume and read any entries this container has not seen yet"""
+    import os
+    
+    try:
+        scene_library_volume.reload()
+    except Exception as e:
+        print(f"  ✗ Scene library reload failed: {e}")
+    if not os.path.isdir(SCENE_LIBRARY_DIR):
+        return []
+    
+    filenames = {name for name in os.listdir(SCENE_LIBRARY_DIR) if name.endswith(".json")}
+    with _scene_library_lock:
+        for name in list(_scene_library):
+            if name not in filenames:
+                del _scene_library[name]  # Evicted by another container
+        for name in filenames - set(_scene_library):
+            try:
+                with open(os.path.join(SCENE_LIBRARY_DIR, name)) as f:
+                    entry = json.load(f)
+                entry["tokens"] = tokenize(" ".join([entry["title"], entry["subject"], *entry["blocks"]]))
+                _scene_library[name] = entry
+            except Exception as e:
+                print(f"  ✗ Skipping unreadable scene library entry {name}: {e}")
+        return list(_scene_library.values())
+
+
+def retrieve_similar_scenes(title: str, subject: str, blocks: list, top_k: int = SCENE_LIBRARY_TOP_K) -> list:
+    """
+    Rank library scenes against a course with BM25 over title, subject and blocks
+    
+    Returns the top_k matches for each voiceover mode, best first, so the
+    prompt can still use examples after a voiceover fallback.
+    """
+    import math
+    
+    entries = load_scene_library()
+    query = set(tokenize(" ".join([title, subject, *blocks])))
+    if not entries or not query:
+        return []
+    
+    document_frequency = {}
+    for entry in entries:
+        for token in set(entry["tokens"]):
+            document_frequency[token] = document_frequency.get(token, 0) + 1
+    average_length = sum(len(entry["tokens"]) for entry in entries) / len(entries)
+    
+    scored = []
+    for entry in entries:
+        counts = {}
+        for token in entry["tokens"]:
+            counts[token] = counts.get(token, 0) + 1
+        length_norm = BM25_K1 * (1 - BM25_B + BM25_B * len(entry["tokens"]) / average_length)
+        score = 0.0
+        for token in query & counts.keys():
+            idf = math.log(1 + (len(entries) - document_frequency[token] + 0.5) / (document_frequency[token] + 0.5))
+            score += idf * counts[token] * (BM25_K1 + 1) / (counts[token] + length_norm)
+        if score > 0:
+            scored.append((score, entry))
+    
+    scored.sort(key=lambda pair: pair[0], reverse=True)
+    examples = []
+    for has_voiceover in (True, False):
+        matches = [(score, entry) for score, entry in scored if entry["has_voiceover"] == has_voiceover][:top_k]
+        examples.extend({**entry, "score": round(score, 3)} for score, entry in matches)
+    for example in examples:
+        example.pop("tokens", None)
+    return examples
+
+
+def store_successful_scene(title: str, subject: str, blocks: list, render_info: dict):
+    """Add a rendered scene to the library, evicting the oldest entries beyond the size limit"""
+    import os
+    
+    manim_code = render_info.get("manim_code")
+    # Template scenes are rebuilt from the templates, so they would only crowd out Gemini examples
+    if not manim_code or render_info.get("route") == "template":
+        return
+    
+    try:
+        scene_library_volume.reload()
+        os.makedirs(SCENE_LIBRARY_DIR, exist_ok=True)
+        
+        # Content-addressed, so re-rendering the same program doesn't add duplicates
+        entry_id = hashlib.sha256(manim_code.encode("utf-8")).hexdigest()[:16]
+        with open(os.path.join(SCENE_LIBRARY_DIR, f"{entry_id}.json"), "w") as f:
+            json.dump({
+                "id": entry_id,
+                "title": title,
+                "subject": subject,
+                "blocks": blocks,
+                "manim_code": manim_code,
+                "has_voiceover": render_info["has_voiceover"],
+                "attempts_used": render_info["attempts_used"],
+                "timings": render_info["timings"],
+                "prompt_version": PROMPT_VERSION,
+                "stored_at": time.time(),
+            }, f)
+        
+        paths = [os.path.join(SCENE_LIBRARY_DIR, name) for name in os.listdir(SCENE_LIBRARY_DIR) if name.endswith(".json")]
+        if len(paths) > SCENE_LIBRARY_MAX_ENTRIES:
+            paths.sort(key=os.path.getmtime)
+            for path in paths[:len(paths) - SCENE_LIBRARY_MAX_ENTRIES]:
+                os.remove(path)
+        
+        scene_library_volume.commit()
+        print(f"✓ Stored scene in library: {entry_id}")
+    except Exception as e:
+        print(f"  ✗ Failed to store scene in library: {e}")
+
+
+def format_few_shot_examples(examples: list) -> str:
+    """Render library scenes as few-shot examples for the prompt"""
+    if not examples:
+        return ""
+    
+    section = "\n\n# Examples of CourseScene programs that rendered successfully for similar courses\n"
+    for i, example in enumerate(examples, 1):
+        section += f"\n## Example {i}: {example['title']}"
+        if example["subject"]:
+            section += f" ({example['subject']})"
+        section += f"\n```python\n{example['manim_code']}\n```\n"
+    return section
+
+
+def configure_api_keys() -> bool:
+    """Set up Gemini and ElevenLabs credentials, returning whether ElevenLabs is available"""
+    import os
+    import google.generativeai as genai
     
-    # Set up API keys
     elevenlabs_available = False
     if "ELEVENLABS_API_KEY" in os.environ:
         os.environ["ELEVEN_API_KEY"] = os.environ["ELEVENLABS_API_KEY"]
@@ -425,11 +367,55 @@ def generate_and_render_video(course_data: dict, max_retries: int = 3):
     
     genai.configure(api_key=os.environ["GEMINI_API_KEY"])
     
-    # Prepare course content for Gemini
-    title = course_data.get("title", "Course")
-    blocks = course_data.get("blocks", [])
-    subject = course_data.get("subject", "")
+    return elevenlabs_available
+
+
+def error_code_line(error: str):
+    """Line number of generated code named in an error message, if any"""
+    import re
     
+    matches = re.findall(r"line (\d+)", error)
+    return int(matches[-1]) if matches else None
+
+
+def build_retry_message(error: str, code: str, failed_attempts: int, context_lines: int = 6) -> str:
+    """Follow-up turn with only the error, where it happened and the code around it"""
+    message = f"That code failed.\nError: {error}\n"
+    
+    line = error_code_line(error)
+    code_lines = code.split("\n")
+    if line and 1 <= line <= len(code_lines):
+        first = max(1, line - context_lines)
+        last = min(len(code_lines), line + context_lines)
+        region = "\n".join(
+            f"{'>>' if number == line else '  '} {number:4d} | {code_lines[number - 1]}"
+            for number in range(first, last + 1)
+        )
+        message += f"Location: line {line}\n\nRelevant code:\n```\n{region}\n```\n"
+    
+    # Add specific guidance based on error type
+    error_lower = error.lower()
+    if "get_part_by_tex" in error_lower and "index" in error_lower:
+        message += "HINT: get_part_by_tex() does NOT accept 'index' parameter. Use direct indexing like equation[0] instead.\n"
+    elif "svgmobject" in error_lower or "imagemobject" in error_lower:
+        message += "HINT: Do NOT use SVGMobject or ImageMobject. Use only built-in Manim primitives.\n"
+    elif "elevenlabs" in error_lower or "voiceover" in error_lower:
+        message += "HINT: ElevenLabs API might be unavailable. Consider generating without voiceover.\n"
+    elif "attributeerror" in error_lower:
+        message += "HINT: Check that all methods and attributes exist in Manim. Refer to the documentation.\n"
+    elif "syntaxerror" in error_lower or "indentation" in error_lower:
+        message += "HINT: Fix syntax errors and ensure proper Python indentation.\n"
+    
+    # Include error history if multiple attempts
+    if failed_attempts > 1:
+        message += f"\nPrevious {failed_attempts - 1} attempt(s) also failed. Avoid repeating the same mistakes.\n"
+    
+    message += "\nPlease fix ALL errors and return the complete corrected CourseScene class code:"
+    return message
+
+
+def build_course_content(title: str, subject: str, blocks: list) -> str:
+    """Format course content for the Gemini prompt"""
     course_content = f"Title: {title}\n"
     if subject:
         course_content += f"Subject: {subject}\n\n"
@@ -437,73 +423,209 @@ def generate_and_render_video(course_data: dict, max_retries: int = 3):
     for i, block in enumerate(blocks, 1):
         course_content += f"Block {i}:\n{block}\n\n"
     
-    print(f"Generating Manim code for: {title}")
+    return course_content
+
+
+class StaticCheckError(Exception):
+    """Generated code failed validation before being executed"""
+
+
+def static_check_code(manim_code: str):
+    """Reject generated code with syntax errors, no CourseScene class or forbidden mobjects"""
+    import ast
     
-    # Try with voiceover first if ElevenLabs is available
-    use_voiceover = elevenlabs_available
-    attempt = 0
-    max_attempts = max(1, min(max_retries, 10))  # Clamp between 1 and 10
-    scene = None
-    warnings = []
-    previous_error = None
-    previous_code = None
-    error_history = []  # Track all errors for better feedback
+    try:
+        tree = ast.parse(manim_code)
+    except SyntaxError as e:
+        raise StaticCheckError(f"SyntaxError at line {e.lineno}: {e.msg}")
     
-    while attempt < max_attempts and scene is None:
-        attempt += 1
-        
-        # Choose prompt based on voiceover availability
-        prompt_to_use = SYSTEM_PROMPT if use_voiceover else SYSTEM_PROMPT_NO_VOICEOVER
-        
-        print(f"Attempt {attempt}: Generating {'with' if use_voiceover else 'without'} voiceover...")
-        
-        # Generate Manim code using Gemini with retry logic
-        model = genai.GenerativeModel('gemini-2.5-pro')
-        formatted_prompt = prompt_to_use.format(manimDocs=manimDocs)
-        
-        # Build the prompt - include error feedback if this is a retry
-        if previous_error and previous_code:
-            # Build comprehensive error feedback
-            error_feedback = f"PREVIOUS ATTEMPT #{attempt - 1} FAILED\n"
-            error_feedback += f"Error: {previous_error}\n\n"
-            error_feedback += "Previous code that failed:\n```python\n"
-            error_feedback += previous_code
-            error_feedback += "\n```\n\n"
-            
-            # Add specific guidance based on error type
-            error_lower = previous_error.lower()
-            if "get_part_by_tex" in error_lower and "index" in error_lower:
-                error_feedback += "HINT: get_part_by_tex() does NOT accept 'index' parameter. Use direct indexing like equation[0] instead.\n"
-            elif "svgmobject" in error_lower or "imagemobject" in error_lower:
-                error_feedback += "HINT: Do NOT use SVGMobject or ImageMobject. Use only built-in Manim primitives.\n"
-            elif "elevenlabs" in error_lower or "voiceover" in error_lower:
-                error_feedback += "HINT: ElevenLabs API might be unavailable. Consider generating without voiceover.\n"
-            elif "attributeerror" in error_lower:
-                error_feedback += "HINT: Check that all methods and attributes exist in Manim. Refer to the documentation.\n"
-            elif "syntaxerror" in error_lower or "indentation" in error_lower:
-                error_feedback += "HINT: Fix syntax errors and ensure proper Python indentation.\n"
-            
-            # Include error history if multiple attempts
-            if len(error_history) > 1:
-                error_feedback += f"\nPrevious {len(error_history) - 1} attempt(s) also failed. Avoid repeating the same mistakes.\n"
-            
-            prompt = f"{formatted_prompt}\n\nCourse Content:\n{course_content}\n\n{error_feedback}\nPlease fix ALL errors and generate corrected CourseScene class code:"
-            print(f"  Including detailed error feedback from attempt {attempt - 1} for LLM to fix...")
-        else:
-            prompt = f"{formatted_prompt}\n\nCourse Content:\n{course_content}\n\nGenerate the CourseScene class code:"
-        
-        # Retry logic for Gemini API call
-        max_retries = 3
-        retry_delay = 2  # seconds
-        manim_code = None
-        
+    class_names = {node.name for node in ast.walk(tree) if isinstance(node, ast.ClassDef)}
+    if "CourseScene" not in class_names:
+        found = ", ".join(sorted(class_names)) or "none"
+        raise StaticCheckError(f"Generated code must define a class named 'CourseScene' (found: {found})")
+    
+    for node in ast.walk(tree):
+        name = None
+        if isinstance(node, ast.Name):
+            name = node.id
+        elif isinstance(node, ast.Attribute):
+            name = node.attr
+        if name in FORBIDDEN_MOBJECTS:
+            raise StaticCheckError(f"Forbidden {name} used at line {node.lineno}: only built-in Manim primitives are allowed")
+
+
+def replace_source_segments(source: str, edits: list) -> str:
+    """Replace (node, text) pairs in source by AST position, skipping edits nested in an earlier one"""
+    encoded = source.encode("utf-8")
+    line_starts = [0]
+    for line in encoded.splitlines(keepends=True):
+        line_starts.append(line_starts[-1] + len(line))
+    
+    # AST column offsets are UTF-8 byte offsets
+    spans = []
+    for node, text in edits:
+        start = line_starts[node.lineno - 1] + node.col_offset
+        end = line_starts[node.end_lineno - 1] + node.end_col_offset
+        if any(start < other_end and other_start < end for other_start, other_end, _ in spans):
+            continue
+        spans.append((start, end, text))
+    
+    for start, end, text in sorted(spans, reverse=True):
+        encoded = encoded[:start] + text.encode("utf-8") + encoded[end:]
+    return encoded.decode("utf-8")
+
+
+def strip_stray_markdown(manim_code: str) -> str:
+    """
+    Drop markdown fences and the prose around the code until it parses (best effort)
+    
+    With a fenced block, only its contents are kept. Otherwise leading and
+    trailing lines are dropped only while the code does not parse and they look
+    like prose ("Here is the code:") or markdown (bullets, bold, quotes), so
+    plain statements such as "x = 1" are never removed.
+    """
+    import ast
+    import re
+    
+    lines = manim_code.splitlines()
+    fences = [number for number, line in enumerate(lines) if line.strip().startswith("```")]
+    if len(fences) >= 2:
+        lines = lines[fences[0] + 1:fences[1]]
+    elif fences:
+        del lines[fences[0]]
+    
+    prose = re.compile(r"^\s*((\*\*|[-*+] |\d+\. |> ).*|[A-Z][\w'’]*[!,.:;]? [\w'’,;:!?\- ]*[.:!?]?)\s*$")
+    
+    def parses():
+        try:
+            ast.parse("\n".join(lines))
+            return True
+        except SyntaxError:
+            return False
+    
+    while lines and not lines[0].strip():
+        lines.pop(0)
+    while lines and not parses() and prose.match(lines[0]):
+        lines.pop(0)
+        while lines and not lines[0].strip():
+            lines.pop(0)
+    while lines and not parses() and (not lines[-1].strip() or prose.match(lines[-1])):
+        lines.pop()
+    while lines and not lines[-1].strip():
+        lines.pop()
+    
+    return "\n".join(lines)
+
+
+def repair_manim_code(manim_code: str):
+    """
+    Deterministically fix known mechanical failures in generated code
+    
+    Strips stray markdown, drops the unsupported index= argument of
+    get_part_by_tex, swaps forbidden mobjects for primitives and renames the
+    scene class to CourseScene. Returns the code and a list of repairs made.
+    """
+    import ast
+    import copy
+    
+    repairs = []
+    
+    try:
+        tree = ast.parse(manim_code)
+    except SyntaxError:
+        stripped = strip_stray_markdown(manim_code)
+        try:
+            tree = ast.parse(stripped)
+        except SyntaxError:
+            return manim_code, repairs
+        if not stripped.strip():
+            return manim_code, repairs
+        manim_code = stripped
+        repairs.append("stripped markdown")
+    
+    def call_name(node):
+        if isinstance(node.func, ast.Name):
+            return node.func.id
+        if isinstance(node.func, ast.Attribute):
+            return node.func.attr
+        return None
+    
+    # get_part_by_tex() has no index parameter
+    edits = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Call) and call_name(node) == "get_part_by_tex" and any(k.arg == "index" for k in node.keywords):
+            fixed = copy.deepcopy(node)
+            fixed.keywords = [k for k in fixed.keywords if k.arg != "index"]
+            edits.append((node, ast.unparse(fixed)))
+    if edits:
+        manim_code = replace_source_segments(manim_code, edits)
+        tree = ast.parse(manim_code)
+        repairs.append(f"removed index= from {len(edits)} get_part_by_tex call(s)")
+    
+    # Forbidden mobjects reference external files, so construct a primitive instead
+    call_edits = [
+        (node, FORBIDDEN_MOBJECT_REPLACEMENTS[call_name(node)])
+        for node in ast.walk(tree)
+        if isinstance(node, ast.Call) and call_name(node) in FORBIDDEN_MOBJECTS
+    ]
+    if call_edits:
+        manim_code = replace_source_segments(manim_code, call_edits)
+        tree = ast.parse(manim_code)
+    name_edits = [
+        (node, FORBIDDEN_MOBJECT_REPLACEMENTS[node.id].split("(")[0])
+        for node in ast.walk(tree)
+        if isinstance(node, ast.Name) and node.id in FORBIDDEN_MOBJECTS
+    ]
+    if name_edits:
+        manim_code = replace_source_segments(manim_code, name_edits)
+        tree = ast.parse(manim_code)
+    if call_edits or name_edits:
+        repairs.append(f"replaced {len(call_edits) + len(name_edits)} forbidden mobject reference(s) with primitives")
+    
+    # Rename the scene class if the model picked another name
+    classes = [node for node in tree.body if isinstance(node, ast.ClassDef)]
+    scene_classes = [
+        node for node in classes
+        if any(isinstance(base, ast.Name) and base.id.endswith("Scene") for base in node.bases)
+    ]
+    if scene_classes and "CourseScene" not in {node.name for node in classes}:
+        old_name = scene_classes[-1].name
+        class_line = scene_classes[-1].lineno - 1
+        edits = [(node, "CourseScene") for node in ast.walk(tree) if isinstance(node, ast.Name) and node.id == old_name]
+        lines = replace_source_segments(manim_code, edits).split("\n")
+        lines[class_line] = lines[class_line].replace(f"class {old_name}", "class CourseScene", 1)
+        manim_code = "\n".join(lines)
+        repairs.append(f"renamed class {old_name} to CourseScene")
+    
+    return manim_code, repairs
+
+
+def generate_manim_code(model, prompt: str, temperature: float = 0.1, top_p: float = None, spans: list = None, cancel: threading.Event = None) -> str:
+    """Call Gemini with retries and return the generated code without markdown fences, giving up between calls once cancel is set"""
+    import google.generativeai as genai
+    
+    # Retry logic for Gemini API call
+    max_retries = 3
+    retry_delay = 2  # seconds
+    manim_code = None
+    
+    with stage_span(spans if spans is not None else [], "gemini", temperature=temperature) as span:
         for retry in range(max_retries):
+            if cancel is not None and cancel.is_set():
+                raise CandidateCancelled("Gemini call cancelled")
             try:
                 print(f"  Gemini API call attempt {retry + 1}/{max_retries}...")
                 response = model.generate_content(prompt, generation_config=genai.types.GenerationConfig(
-                    temperature=0.1,
+                    temperature=temperature,
+                    top_p=top_p,
                 ))
                 manim_code = response.text.strip()
+                usage = getattr(response, "usage_metadata", None)
+                if usage:
+                    span["prompt_tokens"] = usage.prompt_token_count
+                    span["completion_tokens"] = usage.candidates_token_count
+                    span["cached_tokens"] = getattr(usage, "cached_content_token_count", 0) or 0
+                span["api_calls"] = retry + 1
                 print("  ✓ Gemini API call successful")
                 break
             except Exception as e:
@@ -511,48 +633,298 @@ def generate_and_render_video(course_data: dict, max_retries: int = 3):
                 if retry < max_retries - 1:
                     wait_time = retry_delay * (2 ** retry)  # Exponential backoff
                     print(f"  Retrying in {wait_time} seconds...")
-                    time.sleep(wait_time)
+                    if cancel is not None:
+                        cancel.wait(wait_time)
+                    else:
+                        time.sleep(wait_time)
                 else:
                     raise Exception(f"Failed to generate code after {max_retries} attempts: {e}")
+    
+    if not manim_code:
+        raise Exception("Failed to generate Manim code from Gemini")
+    
+    # Gemini usually fences its code and sometimes adds prose around it; a lone or
+    # unclosed fence is handled too, unlike splitting on the fence markers
+    return strip_stray_markdown(manim_code)
+
+
+def validate_candidate(manim_code: str, media_dir: str = MEDIA_DIR, events: JobEvents = None, cancel: threading.Event = None) -> dict:
+    """
+    Auto-repair, static check and sandboxed dry run of generated code
+    
+    Returns the (possibly repaired) candidate with its stage timings, TTS
+    cache stats, the repairs applied, the dry run's animation count and the
+    validation error (None if it passed) instead of raising. Once cancel is
+    set, remaining stages are skipped and a running dry run is killed.
+    """
+    if events:
+        events.publish("exec")
+    candidate = {
+        "manim_code": manim_code,
+        "repairs": [],
+        "error": None,
+        "animations": None,
+        "timings": {"static_check_seconds": 0.0, "dry_run_seconds": 0.0},
+        "tts_cache": {"hits": 0, "misses": 0, "seconds": 0.0},
+        "render_cache": {counter: 0 for counter in RENDER_CACHE_COUNTERS},
+        "tts_prefetch": summarize_tts_prefetch([]),
+        "spans": [],
+    }
+    
+    # Fix known mechanical failures locally instead of spending another Gemini call on them
+    with stage_span(candidate["spans"], "repair") as span:
+        candidate["manim_code"], candidate["repairs"] = repair_manim_code(manim_code)
+        span["repairs"] = len(candidate["repairs"])
+    if candidate["repairs"]:
+        print(f"  Auto-repaired generated code: {'; '.join(candidate['repairs'])}")
+    manim_code = candidate["manim_code"]
+    
+    # Cheap static checks before executing anything
+    stage_start = time.time()
+    try:
+        with stage_span(candidate["spans"], "static_check"):
+            static_check_code(manim_code)
+    except Exception as e:
+        candidate["error"] = e
+        return candidate
+    finally:
+        candidate["timings"]["static_check_seconds"] = time.time() - stage_start
+    
+    # Synthesize all narration up front so neither the dry run nor the render waits on ElevenLabs
+    with stage_span(candidate["spans"], "tts_prefetch") as span:
+        candidate["tts_prefetch"] = prefetch_voiceovers(manim_code, cancel=cancel)
+        span.update({key: value for key, value in candidate["tts_prefetch"].items() if key != "line_seconds"})
+    
+    # Exercise construct() end to end at low quality before paying for the full render
+    print("Validating scene with a dry run...")
+    stage_start = time.time()
+    try:
+        with stage_span(candidate["spans"], "dry_run") as span:
+            try:
+                if cancel is not None and cancel.is_set():
+                    raise CandidateCancelled("Dry run cancelled")
+                outcome = run_scene_in_sandbox(manim_code, "dry_run", DRY_RUN_LIMITS, media_dir=media_dir, cancel=cancel)
+                candidate["animations"] = outcome.get("animations")
+                candidate["tts_cache"] = outcome["tts_cache"]
+                candidate["render_cache"] = outcome["render_cache"]
+                span["peak_rss_bytes"] = outcome["peak_rss_bytes"]
+                print(f"  ✓ Dry run passed in {time.time() - stage_start:.1f}s")
+            except SceneExecutionError as e:
+                candidate["tts_cache"] = e.outcome.get("tts_cache", candidate["tts_cache"])
+                candidate["render_cache"] = e.outcome.get("render_cache", candidate["render_cache"])
+                raise
+    except Exception as e:
+        candidate["error"] = e
+    finally:
+        candidate["timings"]["dry_run_seconds"] = time.time() - stage_start
+    
+    return candidate
+
+
+def race_candidates(model, prompt: str, num_candidates: int, media_dir: str = MEDIA_DIR, events: JobEvents = None):
+    """
+    Generate and validate several Gemini candidates at once, yielding each as it finishes
+    
+    Candidates use increasingly diverse sampling settings and validate in
+    their own sandboxes, so dry runs overlap too. Closing the generator (the
+    caller does once a candidate validated) sets every candidate's cancel
+    event: losers stop before their next Gemini call or TTS line, and their
+    dry-run sandboxes are killed within SANDBOX_POLL_SECONDS.
+    """
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+    
+    def generate_and_validate(temperature, top_p, cancel):
+        spans = []
+        candidate = validate_candidate(generate_manim_code(model, prompt, temperature, top_p, spans=spans, cancel=cancel), media_dir, events, cancel)
+        candidate["spans"] = spans + candidate["spans"]
+        return candidate
+    
+    sampling = SPECULATIVE_SAMPLING[:num_candidates]
+    cancels = [threading.Event() for _ in sampling]
+    executor = ThreadPoolExecutor(max_workers=len(sampling))
+    print(f"  Racing {len(sampling)} candidates concurrently...")
+    futures = {
+        executor.submit(generate_and_validate, temperature, top_p, cancel): number
+        for number, ((temperature, top_p), cancel) in enumerate(zip(sampling, cancels), 1)
+    }
+    
+    try:
+        generated = 0
+        last_error = None
+        for future in as_completed(futures):
+            try:
+                candidate = future.result()
+            except Exception as e:
+                last_error = e
+                print(f"  ✗ Candidate {futures[future]} generation failed: {e}")
+                continue
+            generated += 1
+            print(f"  Candidate {futures[future]} finished ({generated} of {len(sampling)})")
+            yield candidate
         
-        if not manim_code:
-            raise Exception("Failed to generate Manim code from Gemini")
-        
-        # Clean up the code (remove markdown if present)
-        if "```python" in manim_code:
-            manim_code = manim_code.split("```python")[1].split("```")[0].strip()
-        elif "```" in manim_code:
-            manim_code = manim_code.split("```")[1].split("```")[0].strip()
-        
-        print("Generated Manim code:")
-        print(manim_code)
-        
-        # Save generated code for debugging
-        with open(f"/tmp/generated_code_attempt_{attempt}.py", "w") as f:
-            f.write(manim_code)
-        
-        # Execute the generated code to create the scene class
-        exec_globals = {
-            'Scene': Scene,
-            'VoiceoverScene': VoiceoverScene,
-            'ElevenLabsService': ElevenLabsService,
-        }
-        
-        # Import all Manim components
-        exec("from manim import *", exec_globals)
-        
-        try:
-            exec(manim_code, exec_globals)
+        if generated == 0:
+            raise Exception(f"All {len(sampling)} candidates failed to generate: {last_error}")
+    finally:
+        for cancel in cancels:
+            cancel.set()
+        running = sum(1 for future in futures if not future.done())
+        if running:
+            print(f"  Cancelling {running} losing candidate(s)")
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def summarize_token_usage(spans: list) -> list:
+    """Per-attempt Gemini token counts from the gemini spans (speculative candidates are summed)"""
+    usage = {}
+    for span in spans:
+        if span["stage"] != "gemini":
+            continue
+        attempt = usage.setdefault(span.get("attempt", 1), {"attempt": span.get("attempt", 1), "prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0})
+        for key in ("prompt_tokens", "cached_tokens", "completion_tokens"):
+            attempt[key] += span.get(key, 0)
+    return [usage[attempt] for attempt in sorted(usage)]
+
+
+def generate_and_render_scene(course_content: str, max_attempts: int, use_voiceover: bool, extra_instructions: str = "", speculative_candidates: int = 1, model=None, examples: list = None, subject: str = "", render_profile: str = DEFAULT_RENDER_PROFILE, media_dir: str = MEDIA_DIR, template: dict = None, events: JobEvents = None):
+    """
+    Generate CourseScene code with Gemini and render it, feeding errors back to the LLM on retries
+    
+    Returns a dict with the rendered video_path, whether voiceover was used,
+    the number of attempts used and any warnings. Library examples matching the current voiceover mode are added to the
+    prompt as few-shot context, and manimDocs is trimmed to the subject.
+    Retries continue the conversation with only the error delta. The final
+    render uses render_profile (dry runs always run at the lowest quality), and
+    everything is written under media_dir. With a template (see
+    render_scene_template) its code is tried first as attempt 0; if it fails
+    the scene falls back to Gemini with the full max_attempts. Stage
+    transitions and render progress are published to events.
+    """
+    import os
+    import google.generativeai as genai
+    
+    attempt = 0
+    scene = None
+    warnings = []
+    previous_error = None
+    previous_code = None
+    previous_opening_prompt = None
+    manim_docs = trim_manim_docs(subject)
+    error_history = []  # Track all errors for better feedback
+    timings = {"static_check_seconds": 0.0, "dry_run_seconds": 0.0, "render_seconds": 0.0}
+    tts_cache_stats = {"hits": 0, "misses": 0, "seconds": 0.0}
+    render_cache_stats = {counter: 0 for counter in RENDER_CACHE_COUNTERS}
+    tts_prefetch_reports = []
+    video_path = render_output_path(render_profile, media_dir)
+    os.makedirs(media_dir, exist_ok=True)
+    spans = []
+    voiceover_fallbacks = 0
+    auto_repairs = {"attempts_saved": 0, "repairs": []}
+    use_template = template is not None
+    template_error = None
+    few_shot = []
+    events = events or JobEvents()
+    
+    while attempt < max_attempts and scene is None:
+        if use_template:
+            # Template code is deterministic, so it runs as attempt 0 without touching Gemini
+            print(f"Attempt {attempt}: Filling the {template['name']} template {'with' if use_voiceover else 'without'} voiceover...")
+            events.publish("attempt", attempt=attempt, max_attempts=max_attempts, voiceover=use_voiceover, route="template")
+            events.publish("generating", attempt=attempt, template=template["name"])
+            with stage_span(spans, "template", attempt=attempt, template=template["name"]):
+                template_code = render_scene_template(template, use_voiceover)
+            candidate = validate_candidate(template_code, media_dir, events)
+            candidates = iter([candidate])
+        else:
+            attempt += 1
+            events.publish("attempt", attempt=attempt, max_attempts=max_attempts, voiceover=use_voiceover, route="llm")
             
-            # Find the scene class
-            scene_class = exec_globals.get('CourseScene')
-            if not scene_class:
-                raise Exception("Generated code must define a class named 'CourseScene'")
+            # Choose prompt based on voiceover availability
+            prompt_to_use = SYSTEM_PROMPT if use_voiceover else SYSTEM_PROMPT_NO_VOICEOVER
+            
+            print(f"Attempt {attempt}: Generating {'with' if use_voiceover else 'without'} voiceover...")
+            
+            # Generate Manim code using Gemini with retry logic
+            if model is None:
+                model = genai.GenerativeModel(GEMINI_MODEL)
+            with stage_span(spans, "prompt", attempt=attempt) as span:
+                few_shot = [example for example in examples or [] if example["has_voiceover"] == use_voiceover][:SCENE_LIBRARY_TOP_K]
+                formatted_prompt = prompt_to_use.format(manimDocs=manim_docs) + format_few_shot_examples(few_shot) + extra_instructions
+                
+                # The opening turn is identical on every attempt, so Gemini can serve it from its prefix cache
+                opening_prompt = f"{formatted_prompt}\n\nCourse Content:\n{course_content}\n\nGenerate the CourseScene class code:"
+                
+                if previous_error and previous_code and opening_prompt == previous_opening_prompt:
+                    # Continue the conversation with just the error delta - the failed code is already the model's turn
+                    prompt = [
+                        {"role": "user", "parts": [opening_prompt]},
+                        {"role": "model", "parts": [previous_code]},
+                        {"role": "user", "parts": [build_retry_message(previous_error, previous_code, len(error_history))]},
+                    ]
+                    print(f"  Sending error delta from attempt {attempt - 1} for LLM to fix...")
+                else:
+                    prompt = opening_prompt
+                previous_opening_prompt = opening_prompt
+                
+                span["prompt_chars"] = len(prompt) if isinstance(prompt, str) else sum(len(turn["parts"][0]) for turn in prompt)
+                span["turns"] = 1 if isinstance(prompt, str) else len(prompt)
+                span["few_shot_examples"] = len(few_shot)
+            
+            events.publish("generating", attempt=attempt, candidates=speculative_candidates)
+            if speculative_candidates > 1:
+                # Race several candidates, each generated and validated in its own sandbox
+                candidates = race_candidates(model, prompt, speculative_candidates, media_dir, events)
+            else:
+                gemini_spans = []
+                candidate = validate_candidate(generate_manim_code(model, prompt, spans=gemini_spans), media_dir, events)
+                candidate["spans"] = gemini_spans + candidate["spans"]
+                candidates = iter([candidate])
+        
+        manim_code = None
+        try:
+            validated = False
+            last_error = None
+            try:
+                for candidate_number, candidate in enumerate(candidates, 1):
+                    manim_code = candidate["manim_code"]
+                    animations = candidate["animations"]
+                    for stage, seconds in candidate["timings"].items():
+                        timings[stage] += seconds
+                    for counter, count in candidate["tts_cache"].items():
+                        tts_cache_stats[counter] += count
+                    for counter, count in candidate["render_cache"].items():
+                        render_cache_stats[counter] += count
+                    tts_prefetch_reports.append(candidate["tts_prefetch"])
+                    spans.extend({**span, "attempt": attempt, "candidate": candidate_number} for span in candidate["spans"])
+                    
+                    print("Generated Manim code:")
+                    print(manim_code)
+                    
+                    # Save generated code for debugging
+                    with open(f"{media_dir}/generated_code_attempt_{attempt}_candidate_{candidate_number}.py", "w") as f:
+                        f.write(manim_code)
+                    
+                    if candidate["error"] is None:
+                        validated = True
+                        # Without the local repairs this candidate would have failed and cost another attempt
+                        if candidate["repairs"]:
+                            auto_repairs["attempts_saved"] += 1
+                            auto_repairs["repairs"].extend(candidate["repairs"])
+                        break
+                    
+                    last_error = candidate["error"]
+                    if speculative_candidates > 1:
+                        print(f"  ✗ Candidate {candidate_number} failed validation: {last_error}")
+            finally:
+                # Stop waiting on slower candidates once one has validated, or the loop raised
+                if speculative_candidates > 1 and not use_template:
+                    candidates.close()
+            
+            if not validated:
+                raise last_error
             
             # Try to render the scene with retry logic
             print("Rendering Manim scene...")
-            config.media_dir = "/tmp/manim"
-            config.output_file = "output"
+            render_start = time.time()
             
             # Retry logic for scene rendering
             max_render_retries = 2
@@ -561,11 +933,28 @@ def generate_and_render_video(course_data: dict, max_retries: int = 3):
             for render_retry in range(max_render_retries):
                 try:
                     print(f"  Render attempt {render_retry + 1}/{max_render_retries}...")
-                    scene = scene_class()
-                    scene.render()
+                    events.publish("rendering", attempt=attempt, render_attempt=render_retry + 1, animation=0, animations=animations, frames=0)
+                    with stage_span(spans, "render", attempt=attempt, render_attempt=render_retry + 1, render_profile=render_profile) as span:
+                        scene = run_scene_in_sandbox(
+                            manim_code, "render", RENDER_LIMITS, media_dir=media_dir, render_profile=render_profile,
+                            on_progress=lambda progress: events.publish("rendering", attempt=attempt, render_attempt=render_retry + 1, animations=animations, **progress),
+                        )
+                        video_path = scene.get("video_path", video_path)
+                        span["peak_rss_bytes"] = scene["peak_rss_bytes"]
+                        span["tts_seconds"] = round(scene["tts_cache"]["seconds"], 3)
+                        span["partial_movie_hits"] = scene["render_cache"]["partial_hits"]
+                        span["partial_movie_misses"] = scene["render_cache"]["partial_misses"]
+                    
+                    for counter, count in scene["tts_cache"].items():
+                        tts_cache_stats[counter] += count
+                    for counter, count in scene["render_cache"].items():
+                        render_cache_stats[counter] += count
                     render_success = True
                     print(f"  ✓ Render successful")
                     break
+                except ResourceLimitExceeded:
+                    # Re-rendering a runaway scene would just hit the limit again
+                    raise
                 except Exception as render_error:
                     print(f"  ✗ Render error (attempt {render_retry + 1}/{max_render_retries}): {render_error}")
                     if render_retry < max_render_retries - 1:
@@ -577,6 +966,8 @@ def generate_and_render_video(course_data: dict, max_retries: int = 3):
             if not render_success:
                 raise Exception("Failed to render scene after all retry attempts")
             
+            timings["render_seconds"] += time.time() - render_start
+            
             print(f"✓ Successfully rendered {'with' if use_voiceover else 'without'} voiceover")
             if not use_voiceover:
                 warnings.append("Video generated without voiceover due to ElevenLabs unavailability")
@@ -584,6 +975,21 @@ def generate_and_render_video(course_data: dict, max_retries: int = 3):
         except Exception as e:
             error_msg = str(e).lower()
             error_str = str(e)
+            
+            if use_template:
+                if use_voiceover and ("elevenlabs" in error_msg or "voiceover" in error_msg or "api" in error_msg):
+                    # Only the narration failed, so the silent variant of the template is still worth a try
+                    print(f"⚠ ElevenLabs error in the {template['name']} template, retrying it without voiceover...")
+                    use_voiceover = False
+                    voiceover_fallbacks += 1
+                    warnings.append("Switched to non-voiceover mode due to ElevenLabs error")
+                else:
+                    print(f"⚠ {template['name']} template failed, falling back to Gemini: {e}")
+                    template_error = {"error": error_str, "error_type": getattr(e, 'error_type', type(e).__name__)}
+                    use_template = False
+                scene = None
+                continue
+            
             print(f"Error during attempt {attempt}/{max_attempts}: {e}")
             
             # Store error and code for next attempt
@@ -592,13 +998,14 @@ def generate_and_render_video(course_data: dict, max_retries: int = 3):
             error_history.append({
                 'attempt': attempt,
                 'error': error_str,
-                'error_type': type(e).__name__
+                'error_type': getattr(e, 'error_type', type(e).__name__)
             })
             
             # Check if it's an ElevenLabs-related error
             if use_voiceover and ("elevenlabs" in error_msg or "voiceover" in error_msg or "api" in error_msg):
                 print("⚠ ElevenLabs error detected, switching to non-voiceover mode...")
                 use_voiceover = False
+                voiceover_fallbacks += 1
                 warnings.append("Switched to non-voiceover mode due to ElevenLabs error")
                 scene = None  # Reset to retry
             elif attempt < max_attempts:
@@ -611,55 +1018,343 @@ def generate_and_render_video(course_data: dict, max_retries: int = 3):
                 error_summary = f"Failed after {max_attempts} attempts. Error history: "
                 for i, err in enumerate(error_history, 1):
                     error_summary += f"\n  Attempt {i}: {err['error_type']} - {err['error'][:100]}..."
-                raise Exception(error_summary)
+                failure = Exception(error_summary)
+                failure.error_history = error_history
+                raise failure
     
     if scene is None:
         raise Exception("Failed to generate video after all attempts")
     
-    video_path = f"{config.media_dir}/videos/1080p60/output.mp4"
-    print(f"Reading video from: {video_path}")
+    render_info = {
+        "video_path": video_path,
+        "route": "template" if use_template else "template_fallback" if template else "llm",
+        "render_profile": render_profile,
+        "has_voiceover": use_voiceover,
+        "attempts_used": attempt,
+        "warnings": warnings,
+        "timings": {stage: round(seconds, 3) for stage, seconds in timings.items()},
+        "tts_cache": {**tts_cache_stats, "seconds": round(tts_cache_stats["seconds"], 3)},
+        "render_cache": summarize_render_cache(render_cache_stats),
+        "tts_prefetch": summarize_tts_prefetch(tts_prefetch_reports),
+        "error_history": error_history,
+        "spans": spans,
+        "voiceover_fallbacks": voiceover_fallbacks,
+        "auto_repairs": auto_repairs,
+        "manim_code": manim_code,
+        "token_usage": summarize_token_usage(spans),
+        "few_shot_examples": [{"id": example["id"], "title": example["title"], "score": example["score"]} for example in few_shot],
+    }
+    # TTS runs inside the dry-run and render sandboxes, so report its total as a stage of its own
+    spans.append({"stage": "tts", "seconds": render_info["tts_cache"]["seconds"], "hits": tts_cache_stats["hits"], "misses": tts_cache_stats["misses"]})
+    if template:
+        render_info["template"] = template["name"]
+    if template_error:
+        render_info["template_error"] = template_error
     
-    # Upload to R2 with retry logic
-    print("Uploading to Cloudflare R2...")
-    s3_client = boto3.client(
-        's3',
-        endpoint_url=os.environ["R2_STORAGE_ENDPOINT"],
-        aws_access_key_id=os.environ["R2_STORAGE_ACCESS_KEY"],
-        aws_secret_access_key=os.environ["R2_STORAGE_SECRET_KEY"],
-        region_name='auto'
+    return render_info
+
+
+def probe_audio_stream(video_path: str):
+    """Return the first audio stream's parameters (codec, sample rate, channels) or None"""
+    import subprocess
+    
+    probe = subprocess.run(
+        [
+            "ffprobe", "-v", "error",
+            "-select_streams", "a:0",
+            "-show_entries", "stream=codec_name,sample_rate,channels",
+            "-of", "json",
+            video_path,
+        ],
+        capture_output=True,
+        text=True,
+        check=True,
     )
+    streams = json.loads(probe.stdout).get("streams", [])
+    return streams[0] if streams else None
+
+
+def add_silent_audio_track(video_path: str, output_path: str, audio_stream: dict):
+    """Add a silent audio track matching audio_stream, stream-copying the video"""
+    import subprocess
+    
+    channel_layout = "mono" if int(audio_stream.get("channels", 2)) == 1 else "stereo"
+    sample_rate = audio_stream.get("sample_rate", "48000")
+    subprocess.run(
+        [
+            "ffmpeg", "-y", "-v", "error",
+            "-i", video_path,
+            "-f", "lavfi", "-i", f"anullsrc=channel_layout={channel_layout}:sample_rate={sample_rate}",
+            "-map", "0:v", "-map", "1:a",
+            "-c:v", "copy",
+            "-c:a", audio_stream.get("codec_name", "aac"),
+            "-shortest",
+            output_path,
+        ],
+        check=True,
+    )
+
+
+def concat_segments(segment_paths: list, output_path: str):
+    """
+    Join rendered segments back to back with ffmpeg's concat demuxer (stream copy, no re-encode)
+    
+    Stream copy requires identical stream layouts, so segments without audio
+    (e.g. after a voiceover fallback) get a matching silent track first.
+    """
+    import os
+    import subprocess
+    
+    audio_streams = [probe_audio_stream(path) for path in segment_paths]
+    reference_audio = next((stream for stream in audio_streams if stream), None)
+    
+    if reference_audio:
+        for i, (path, stream) in enumerate(zip(segment_paths, audio_streams)):
+            if stream is None:
+                padded_path = f"{os.path.splitext(output_path)[0]}_segment_{i + 1:03d}_audio.mp4"
+                print(f"  Adding silent audio track to segment {i + 1}...")
+                add_silent_audio_track(path, padded_path, reference_audio)
+                segment_paths[i] = padded_path
+    
+    list_path = f"{os.path.splitext(output_path)[0]}_segments.txt"
+    with open(list_path, "w") as f:
+        for path in segment_paths:
+            f.write(f"file '{path}'\n")
+    
+    print(f"Concatenating {len(segment_paths)} segments (stream copy)...")
+    subprocess.run(
+        [
+            "ffmpeg", "-y", "-v", "error",
+            "-f", "concat", "-safe", "0",
+            "-i", list_path,
+            "-c", "copy",
+            output_path,
+        ],
+        check=True,
+    )
+    print(f"✓ Concatenated segments into {output_path}")
+
+
+def faststart_mp4(video_path: str, output_path: str):
+    """Remux an MP4 with the moov atom up front so players can start on range requests"""
+    import subprocess
+    
+    subprocess.run(
+        [
+            "ffmpeg", "-y", "-v", "error",
+            "-i", video_path,
+            "-c", "copy",
+            "-movflags", "+faststart",
+            output_path,
+        ],
+        check=True,
+    )
+
+
+def render_segments_in_parallel(course_data: dict, max_attempts: int, use_voiceover: bool, speculative_candidates: int = 1, render_profile: str = DEFAULT_RENDER_PROFILE, hls: HlsPublisher = None, workspace: str = MEDIA_DIR, events: JobEvents = None, use_templates: bool = False, use_cache: bool = True):
+    """
+    Render every block as its own segment in parallel containers and concatenate them
+    
+    Segments already stored under the same segment_key (blocks unchanged since
+    an earlier render of the course) are reused as-is, so only edited blocks
+    are generated and rendered; use_cache=False renders every block again.
+    The segment store is pruned and committed when the render finishes. With an HlsPublisher, each segment is published
+    as soon as it and all the segments before it are ready. Segments render in
+    other containers, so events get one "rendering" event per finished segment.
+    """
+    import os
+    
+    events = events or JobEvents()
+    
+    total = len(course_data.get("blocks", []))
+    hashes = block_hashes(course_data)
+    keys = [segment_key(course_data, index, use_voiceover, render_profile, use_templates) for index in range(1, total + 1)]
+    
+    with shared_volume_session(segment_volume, "segment store", prune_segment_store):
+        stored = {}
+        for index, key in enumerate(keys, start=1):
+            segment = load_stored_segment(key, index) if use_cache else None
+            if segment:
+                stored[index] = segment
+        pending = [index for index in range(1, total + 1) if index not in stored]
+        
+        print(f"Rendering {len(pending)} of {total} segments in parallel ({len(stored)} reused)...")
+        events.publish("rendering", segment=0, segments=total, reused=len(stored))
+        segments = []
+        spans = []
+        # starmap yields in input order, so every segment arrives after the ones before it
+        rendered = iter(VideoGenerator().render_segment.starmap(
+            [
+                (course_data, index, total, keys[index - 1], max_attempts, use_voiceover, speculative_candidates, render_profile, use_templates)
+                for index in pending
+            ]
+        ) if pending else [])
+        for index in range(1, total + 1):
+            segment = stored.get(index) or next(rendered)
+            segment["block_hash"] = hashes[index - 1]
+            segments.append(segment)
+            events.publish("rendering", segment=index, segments=total, reused=segment["reused"])
+            if hls:
+                if not os.path.exists(segment["segment_path"]):
+                    # Pick up the segment file committed by the other container
+                    reload_volume(segment_volume, "segment store")
+                with stage_span(spans, "hls_publish", segment=segment["index"]):
+                    hls.add_video(segment["segment_path"])
+        
+        # Pick up the segment files committed by the other containers
+        if not all(os.path.exists(segment["segment_path"]) for segment in segments):
+            reload_volume(segment_volume, "segment store")
+        
+        video_path = f"{workspace}/output_parallel.mp4"
+        os.makedirs(os.path.dirname(video_path), exist_ok=True)
+        events.publish("encoding", step="concat")
+        with stage_span(spans, "encode", step="concat"):
+            concat_segments([segment["segment_path"] for segment in segments], video_path)
+    
+    warnings = []
+    for segment in segments:
+        warnings.extend(f"Segment {segment['index']}: {warning}" for warning in segment["warnings"])
+    
+    routes = {segment["route"] for segment in segments}
+    return {
+        "video_path": video_path,
+        "route": routes.pop() if len(routes) == 1 else "mixed",
+        "segment_reuse": {"reused": len(stored), "rendered": len(pending)},
+        "has_voiceover": any(segment["has_voiceover"] for segment in segments),
+        "attempts_used": max(segment["attempts_used"] for segment in segments),
+        "warnings": warnings,
+        "segments": [{key: value for key, value in segment.items() if key != "spans"} for segment in segments],
+        "tts_cache": {
+            counter: sum(segment["tts_cache"][counter] for segment in segments)
+            for counter in ("hits", "misses", "seconds")
+        },
+        "render_cache": summarize_render_cache({
+            counter: sum(segment["render_cache"][counter] for segment in segments)
+            for counter in RENDER_CACHE_COUNTERS
+        }),
+        "tts_prefetch": summarize_tts_prefetch([segment["tts_prefetch"] for segment in segments]),
+        "error_history": [{**error, "segment": segment["index"]} for segment in segments for error in segment["error_history"]],
+        "spans": [{**span, "segment": segment["index"]} for segment in segments for span in segment["spans"]] + spans,
+        "voiceover_fallbacks": sum(segment["voiceover_fallbacks"] for segment in segments),
+        "auto_repairs": {
+            "attempts_saved": sum(segment["auto_repairs"]["attempts_saved"] for segment in segments),
+            "repairs": [repair for segment in segments for repair in segment["auto_repairs"]["repairs"]],
+        },
+        # Segments run concurrently, so the slowest one bounds each stage
+        "timings": {
+            stage: max(segment["timings"][stage] for segment in segments)
+            for stage in segments[0]["timings"]
+        },
+    }
+
+
+def run_generation_pipeline(course_data: dict, max_retries: int = 3, use_cache: bool = True, render_mode: str = "single", speculative_candidates: int = 1, model=None, s3_client=None, elevenlabs_available: bool = None, stream_upload: bool = False, output_format: str = "mp4", job_id: str = None, render_profile: str = DEFAULT_RENDER_PROFILE, workspace: str = MEDIA_DIR, events: JobEvents = None, use_templates: bool = False):
+    import os
+    
+    events = events or JobEvents()
+    if render_mode not in RENDER_MODES:
+        raise Exception(f"Unknown render_mode '{render_mode}', expected one of: {', '.join(RENDER_MODES)}")
+    if output_format not in OUTPUT_FORMATS:
+        raise Exception(f"Unknown output_format '{output_format}', expected one of: {', '.join(OUTPUT_FORMATS)}")
+    if render_profile not in RENDER_PROFILES:
+        raise Exception(f"Unknown render_profile '{render_profile}', expected one of: {', '.join(RENDER_PROFILES)}")
+    if output_format == "hls" and render_mode != "parallel":
+        raise Exception("output_format 'hls' requires render_mode 'parallel'")
+    if stream_upload and render_mode != "single":
+        raise Exception("stream_upload is only supported with render_mode 'single'")
+    upload_mode = "stream" if stream_upload else "faststart"
+    
+    # Serve identical course payloads straight from the result cache
+    cache_key = result_cache_key(course_data, render_mode, output_format, render_profile, use_templates, upload_mode)
+    if use_cache:
+        cached = get_cached_result(cache_key)
+        if cached:
+            print(f"✓ Result cache hit: {cache_key[:12]}...")
+            result = dict(cached["result"])
+            result["cache"] = "hit"
+            result["cached_at"] = datetime.fromtimestamp(cached["cached_at"]).isoformat()
+            return result
+        print(f"Result cache miss: {cache_key[:12]}...")
+    
+    if elevenlabs_available is None:
+        elevenlabs_available = configure_api_keys()
+    
+    # Prepare course content for Gemini
+    title = course_data.get("title", "Course")
+    blocks = course_data.get("blocks", [])
+    subject = course_data.get("subject", "")
+    
+    course_content = build_course_content(title, subject, blocks)
+    
+    print(f"Generating Manim code for: {title}")
+    
+    # Try with voiceover first if ElevenLabs is available
+    use_voiceover = elevenlabs_available
+    max_attempts = max(1, min(max_retries, 10))  # Clamp between 1 and 10
+    speculative_candidates = max(1, min(speculative_candidates, MAX_SPECULATIVE_CANDIDATES))
     
     # Generate filename from title
     safe_title = "".join(c if c.isalnum() else "_" for c in title).lower()
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     r2_filename = f"videos/{safe_title}_{timestamp}.mp4"
     
-    # Retry logic for R2 upload
-    max_upload_retries = 3
-    upload_retry_delay = 2
+    hls = None
+    if output_format == "hls":
+        if s3_client is None:
+            s3_client = create_r2_client()
+        hls = HlsPublisher(s3_client, f"videos/{safe_title}_{timestamp}_hls", f"{workspace}/hls", job_id=job_id)
     
-    for upload_retry in range(max_upload_retries):
-        try:
-            print(f"  Upload attempt {upload_retry + 1}/{max_upload_retries}...")
-            with open(video_path, "rb") as video_file:
-                s3_client.upload_fileobj(
-                    video_file,
-                    os.environ["R2_STORAGE_BUCKET_NAME"],
-                    r2_filename,
-                    ExtraArgs={'ContentType': 'video/mp4'}
-                )
-            print(f"✓ Uploaded to R2: {r2_filename}")
-            break
-        except Exception as upload_error:
-            print(f"  ✗ Upload error (attempt {upload_retry + 1}/{max_upload_retries}): {upload_error}")
-            if upload_retry < max_upload_retries - 1:
-                wait_time = upload_retry_delay * (2 ** upload_retry)
-                print(f"  Retrying upload in {wait_time} seconds...")
-                time.sleep(wait_time)
-            else:
-                raise Exception(f"Failed to upload to R2 after {max_upload_retries} attempts: {upload_error}")
+    if render_mode == "parallel" and len(blocks) > 1:
+        # Fan blocks out to independent containers and stitch the segments back together
+        render_info = render_segments_in_parallel(course_data, max_attempts, use_voiceover, speculative_candidates, render_profile, hls=hls, workspace=workspace, events=events, use_templates=use_templates, use_cache=use_cache)
+    else:
+        # Opted-in courses with a common visual shape go straight to a parametric template instead of Gemini
+        template = classify_course(title, subject, blocks) if use_templates else None
+        if template:
+            print(f"Routing to the {template['name']} scene template")
+            template.update(title=title, blocks=blocks)
+        
+        # Few-shot context from similar scenes that rendered before, in case the template falls back to Gemini
+        examples = retrieve_similar_scenes(title, subject, blocks)
+        if examples:
+            print(f"Found {len(examples)} similar scene(s) in the library")
+        
+        with persistent_tts_cache(), persistent_render_cache():
+            render_info = generate_and_render_scene(
+                course_content, max_attempts, use_voiceover, speculative_candidates=speculative_candidates, model=model,
+                examples=examples, subject=subject, render_profile=render_profile,
+                media_dir=workspace, template=template, events=events,
+            )
+        store_successful_scene(title, subject, blocks, render_info)
+        if hls:
+            # Only a one-block parallel render gets here, so its whole video is the one segment
+            with stage_span(render_info["spans"], "hls_publish"):
+                hls.add_video(render_info["video_path"])
     
-    r2_url = f"{os.environ['R2_STORAGE_BASE_URL']}/{r2_filename}"
+    spans = render_info["spans"]
+    video_path = render_info["video_path"]
+    use_voiceover = render_info["has_voiceover"]
+    attempt = render_info["attempts_used"]
+    warnings = render_info["warnings"]
+    print(f"Reading video from: {video_path}")
+    
+    hls_info = hls.finish() if hls else None
+    
+    upload_path = video_path
+    if upload_mode == "faststart":
+        # Move the moov atom to the front for range-request-friendly progressive download
+        upload_path = f"{os.path.splitext(video_path)[0]}_faststart.mp4"
+        events.publish("encoding", step="faststart")
+        with stage_span(spans, "encode", step="faststart"):
+            faststart_mp4(video_path, upload_path)
+    # Manim only writes the final movie once the render ends, so the upload always starts after it
+    with stage_span(spans, "upload") as span:
+        span["bytes"] = os.path.getsize(upload_path)
+        events.publish("uploading", bytes_sent=0, bytes_total=span["bytes"])
+        r2_url = upload_to_r2(
+            upload_path, r2_filename, s3_client=s3_client,
+            on_progress=lambda bytes_sent: events.publish("uploading", bytes_sent=bytes_sent, bytes_total=span["bytes"]),
+        )
     
     result = {
         "r2_url": r2_url,
@@ -669,18 +1364,336 @@ def generate_and_render_video(course_data: dict, max_retries: int = 3):
         "has_voiceover": use_voiceover,
         "attempts_used": attempt,
         "max_attempts": max_attempts,
+        "render_mode": render_mode,
+        "speculative_candidates": speculative_candidates,
+        "output_format": output_format,
+        "upload_mode": upload_mode,
+        "render_profile": render_profile,
+        "route": render_info["route"],
+        "subject": subject,
+        "cache": "miss",
+        "cache_key": cache_key,
+        # Lets POST /regenerate tell which blocks of a later edit actually changed
+        "block_hashes": block_hashes(course_data),
     }
     
     if warnings:
         result["warnings"] = warnings
     
+    if "segments" in render_info:
+        result["segments"] = render_info["segments"]
+        result["segment_reuse"] = render_info["segment_reuse"]
+    
+    if render_info.get("template"):
+        result["template"] = render_info["template"]
+    
+    if render_info.get("template_error"):
+        result["template_error"] = render_info["template_error"]
+    
+    if "tts_cache" in render_info:
+        result["tts_cache"] = render_info["tts_cache"]
+    
+    if "render_cache" in render_info:
+        result["render_cache"] = render_info["render_cache"]
+    
+    if render_info.get("tts_prefetch", {}).get("lines"):
+        result["tts_prefetch"] = render_info["tts_prefetch"]
+    
+    if "timings" in render_info:
+        result["timings"] = render_info["timings"]
+    
+    if render_info.get("voiceover_fallbacks"):
+        result["voiceover_fallbacks"] = render_info["voiceover_fallbacks"]
+    
+    if render_info.get("auto_repairs", {}).get("repairs"):
+        result["auto_repairs"] = render_info["auto_repairs"]
+    
+    if render_info.get("few_shot_examples"):
+        result["few_shot_examples"] = render_info["few_shot_examples"]
+    
+    if render_info.get("token_usage"):
+        result["token_usage"] = render_info["token_usage"]
+    
+    # Lets a single-scene video be re-rendered at another profile without asking Gemini again
+    if render_info.get("manim_code"):
+        result["manim_code"] = render_info["manim_code"]
+    
+    result["spans"] = spans
+    
+    if hls_info:
+        result["playlist_url"] = hls_info["playlist_url"]
+        result["hls"] = hls_info
+    
+    if render_info.get("error_history"):
+        result["error_history"] = render_info["error_history"]
+    
     if attempt > 1:
         result["regenerated"] = True
         result["regeneration_count"] = attempt - 1
     
+    # Only cache full-quality results - degraded (e.g. voiceover fallback) videos should be retried
+    if not warnings:
+        store_cached_result(cache_key, result)
+    
     return result
 
 
+def render_upgrade(manim_code: str, r2_filename: str, render_profile: str = UPGRADE_RENDER_PROFILE, s3_client=None, media_dir: str = MEDIA_DIR) -> dict:
+    """
+    Re-render already validated scene code at another render profile and upload it next to the original
+    
+    Skips Gemini and the dry run; narration and unchanged Tex come from the shared caches.
+    """
+    import os
+    
+    spans = []
+    with persistent_tts_cache(), persistent_render_cache():
+        with stage_span(spans, "render", render_profile=render_profile) as span:
+            scene = run_scene_in_sandbox(manim_code, "render", RENDER_LIMITS, media_dir=media_dir, render_profile=render_profile)
+            span["peak_rss_bytes"] = scene["peak_rss_bytes"]
+    
+    video_path = scene["video_path"]
+    faststart_path = f"{os.path.splitext(video_path)[0]}_faststart.mp4"
+    with stage_span(spans, "encode", step="faststart"):
+        faststart_mp4(video_path, faststart_path)
+    
+    upgrade_filename = f"{os.path.splitext(r2_filename)[0]}_{render_profile}.mp4"
+    with stage_span(spans, "upload") as span:
+        r2_url = upload_to_r2(faststart_path, upgrade_filename, s3_client=s3_client)
+        span["bytes"] = os.path.getsize(faststart_path)
+    
+    return {
+        "status": "succeeded",
+        "render_profile": render_profile,
+        "r2_url": r2_url,
+        "r2_filename": upgrade_filename,
+        "tts_cache": scene["tts_cache"],
+        "render_cache": summarize_render_cache(scene["render_cache"]),
+        "spans": spans,
+    }
+
+
+@app.cls(
+    image=image,
+    secrets=[
+        modal.Secret.from_name("elevenlabs-api-key"),
+        modal.Secret.from_name("r2-credentials"),
+        modal.Secret.from_name("gemini-api-key")
+    ],
+    volumes={SEGMENTS_DIR: segment_volume, TTS_CACHE_DIR: tts_cache_volume, RENDER_CACHE_DIR: render_cache_volume, SCENE_LIBRARY_DIR: scene_library_volume},
+    timeout=900,
+    enable_memory_snapshot=True,
+)
+@modal.concurrent(max_inputs=JOBS_PER_CONTAINER)
+class VideoGenerator:
+    """
+    Render worker that keeps Manim, Gemini and R2 clients warm across invocations
+    
+    Heavy imports happen once in a memory-snapshotted setup phase, so restored
+    containers skip them entirely. Clients that need secrets are created after
+    restore, once per container. Several inputs can run at once, each in its own
+    job workspace with scenes rendered in separate sandbox processes.
+    """
+    
+    @modal.enter(snap=True)
+    def preload(self):
+        import os
+        
+        preload_start = time.time()
+        
+        # Imported for their side effects: later imports in the pipeline hit sys.modules
+        import boto3
+        import google.generativeai
+        import manim
+        import manim_voiceover
+        import manim_voiceover.services.elevenlabs
+        
+        self.preload_seconds = time.time() - preload_start
+        self.preload_task_id = os.environ.get("MODAL_TASK_ID")
+        self.invocations = 0
+        self.invocations_lock = threading.Lock()  # Inputs run concurrently (see @modal.concurrent)
+        print(f"✓ Preloaded Manim, Gemini and boto3 in {self.preload_seconds:.2f}s")
+    
+    @modal.enter(snap=False)
+    def connect(self):
+        import google.generativeai as genai
+        import os
+        
+        connect_start = time.time()
+        # Containers restored from the snapshot have a new task id and never ran preload themselves
+        self.restored = os.environ.get("MODAL_TASK_ID") != self.preload_task_id
+        self.elevenlabs_available = configure_api_keys()
+        self.model = genai.GenerativeModel(GEMINI_MODEL)
+        self.s3_client = create_r2_client()
+        # Fork server inherits the API keys set above, so start it only after configuring them
+        start_sandbox_pool()
+        self.connect_seconds = time.time() - connect_start
+        print(f"✓ Connected Gemini and R2 clients in {self.connect_seconds:.2f}s{' after a snapshot restore' if self.restored else ''}")
+    
+    def container_stats(self) -> dict:
+        """
+        Startup cost paid by this invocation: the setup this container ran on a cold start, nothing when warm
+        
+        A container restored from the memory snapshot carries the preload time of
+        the container that took it, so only its own connect time is counted.
+        """
+        with self.invocations_lock:
+            self.invocations += 1
+            invocations = self.invocations
+        cold_start = invocations == 1
+        preload_seconds = 0.0 if self.restored else self.preload_seconds
+        return {
+            "cold_start": cold_start,
+            "restored": self.restored,
+            "startup_seconds": round(preload_seconds + self.connect_seconds, 3) if cold_start else 0.0,
+            "preload_seconds": round(preload_seconds, 3),
+            "connect_seconds": round(self.connect_seconds, 3),
+            "invocations": invocations,
+        }
+    
+    @modal.method()
+    def generate(self, course_data: dict, max_retries: int = 3, use_cache: bool = True, job_id: str = None, render_mode: str = "single", speculative_candidates: int = 1, stream_upload: bool = False, output_format: str = "mp4", render_profile: str = DEFAULT_RENDER_PROFILE, upgrade_to_hq: bool = False, use_templates: bool = False):
+        container = self.container_stats()
+        update_job(job_id, status="running", started_at=time.time())
+        job_start = time.time()
+        events = JobEvents(job_id)
+        events.publish("started", cold_start=container["cold_start"], render_mode=render_mode)
+        
+        try:
+            with job_workspace(job_id) as workspace:
+                result = run_generation_pipeline(
+                    course_data,
+                    max_retries=max_retries,
+                    use_cache=use_cache,
+                    render_mode=render_mode,
+                    speculative_candidates=speculative_candidates,
+                    model=self.model,
+                    s3_client=self.s3_client,
+                    elevenlabs_available=self.elevenlabs_available,
+                    stream_upload=stream_upload,
+                    output_format=output_format,
+                    job_id=job_id,
+                    render_profile=render_profile,
+                    workspace=workspace,
+                    events=events,
+                    use_templates=use_templates,
+                )
+        except Exception as e:
+            update_job(job_id, status="failed", error=str(e), finished_at=time.time())
+            events.publish("failed", error=str(e))
+            events.close()
+            release_inflight_claim(job_id)
+            record_job_metrics("failed", time.time() - job_start, error_history=getattr(e, "error_history", None))
+            raise
+        
+        result["container"] = container
+        if upgrade_to_hq and render_profile != UPGRADE_RENDER_PROFILE and result.get("manim_code"):
+            # Hand back the quick render now and re-render the same code at HQ in the background
+            result["upgrade"] = {"status": "queued", "render_profile": UPGRADE_RENDER_PROFILE}
+            update_job(job_id, upgrade=result["upgrade"])
+            self.upgrade.spawn(result["manim_code"], result["r2_filename"], job_id=job_id)
+        update_job(job_id, status="succeeded", result=result, finished_at=time.time())
+        events.publish("done", r2_url=result["r2_url"], cache=result["cache"], seconds=round(time.time() - job_start, 3))
+        events.close()
+        release_inflight_claim(job_id)
+        record_job_metrics("succeeded", time.time() - job_start, result=result)
+        return result
+    
+    @modal.method()
+    def upgrade(self, manim_code: str, r2_filename: str, job_id: str = None, render_profile: str = UPGRADE_RENDER_PROFILE):
+        """Re-render a finished job's scene at a higher render profile, reporting progress as the job's "upgrade" field"""
+        update_job(job_id, upgrade={"status": "running", "render_profile": render_profile})
+        try:
+            with job_workspace(f"{job_id}-upgrade" if job_id else "upgrade") as workspace:
+                upgrade = render_upgrade(manim_code, r2_filename, render_profile, s3_client=self.s3_client, media_dir=workspace)
+        except Exception as e:
+            update_job(job_id, upgrade={"status": "failed", "render_profile": render_profile, "error": str(e)})
+            raise
+        
+        update_job(job_id, upgrade=upgrade)
+        print(f"✓ Upgraded render uploaded: {upgrade['r2_url']}")
+        return upgrade
+    
+    @modal.method()
+    def render_segment(self, course_data: dict, index: int, total: int, key: str, max_attempts: int, use_voiceover: bool, speculative_candidates: int = 1, render_profile: str = DEFAULT_RENDER_PROFILE, use_templates: bool = False):
+        """Generate and render a single course block as one segment of a parallel render, stored under its segment_key"""
+        import os
+        import shutil
+        
+        container = self.container_stats()
+        
+        title = course_data.get("title", "Course")
+        blocks = course_data.get("blocks", [])
+        subject = course_data.get("subject", "")
+        
+        # Give Gemini the full course for context, the segment instructions restrict it to one block
+        course_content = build_course_content(title, subject, blocks)
+        
+        print(f"Rendering segment {index}/{total} for: {title}")
+        
+        # Classify the whole course so template state (e.g. array contents) carries across segments
+        template = classify_course(title, subject, blocks) if use_templates else None
+        if template:
+            template.update(title=title, blocks=blocks, segment=[index, total])
+        
+        # The segment only covers its own block, so look up and store examples by that block
+        block = blocks[index - 1:index]
+        examples = retrieve_similar_scenes(title, subject, block)
+        
+        with job_workspace(f"segment-{index:03d}") as workspace:
+            with persistent_tts_cache(), persistent_render_cache():
+                render_info = generate_and_render_scene(
+                    course_content,
+                    max_attempts,
+                    use_voiceover and self.elevenlabs_available,
+                    extra_instructions=segment_instructions(index, total),
+                    speculative_candidates=speculative_candidates,
+                    model=self.model,
+                    examples=examples,
+                    subject=subject,
+                    render_profile=render_profile,
+                    media_dir=workspace,
+                    template=template,
+                )
+            store_successful_scene(title, subject, block, render_info)
+            
+            if render_info["has_voiceover"] == use_voiceover:
+                segment_path = store_segment(key, render_info["video_path"], {
+                    "has_voiceover": render_info["has_voiceover"],
+                    "route": render_info["route"],
+                    "rendered_at": datetime.now().isoformat(),
+                })
+            else:
+                # A voiceover fallback is not worth reusing, keep it out of the content-addressed store
+                os.makedirs(SEGMENT_STORE_DIR, exist_ok=True)
+                segment_path = f"{SEGMENT_STORE_DIR}/{key}-{os.path.basename(workspace)}.mp4"
+                shutil.copyfile(render_info["video_path"], segment_path)
+            segment_volume.commit()
+        print(f"✓ Segment {index}/{total} saved to {segment_path}")
+        
+        return {
+            "index": index,
+            "segment_path": segment_path,
+            "segment_key": key,
+            "reused": False,
+            "route": render_info["route"],
+            "template": render_info.get("template"),
+            "has_voiceover": render_info["has_voiceover"],
+            "attempts_used": render_info["attempts_used"],
+            "warnings": render_info["warnings"],
+            "tts_cache": render_info["tts_cache"],
+            "render_cache": render_info["render_cache"],
+            "tts_prefetch": render_info["tts_prefetch"],
+            "timings": render_info["timings"],
+            "error_history": render_info["error_history"],
+            "spans": render_info["spans"],
+            "voiceover_fallbacks": render_info["voiceover_fallbacks"],
+            "auto_repairs": render_info["auto_repairs"],
+            "few_shot_examples": render_info["few_shot_examples"],
+            "container": container,
+        }
+
+
 @app.function(
     image=image,
     secrets=[
@@ -689,89 +1702,26 @@ def generate_and_render_video(course_data: dict, max_retries: int = 3):
         modal.Secret.from_name("gemini-api-key"),
         modal.Secret.from_name("api-auth-key")
     ],
+    timeout=BATCH_TIMEOUT_SECONDS,  # Batch requests stream results until every item has finished
+    max_containers=1,  # Admission control state is in memory, so one container keeps the limits global
 )
+@modal.concurrent(max_inputs=500)  # Handlers only enqueue/poll jobs, so one container serves many clients
 @modal.asgi_app()
 def fastapi_app():
-    import os 
-    from fastapi import FastAPI, HTTPException, Header
-    from fastapi.middleware.cors import CORSMiddleware
-    from typing import Optional
-    
-    web_app = FastAPI(title="Manim Course Video Generator")
-    
-    # Enable CORS
-    web_app.add_middleware(
-        CORSMiddleware,
-        allow_origins=["*"],
-        allow_credentials=True,
-        allow_methods=["*"],
-        allow_headers=["*"],
-    )
+    return create_web_app(VideoGenerator)
 
-    def verify_api_key(x_api_key: Optional[str] = Header(None)):
-        if not x_api_key:
-            raise HTTPException(status_code=401, detail="API key is missing")
-        
-        # Get the valid API key from environment
-        valid_api_key = os.environ.get("API_AUTH_KEY")
-        
-        if x_api_key != valid_api_key:
-            raise HTTPException(status_code=403, detail="Invalid API key")
-        
-        return x_api_key
-    
-    @web_app.post("/generate")
-    async def generate_course_video(data: dict, api_key: str = Header(..., alias="X-API-Key")):
-        """
-        Generate educational video from course content summary
-        
-        Expected body:
-        {
-            "title": "Introduction to Arrays",
-            "subject": "Computer Science",
-            "blocks": [
-                "Block 1 content...",
-                "Block 2 content...",
-                ...
-            ],
-            "max_retries": 3  // Optional: Maximum retry attempts (1-10, default: 3)
-        }
-        """
-        verify_api_key(api_key)
 
-        try:
-            if "title" not in data or "blocks" not in data:
-                raise HTTPException(
-                    status_code=400, 
-                    detail="Missing required fields: 'title' and 'blocks'"
-                )
-            
-            # Extract max_retries from data if provided, otherwise use default
-            max_retries = data.get("max_retries", 3)
-            
-            # Create course_data dict without max_retries
-            course_data = {
-                "title": data["title"],
-                "blocks": data["blocks"],
-                "subject": data.get("subject", "")
-            }
-            
-            result = generate_and_render_video.remote(course_data, max_retries=max_retries)
-            return result
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=str(e))
+@app.function(image=image.add_local_python_source("benchmark"), timeout=60 * 60)
+def run_benchmark(options: dict) -> dict:
+    """Run the offline benchmark corpus in the production image, returning its environment and per-scene results"""
+    import benchmark
     
-    @web_app.get("/health")
-    async def health(api_key: str = Header(..., alias="X-API-Key")):
-        verify_api_key(api_key)
-        return {"status": "healthy"}
-    
-    return web_app
+    return {"environment": benchmark.benchmark_environment("modal"), "scenes": benchmark.measure(**options)}
 
 
 @app.local_entrypoint()
 def main():
-    result = generate_and_render_video.remote({
+    result = VideoGenerator().generate.remote({
         "title": "Introduction to Arrays",
         "subject": "Computer Science",
         "blocks": [
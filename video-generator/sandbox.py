@@ -0,0 +1,331 @@
+"""Forked render sandbox that runs generated scenes under resource limits"""
+
+import threading
+import time
+
+from config import DEFAULT_RENDER_PROFILE, GENERATED_CODE_FILENAME, MEDIA_DIR, RENDER_PROFILES
+from cache import (
+    RENDER_CACHE_COUNTERS, install_render_cache, route_voiceover_cache_index,
+    make_cached_speech_service, publish_partial_movies,
+)
+
+# Generated scenes run in fork-server subprocesses under these limits, and are killed when exceeded.
+# RSS counts the worker and everything it spawns (LaTeX, dvisvgm, ffmpeg); RLIMIT_AS is also set per
+# process as a backstop, with headroom because thread stacks and malloc arenas reserve address space.
+# A render that reports no progress (see install_render_progress) for stall_seconds is killed too.
+DRY_RUN_LIMITS = {
+    "wall_seconds": 120, "cpu_seconds": 180,
+    "max_rss_bytes": 3 * 1024 * 1024 * 1024, "max_address_space_bytes": 12 * 1024 * 1024 * 1024,
+}
+RENDER_LIMITS = {
+    "wall_seconds": 600, "cpu_seconds": 1200, "stall_seconds": 120,
+    "max_rss_bytes": 6 * 1024 * 1024 * 1024, "max_address_space_bytes": 24 * 1024 * 1024 * 1024,
+}
+SANDBOX_POLL_SECONDS = 0.25
+
+RENDER_PROGRESS_SECONDS = 1.0  # Minimum gap between render progress reports from a sandbox
+
+
+def apply_render_profile(render_profile: str):
+    """Set Manim's resolution and frame rate (call inside a sandbox subprocess)"""
+    from manim import config
+    
+    profile = RENDER_PROFILES[render_profile]
+    config.frame_size = (profile["pixel_width"], profile["pixel_height"])
+    config.frame_rate = profile["frame_rate"]
+
+
+def render_output_path(render_profile: str, media_dir: str = MEDIA_DIR) -> str:
+    """Where Manim writes the final movie for a render profile"""
+    profile = RENDER_PROFILES[render_profile]
+    # Manim's video_dir is {media_dir}/videos/{module_name}/{pixel_height}p{frame_rate}, and exec'd code has no module name
+    return f"{media_dir}/videos/{profile['pixel_height']}p{profile['frame_rate']:g}/output.mp4"
+
+
+def install_render_progress(report, interval: float = RENDER_PROGRESS_SECONDS):
+    """
+    Report the current animation and frames written while a scene renders
+    
+    Call inside a sandbox subprocess. report is called with {"animation",
+    "frames"} at most once per interval (cached partial movies write no frames).
+    """
+    from manim.renderer.cairo_renderer import CairoRenderer
+    from manim.scene.scene_file_writer import SceneFileWriter
+    
+    progress = {"animation": 0, "frames": 0}
+    last_report = [0.0]
+    
+    def maybe_report():
+        now = time.time()
+        if now - last_report[0] >= interval:
+            last_report[0] = now
+            report(dict(progress))
+    
+    original_play = CairoRenderer.play
+    original_write_frame = SceneFileWriter.write_frame
+    
+    def play(self, *args, **kwargs):
+        progress["animation"] = self.num_plays + 1
+        maybe_report()
+        return original_play(self, *args, **kwargs)
+    
+    def write_frame(self, frame_or_renderer, num_frames=1):
+        progress["frames"] += num_frames
+        maybe_report()
+        return original_write_frame(self, frame_or_renderer, num_frames)
+    
+    CairoRenderer.play = play
+    SceneFileWriter.write_frame = write_frame
+
+
+def dry_run_scene(scene_class) -> int:
+    """Run construct() end to end at the lowest quality with animations skipped and no output written, returning the number of animations"""
+    from manim import tempconfig
+    
+    with tempconfig({"quality": "low_quality", "dry_run": True}):
+        scene = scene_class(skip_animations=True)
+        scene.render()
+        return scene.renderer.num_plays
+
+
+class SceneExecutionError(Exception):
+    """Generated scene code raised inside the sandbox; error_type names the original exception"""
+    
+    def __init__(self, error_type: str, message: str, outcome: dict = None):
+        super().__init__(f"{error_type}: {message}")
+        self.error_type = error_type
+        self.outcome = outcome or {}
+
+
+class CandidateCancelled(Exception):
+    """A speculative candidate was stopped because another candidate already validated"""
+
+
+class ResourceLimitExceeded(Exception):
+    """A sandboxed scene exceeded its wall-clock, CPU or memory limit and was killed"""
+    
+    error_type = "ResourceLimitExceeded"
+
+
+_sandbox_context = None
+
+
+def get_sandbox_context():
+    """Multiprocessing context whose fork server has Manim imported, so each scene forks warm"""
+    global _sandbox_context
+    if _sandbox_context is None:
+        import multiprocessing
+        
+        preload = ["manim", "manim_voiceover", "manim_voiceover.services.elevenlabs"]
+        # Children unpickle the worker function by module name, so preload this module too
+        if __name__ != "__main__":
+            preload.append(__name__)
+        
+        _sandbox_context = multiprocessing.get_context("forkserver")
+        _sandbox_context.set_forkserver_preload(preload)
+    return _sandbox_context
+
+
+def start_sandbox_pool():
+    """Start the fork server now so its imports are paid before the first scene arrives"""
+    from multiprocessing import forkserver
+    
+    get_sandbox_context()
+    forkserver.ensure_running()
+
+
+def generated_code_line(error: BaseException):
+    """Line number in the generated code where error was raised, if it came from there"""
+    tb = error.__traceback__
+    line = getattr(error, "lineno", None) if isinstance(error, SyntaxError) else None
+    while tb is not None:
+        if tb.tb_frame.f_code.co_filename == GENERATED_CODE_FILENAME:
+            line = tb.tb_lineno
+        tb = tb.tb_next
+    return line
+
+
+def process_rss_bytes(pid: int) -> int:
+    """Resident set size of a process, read from /proc"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return 0
+
+
+def process_tree_rss_bytes(pid: int) -> int:
+    """Resident set size of a process and all of its descendants, read from /proc"""
+    import os
+    
+    total = 0
+    pending = [pid]
+    while pending:
+        pid = pending.pop()
+        total += process_rss_bytes(pid)
+        try:
+            for task in os.listdir(f"/proc/{pid}/task"):
+                with open(f"/proc/{pid}/task/{task}/children") as f:
+                    pending.extend(int(child) for child in f.read().split())
+        except (OSError, ValueError):
+            pass
+    return total
+
+
+def _sandbox_worker(conn, manim_code: str, mode: str, media_dir: str, cpu_seconds: int, render_profile: str, address_space_bytes: int = None):
+    """Entry point of a sandbox subprocess: execute generated code and dry run or render it"""
+    import os
+    import resource
+    
+    # Lead a process group so the parent can kill anything the scene spawns along with it
+    os.setpgrp()
+    
+    outcome = {
+        "tts_cache": {"hits": 0, "misses": 0, "seconds": 0.0},
+        "render_cache": {counter: 0 for counter in RENDER_CACHE_COUNTERS},
+    }
+    try:
+        # The kernel sends SIGXCPU at the soft limit and SIGKILL at the hard limit
+        resource.setrlimit(resource.RLIMIT_CPU, (cpu_seconds, cpu_seconds + 5))
+        # Inherited by every subprocess, so runaway LaTeX or ffmpeg children are capped too
+        if address_space_bytes:
+            resource.setrlimit(resource.RLIMIT_AS, (address_space_bytes, address_space_bytes))
+        
+        # Route narration through the shared TTS cache (this process is a fresh fork, so patch freely)
+        import manim_voiceover.services.elevenlabs as elevenlabs_module
+        elevenlabs_module.ElevenLabsService = make_cached_speech_service(
+            elevenlabs_module.ElevenLabsService, outcome["tts_cache"]
+        )
+        route_voiceover_cache_index()
+        
+        from manim import config, Scene
+        from manim_voiceover import VoiceoverScene
+        
+        config.media_dir = media_dir
+        config.output_file = "output"
+        if mode == "render":
+            apply_render_profile(render_profile)
+            install_render_progress(lambda progress: conn.send({"progress": progress}))
+        partial_dir = install_render_cache(outcome["render_cache"])
+        
+        # Execute the generated code to create the scene class
+        exec_globals = {
+            'Scene': Scene,
+            'VoiceoverScene': VoiceoverScene,
+            'ElevenLabsService': elevenlabs_module.ElevenLabsService,
+        }
+        
+        # Import all Manim components
+        exec("from manim import *", exec_globals)
+        exec(compile(manim_code, GENERATED_CODE_FILENAME, "exec"), exec_globals)
+        
+        # Find the scene class
+        scene_class = exec_globals.get('CourseScene')
+        if not scene_class:
+            raise Exception("Generated code must define a class named 'CourseScene'")
+        
+        if mode == "dry_run":
+            outcome["animations"] = dry_run_scene(scene_class)
+        else:
+            scene = scene_class()
+            scene.render()
+            publish_partial_movies(scene.renderer.file_writer.partial_movie_directory, partial_dir)
+            outcome["video_path"] = str(scene.renderer.file_writer.movie_file_path)
+        
+        outcome["ok"] = True
+    except BaseException as e:
+        outcome.update(ok=False, error_type=type(e).__name__, error=str(e), line=generated_code_line(e))
+    
+    conn.send(outcome)
+    conn.close()
+
+
+def run_scene_in_sandbox(manim_code: str, mode: str, limits: dict, media_dir: str = MEDIA_DIR, render_profile: str = DEFAULT_RENDER_PROFILE, on_progress=None, cancel: threading.Event = None) -> dict:
+    """
+    Execute generated scene code in a fork-server subprocess under wall-clock, CPU and RSS limits
+    
+    mode is "dry_run" or "render" (at render_profile). Returns the worker's outcome
+    (TTS and render cache stats, the animation count of a dry run, the video path
+    when rendering, peak RSS, wall time); raises SceneExecutionError if the scene
+    raised and ResourceLimitExceeded if it was killed for exceeding a limit.
+    While rendering, on_progress is called with the worker's progress reports
+    (see install_render_progress); a render silent for limits["stall_seconds"]
+    is killed. Setting cancel kills the worker and raises CandidateCancelled.
+    Killing takes the worker's whole process group, so its subprocesses go too.
+    """
+    import os
+    import signal
+    
+    context = get_sandbox_context()
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(
+        target=_sandbox_worker,
+        args=(sender, manim_code, mode, media_dir, limits["cpu_seconds"], render_profile, limits.get("max_address_space_bytes")),
+        daemon=True,
+    )
+    
+    start = time.time()
+    process.start()
+    sender.close()
+    
+    outcome = None
+    peak_rss = 0
+    last_progress = start
+    stall_seconds = limits.get("stall_seconds") if mode == "render" else None
+    try:
+        while outcome is None:
+            if receiver.poll(SANDBOX_POLL_SECONDS):
+                try:
+                    message = receiver.recv()
+                except EOFError:
+                    break  # Worker died without reporting
+                if "progress" not in message:
+                    outcome = message
+                    break
+                last_progress = time.time()
+                if on_progress:
+                    on_progress(message["progress"])
+            
+            if cancel is not None and cancel.is_set():
+                raise CandidateCancelled(f"Scene {mode} cancelled")
+            
+            rss = process_tree_rss_bytes(process.pid)
+            peak_rss = max(peak_rss, rss)
+            now = time.time()
+            if rss > limits["max_rss_bytes"]:
+                raise ResourceLimitExceeded(
+                    f"Scene {mode} used {rss / (1024 * 1024):.0f} MB RSS, limit is {limits['max_rss_bytes'] / (1024 * 1024):.0f} MB"
+                )
+            if now - start > limits["wall_seconds"]:
+                raise ResourceLimitExceeded(f"Scene {mode} exceeded the {limits['wall_seconds']}s wall-clock limit")
+            if stall_seconds and now - last_progress > stall_seconds:
+                raise ResourceLimitExceeded(f"Scene {mode} made no progress for {stall_seconds}s")
+    finally:
+        if outcome is None and process.is_alive():
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except OSError:
+                process.kill()  # Not yet a group leader
+        process.join(timeout=5)
+        receiver.close()
+    
+    if outcome is None:
+        if process.exitcode in (-signal.SIGXCPU, -signal.SIGKILL):
+            raise ResourceLimitExceeded(f"Scene {mode} exceeded the {limits['cpu_seconds']}s CPU time limit")
+        raise SceneExecutionError("WorkerCrashed", f"Scene {mode} worker exited with code {process.exitcode}")
+    
+    outcome["peak_rss_bytes"] = peak_rss
+    outcome["wall_seconds"] = round(time.time() - start, 3)
+    
+    if not outcome["ok"]:
+        if outcome["error_type"] == "MemoryError":
+            raise ResourceLimitExceeded(f"Scene {mode} ran out of memory: {outcome['error']}")
+        message = outcome["error"]
+        if outcome.get("line"):
+            message += f" (generated code line {outcome['line']})"
+        raise SceneExecutionError(outcome["error_type"], message, outcome)
+    
+    return outcome
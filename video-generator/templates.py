@@ -0,0 +1,767 @@
+"""Deterministic scene templates for courses that match a known shape"""
+
+from prompts import SCENE_TEMPLATE_HEADER, SCENE_TEMPLATE_HEADER_NO_VOICEOVER
+
+# Parametric CourseScene templates that skip Gemini for common visual shapes (see classify_course)
+TEMPLATE_VERSION = "2026-10-19"  # Part of the result cache key, bump when template output changes
+TEMPLATE_SILENT_SECONDS = (2.5, 6.0)  # Length bounds of each caption without voiceover
+TEMPLATE_CAPTION_WORDS = 24  # Captions longer than this are split at sentence ends and shown in turn
+TEMPLATE_MAX_ARRAY_LENGTH = 10
+TEMPLATE_MAX_GRAPH_NODES = 15
+TEMPLATE_MAX_TEX_CHARS = 120
+TEMPLATE_FORBIDDEN_TEX = (r"\input", r"\include", r"\write", r"\read", r"\open", r"\immediate", r"\catcode", r"\def", r"\csname", r"\usepackage", r"\special")
+TEMPLATE_PLOT_FUNCTIONS = {"sin": "np.sin", "cos": "np.cos", "tan": "np.tan", "exp": "np.exp", "log": "np.log", "ln": "np.log", "sqrt": "np.sqrt", "abs": "np.abs"}
+TEMPLATE_PLOT_SAMPLES = 200
+TEMPLATE_PLOT_MAX_SPAN = 100  # Functions whose y values vary more than this over the plot go to Gemini
+TEMPLATE_MAX_PLOTS = 5
+# Plot courses mentioning these need more than curves on axes, so they stay with Gemini
+TEMPLATE_PLOT_UNSUPPORTED = r"\b(?:derivative|differentiat\w*|integral|integrat\w*|antiderivative|limits?|chain rule|product rule|quotient rule|tangent lines?|slopes?|area under|rate of change)\b|\b[a-z]\s*'|′|\bd[xy]?/dx\b"
+# Course text that reads like code (e.g. a Python lists course) never goes to the array template
+TEMPLATE_CODE_SIGNS = r"\w\.\w+\(|\bdef\s|\bprint\(|>>>|\bappend\b|\bfor\s+\w+\s+in\b"
+
+
+def template_narration(block: str) -> str:
+    """A block as plain spoken text, with TeX markup dropped"""
+    import re
+    
+    text = re.sub(r"\\[a-zA-Z]+", " ", block)
+    return " ".join(re.sub(r"[$\\{}]", "", text).split())
+
+
+def caption_chunks(narration: str, max_words: int = TEMPLATE_CAPTION_WORDS) -> list:
+    """Split narration at sentence ends into captions of at most max_words words (longer sentences stay whole)"""
+    import re
+    
+    chunks = []
+    for sentence in re.split(r"(?<=[.!?])\s+", narration):
+        if chunks and len(chunks[-1].split()) + len(sentence.split()) <= max_words:
+            chunks[-1] += " " + sentence
+        else:
+            chunks.append(sentence)
+    return chunks
+
+
+def format_template_beat(narration: str, statements: list, use_voiceover: bool) -> list:
+    """
+    construct() lines for one beat of a template scene
+    
+    Statements time themselves as fractions of RUN_TIME, which becomes the
+    voiceover's duration. Without voiceover the narration is shown as
+    captions instead, one sentence group after another, and RUN_TIME is the
+    reading time of the first one.
+    """
+    import textwrap
+    
+    if use_voiceover:
+        lines = [f"with self.voiceover(text={narration!r}) as tracker:"]
+        lines += [textwrap.indent(statement.replace("RUN_TIME", "tracker.duration"), "    ") for statement in statements or ["pass"]]
+        return lines
+    
+    low, high = TEMPLATE_SILENT_SECONDS
+    chunks = caption_chunks(narration)
+    seconds = [round(max(low, min(high, len(chunk.split()) / 2.5)), 1) for chunk in chunks]
+    
+    def make_caption(name, chunk):
+        text = "\n".join(textwrap.wrap(chunk, 60))
+        return [
+            f"{name} = Text({text!r}, font_size=24)",
+            f"{name}.scale_to_fit_width(min({name}.width, config.frame_width - 1)).to_edge(DOWN)",
+        ]
+    
+    lines = [
+        "# Caption the beat since there is no narration",
+        *make_caption("caption", chunks[0]),
+        "self.play(FadeIn(caption), run_time=0.5)",
+        *[statement.replace("RUN_TIME", str(seconds[0])) for statement in statements],
+        "self.wait(1)",
+    ]
+    for chunk, chunk_seconds in zip(chunks[1:], seconds[1:]):
+        lines += [
+            *make_caption("next_caption", chunk),
+            "self.play(ReplacementTransform(caption, next_caption), run_time=0.5)",
+            "caption = next_caption",
+            f"self.wait({chunk_seconds})",
+        ]
+    lines.append("self.play(FadeOut(caption), run_time=0.5)")
+    return lines
+
+
+def apply_array_step(values: list, step: dict) -> list:
+    """Array contents after one array template step"""
+    if step["op"] == "insert":
+        return values[:step["index"]] + [step["value"]] + values[step["index"]:]
+    if step["op"] == "delete":
+        return values[:step["index"]] + values[step["index"] + 1:]
+    return values
+
+
+def match_array_template(title: str, subject: str, blocks: list):
+    """
+    Courses introducing an array as "the array [3, 1, 4]" (or "array = [...]"),
+    with at least one insert, delete or search step
+    """
+    import re
+    
+    if re.search(TEMPLATE_CODE_SIGNS, " ".join(blocks)):
+        return None
+    literal = re.search(r"\b(?:array|list)\s*(?:is|=|:|of)?\s*\[\s*(-?\d+(?:\s*,\s*-?\d+)+)\s*\]", " ".join(blocks), re.IGNORECASE)
+    if not literal:
+        return None
+    values = [int(value) for value in re.findall(r"-?\d+", literal.group(1))]
+    if len(values) > TEMPLATE_MAX_ARRAY_LENGTH:
+        return None
+    
+    steps = []
+    current = list(values)
+    for block in blocks:
+        lower = block.lower()
+        insert = re.search(r"\binsert(?:s|ing|ed)?\s+(?:the\s+)?(?:value\s+|number\s+|element\s+)?(-?\d+)(?:\D{0,20}?(?:index|position)\s+(\d+))?", lower)
+        delete = re.search(r"\b(?:delet|remov)(?:e|es|ing|ed)\s+(?:the\s+)?(?:value\s+|number\s+|element\s+)?(?:at\s+(?:index|position)\s+(\d+)|(-?\d+))", lower)
+        search = re.search(r"\b(?:search|find|look)(?:s|es|ing|ed)?\s+(?:up\s+)?(?:for\s+)?(?:the\s+)?(?:value\s+|number\s+|element\s+)?(-?\d+)", lower)
+        
+        step = {"op": "show"}
+        if insert and len(current) < TEMPLATE_MAX_ARRAY_LENGTH:
+            index = int(insert.group(2)) if insert.group(2) else len(current)
+            step = {"op": "insert", "index": min(index, len(current)), "value": int(insert.group(1))}
+        elif delete and len(current) > 1:
+            if delete.group(1):
+                index = int(delete.group(1))
+            else:
+                index = current.index(int(delete.group(2))) if int(delete.group(2)) in current else None
+            if index is not None and index < len(current):
+                step = {"op": "delete", "index": index}
+        elif search:
+            step = {"op": "search", "value": int(search.group(1))}
+        steps.append(step)
+        current = apply_array_step(current, step)
+    
+    # A literal with nothing done to it is just an example in the prose
+    if all(step["op"] == "show" for step in steps):
+        return None
+    return {"values": values, "steps": steps}
+
+
+def build_array_template(params: dict, blocks: list, shown: list):
+    """Row of cells animated through each block's insert, delete or search step"""
+    values = list(params["values"])
+    for step in params["steps"][:shown[0]]:
+        values = apply_array_step(values, step)
+    
+    setup = [
+        "# Build one square cell per array element",
+        "def make_cell(value):\n    box = Square(side_length=0.9, color=BLUE)\n    return VGroup(box, Text(str(value), font_size=32).move_to(box))",
+        f"cells = VGroup(*[make_cell(value) for value in {values!r}]).arrange(RIGHT, buff=0).shift(UP * 0.5)",
+    ]
+    relayout = "self.play(cells.animate.arrange(RIGHT, buff=0).move_to(UP * 0.5), run_time=RUN_TIME * 0.4)"
+    
+    beats = []
+    for n, i in enumerate(shown):
+        step = params["steps"][i]
+        statements = []
+        if n == 0:
+            statements.append(f"self.play(Create(cells), run_time=RUN_TIME * {0.8 if step['op'] == 'show' else 0.3})")
+        
+        if step["op"] == "insert":
+            statements += [
+                f"# Insert {step['value']} at index {step['index']} and shift the cells after it",
+                f"new_cell = make_cell({step['value']}).set_color(GREEN).next_to(cells[{min(step['index'], len(values) - 1)}], UP)",
+                "self.play(FadeIn(new_cell, shift=DOWN), run_time=RUN_TIME * 0.3)",
+                "self.remove(new_cell)",
+                f"cells.insert({step['index']}, new_cell)",
+                relayout,
+            ]
+        elif step["op"] == "delete":
+            statements += [
+                f"# Delete the element at index {step['index']} and close the gap",
+                f"removed = cells[{step['index']}]",
+                "self.play(Indicate(removed, color=RED), run_time=RUN_TIME * 0.2)",
+                "cells.remove(removed)",
+                "self.add(removed)",
+                "self.play(FadeOut(removed, shift=UP), run_time=RUN_TIME * 0.2)",
+                relayout,
+            ]
+        elif step["op"] == "search":
+            found = step["value"] in values
+            scanned = values.index(step["value"]) + 1 if found else len(values)
+            statements += [
+                f"# Scan the cells from the left looking for {step['value']}",
+                f"self.play(LaggedStart(*[Indicate(cells[k]) for k in range({scanned})], lag_ratio=0.7), run_time=RUN_TIME * 0.5)",
+                f"self.play(Circumscribe(cells[{scanned - 1}], color=GREEN), run_time=RUN_TIME * 0.3)" if found else "self.play(Wiggle(cells), run_time=RUN_TIME * 0.3)",
+            ]
+        elif n > 0:
+            statements += [
+                "# Walk through the elements one by one",
+                "self.play(LaggedStart(*[Indicate(cell) for cell in cells], lag_ratio=0.3), run_time=RUN_TIME * 0.7)",
+            ]
+        
+        values = apply_array_step(values, step)
+        beats.append((template_narration(blocks[i]) or f"Part {i + 1}.", statements))
+    return setup, beats
+
+
+def tree_traversal(root: str, children: dict, order: str) -> list:
+    """Preorder, inorder (binary trees), postorder or level-order node sequence"""
+    if order == "level":
+        visited, queue = [], [root]
+        while queue:
+            node = queue.pop(0)
+            visited.append(node)
+            queue.extend(child for child in children.get(node, []) if child is not None)
+        return visited
+    
+    def walk(node):
+        if node is None:
+            return []
+        kids = children.get(node, [])
+        if order == "inorder":
+            left, right = (kids + [None, None])[:2]
+            return walk(left) + [node] + walk(right)
+        inner = [visited for kid in kids for visited in walk(kid)]
+        return [node] + inner if order == "preorder" else inner + [node]
+    
+    return walk(root)
+
+
+def graph_shortest_path(adjacency: dict, start: str, goal: str) -> list:
+    """Fewest-edge path from start to goal, or [] if goal is unreachable"""
+    previous = {start: None}
+    queue = [start]
+    while queue:
+        node = queue.pop(0)
+        if node == goal:
+            path = []
+            while node is not None:
+                path.insert(0, node)
+                node = previous[node]
+            return path
+        for neighbor in adjacency.get(node, []):
+            if neighbor not in previous:
+                previous[neighbor] = node
+                queue.append(neighbor)
+    return []
+
+
+def match_graph_template(title: str, subject: str, blocks: list):
+    """
+    Binary search trees built from "insert [8, 3, 10]" (or "values/keys [...]"),
+    or trees and graphs given as an explicit edge list like "edges: A-B, B-C" /
+    "edges A->B and B->C", with traversal, search or path steps per block
+    """
+    import math
+    import re
+    
+    text = " ".join([title, subject, *blocks]).lower()
+    if not re.search(r"\b(tree|graph|bst)s?\b", text):
+        return None
+    
+    directed = False
+    root = None
+    if re.search(r"binary search tree|\bbst\b", text):
+        literal = re.search(r"\b(?:insert(?:s|ing|ed)?|values?|keys?)\b[^\[\].]{0,20}\[\s*(-?\d+(?:\s*,\s*-?\d+)+)\s*\]", " ".join(blocks), re.IGNORECASE)
+        if not literal:
+            return None
+        values = list(dict.fromkeys(int(value) for value in re.findall(r"-?\d+", literal.group(1))))
+        if len(values) > TEMPLATE_MAX_GRAPH_NODES:
+            return None
+        
+        # Build the tree by inserting the values in order
+        children = {str(values[0]): [None, None]}
+        for value in values[1:]:
+            node = values[0]
+            while True:
+                side = 0 if value < node else 1
+                child = children[str(node)][side]
+                if child is None:
+                    children[str(node)][side] = str(value)
+                    children[str(value)] = [None, None]
+                    break
+                node = int(child)
+        root = str(values[0])
+        kind = "bst"
+        edges = [[node, child] for node, kids in children.items() for child in kids if child is not None]
+        order = tree_traversal(root, children, "inorder")
+    else:
+        # Only pairs inside an explicit edge list count, so "A-B" in prose never becomes a graph
+        edge = r"\b[A-Z]\s*(?:-{1,2}>?|→|–|—)\s*[A-Z]\b"
+        edge_lists = re.findall(rf"\bedges?\b\s*(?:are|is|:|=)?\s*({edge}(?:\s*(?:,|;|and)\s*{edge})+)", " ".join(blocks), re.IGNORECASE)
+        pairs = re.findall(r"\b([A-Z])\s*(-{1,2}>?|→|–|—)\s*([A-Z])\b", " ".join(edge_lists))
+        directed = any(">" in arrow or arrow == "→" for _, arrow, _ in pairs)
+        edges = list(dict.fromkeys((a, b) for a, _, b in pairs if a != b))
+        nodes = list(dict.fromkeys(node for edge in edges for node in edge))
+        if len(edges) < 2 or len(nodes) > TEMPLATE_MAX_GRAPH_NODES:
+            return None
+        edges = [list(edge) for edge in edges]
+        
+        adjacency = {node: [] for node in nodes}
+        for a, b in edges:
+            adjacency[a].append(b)
+            if not directed:
+                adjacency[b].append(a)
+        
+        kind = "graph"
+        if "tree" in text and len(edges) == len(nodes) - 1:
+            # Orient the tree away from the first node mentioned
+            children, seen, queue = {}, {nodes[0]}, [nodes[0]]
+            while queue:
+                node = queue.pop(0)
+                children[node] = [neighbor for neighbor in adjacency[node] if neighbor not in seen]
+                seen.update(children[node])
+                queue.extend(children[node])
+            if len(seen) == len(nodes):
+                root = nodes[0]
+                kind = "tree"
+    
+    # Trees are drawn top-down, other graphs on a circle
+    positions = {}
+    if root is not None:
+        depths = {root: 0}
+        for node in tree_traversal(root, children, "level"):
+            for child in children.get(node, []):
+                if child is not None:
+                    depths[child] = depths[node] + 1
+        if kind == "bst":
+            slots = {node: float(rank) for rank, node in enumerate(order)}
+        else:
+            slots = {}
+            for node in tree_traversal(root, children, "postorder"):
+                kids = [slots[kid] for kid in children.get(node, [])]
+                slots[node] = sum(kids) / len(kids) if kids else float(sum(1 for kid in slots if not children.get(kid)))
+        width = max(slots.values())
+        dx = min(1.4, 11 / width) if width else 1.4
+        dy = min(1.4, 4.2 / max(1, max(depths.values())))
+        positions = {node: [round((slot - width / 2) * dx, 2), round(2.2 - depths[node] * dy, 2)] for node, slot in slots.items()}
+    else:
+        for k, node in enumerate(nodes):
+            angle = math.pi / 2 - 2 * math.pi * k / len(nodes)
+            positions[node] = [round(2.3 * math.cos(angle), 2), round(2.3 * math.sin(angle) + 0.3, 2)]
+    
+    steps = []
+    start = root or edges[0][0]
+    for block in blocks:
+        lower = block.lower()
+        step = {"op": "show"}
+        traversals = (
+            (r"\bin-?order\b", "inorder", "Inorder"),
+            (r"\bpre-?order\b", "preorder", "Preorder"),
+            (r"\bpost-?order\b", "postorder", "Postorder"),
+            (r"\blevel[- ]order\b|\bbfs\b|\bbreadth[- ]first\b", "level", "BFS"),
+            (r"\bdfs\b|\bdepth[- ]first\b", "preorder", "DFS"),
+        )
+        search = re.search(r"\b(?:search|find|look)(?:s|es|ing|ed)?\s+(?:up\s+)?(?:for\s+)?(?:the\s+)?(?:value\s+|key\s+)?(-?\d+)", lower)
+        route = re.search(r"\bfrom\s+([A-Z])\s+to\s+([A-Z])\b", block)
+        
+        for pattern, order, name in traversals:
+            if not re.search(pattern, lower) or (order == "inorder" and kind != "bst"):
+                continue
+            if root is not None:
+                path = tree_traversal(root, children, order)
+            elif order == "level":
+                # Breadth-first visiting order from the start node
+                path, queue = [start], [start]
+                while queue:
+                    for neighbor in adjacency[queue.pop(0)]:
+                        if neighbor not in path:
+                            path.append(neighbor)
+                            queue.append(neighbor)
+            elif order == "preorder":
+                path = []
+                stack = [start]
+                while stack:
+                    node = stack.pop()
+                    if node not in path:
+                        path.append(node)
+                        stack.extend(reversed(adjacency[node]))
+            else:
+                continue
+            step = {"op": "traverse", "path": path, "note": f"{name}: {', '.join(path)}"}
+            break
+        else:
+            if kind == "bst" and search:
+                value = int(search.group(1))
+                path, node = [], root
+                while node is not None:
+                    path.append(node)
+                    if int(node) == value:
+                        break
+                    node = children[node][0 if value < int(node) else 1]
+                found = path[-1] == str(value)
+                step = {"op": "search", "path": path, "note": f"Found {value}" if found else f"{value} not found"}
+            elif route and root is None and route.group(1) in adjacency and route.group(2) in adjacency:
+                path = graph_shortest_path(adjacency, route.group(1), route.group(2))
+                if path:
+                    step = {"op": "path", "path": path, "note": " -> ".join(path)}
+        steps.append(step)
+    
+    return {"kind": kind, "directed": directed, "positions": positions, "edges": edges, "steps": steps}
+
+
+def build_graph_template(params: dict, blocks: list, shown: list):
+    """Labelled nodes joined by lines (arrows when directed), highlighted along each block's traversal or path"""
+    connector = "Arrow(nodes[a].get_center(), nodes[b].get_center(), buff=0.35, stroke_width=3, max_tip_length_to_length_ratio=0.15, color=GRAY)" if params["directed"] else "Line(nodes[a].get_center(), nodes[b].get_center(), buff=0.35, color=GRAY)"
+    setup = [
+        "# Node positions laid out ahead of time",
+        f"positions = {params['positions']!r}",
+        "# Draw each node as a labelled circle",
+        "nodes = {}",
+        "for key, (x, y) in positions.items():\n    circle = Circle(radius=0.35, color=BLUE).move_to([x, y, 0])\n    nodes[key] = VGroup(circle, Text(key, font_size=28).move_to(circle))",
+        "# Connect the nodes, stopping at the circle edges",
+        f"edges = VGroup(*[{connector} for a, b in {params['edges']!r}])",
+    ]
+    
+    beats = []
+    has_note = False
+    for n, i in enumerate(shown):
+        step = params["steps"][i]
+        statements = []
+        if n == 0:
+            show = step["op"] == "show"
+            statements += [
+                f"self.play(LaggedStart(*[GrowFromCenter(node) for node in nodes.values()], lag_ratio=0.15), run_time=RUN_TIME * {0.5 if show else 0.2})",
+                f"self.play(Create(edges), run_time=RUN_TIME * {0.3 if show else 0.1})",
+            ]
+        
+        if step["op"] == "show":
+            if n > 0:
+                statements.append("self.play(Circumscribe(VGroup(edges, *nodes.values())), run_time=RUN_TIME * 0.6)")
+        else:
+            if has_note:
+                statements.append("self.play(FadeOut(note), run_time=RUN_TIME * 0.1)")
+            statements += [
+                f"# Visit the nodes in order: {', '.join(step['path'])}",
+                f"self.play(LaggedStart(*[Indicate(nodes[key], color=YELLOW) for key in {step['path']!r}], lag_ratio=0.8), run_time=RUN_TIME * 0.5)",
+                f"note = Text({step['note']!r}, font_size=28)",
+                "note.scale_to_fit_width(min(note.width, config.frame_width - 1)).to_edge(UP)",
+                "self.play(Write(note), run_time=RUN_TIME * 0.2)",
+            ]
+            has_note = True
+        
+        beats.append((template_narration(blocks[i]) or f"Part {i + 1}.", statements))
+    return setup, beats
+
+
+def match_equation_template(title: str, subject: str, blocks: list):
+    """
+    Courses whose blocks mostly carry $...$, $$...$$, \\(...\\) or \\[...\\] equations, transformed one into the next
+    
+    Any delimited span that reads like prose (e.g. prices like "$5 and ... $10")
+    sends the whole course to Gemini; bare symbols like $x$ are not equations.
+    """
+    import re
+    
+    steps = []
+    for block in blocks:
+        found = re.findall(r"\$\$(.+?)\$\$|\$(.+?)\$|\\\((.+?)\\\)|\\\[(.+?)\\\]", block, re.DOTALL)
+        equations = []
+        for match in found:
+            raw = next((group for group in match if group), "")
+            tex = " ".join(raw.split())
+            words = re.sub(r"\\text\{[^}]*\}|\\[a-zA-Z]+", " ", tex)
+            if raw != raw.strip() or re.search(r"[A-Za-z]{2,}\s+[A-Za-z]{2,}", words):
+                return None
+            if len(tex) > TEMPLATE_MAX_TEX_CHARS or any(command in tex for command in TEMPLATE_FORBIDDEN_TEX):
+                return None
+            if re.search(r"[=<>+\-^_]|\\(?:frac|sqrt|sum|int|cdot|times|le|ge|neq|approx)\b", tex):
+                equations.append(tex)
+        steps.append({"equations": equations[:3]})
+    
+    with_equations = sum(1 for step in steps if step["equations"])
+    if not with_equations or 2 * with_equations < len(blocks):
+        return None
+    return {"steps": steps}
+
+
+def build_equation_template(params: dict, blocks: list, shown: list):
+    """Each block's equations written out, morphing from the previous equation"""
+    setup = [
+        "# Keep long equations inside the frame",
+        "def fit(mobject):\n    return mobject.scale_to_fit_width(min(mobject.width, config.frame_width - 1.5))",
+    ]
+    
+    beats = []
+    current = None
+    count = 0
+    for i in shown:
+        equations = params["steps"][i]["equations"]
+        statements = []
+        for tex in equations:
+            count += 1
+            name = f"equation_{count}"
+            share = round(0.8 / len(equations), 2)
+            statements.append(f"{name} = fit(MathTex({tex!r}, font_size=56))")
+            if current:
+                statements.append(f"self.play(TransformMatchingShapes({current}, {name}), run_time=RUN_TIME * {share})")
+            else:
+                statements.append(f"self.play(Write({name}), run_time=RUN_TIME * {share})")
+            current = name
+        if not equations and current:
+            statements.append(f"self.play(Circumscribe({current}), run_time=RUN_TIME * 0.5)")
+        beats.append((template_narration(blocks[i]) or f"Part {i + 1}.", statements))
+    return setup, beats
+
+
+def parse_plot_expression(text: str):
+    """
+    Turn an expression like "2x^2 - sin(x)" into (numpy code, float evaluator), or None
+    
+    Only numbers, x, e, pi, arithmetic and TEMPLATE_PLOT_FUNCTIONS are accepted,
+    and constants are evaluated as floats so huge powers overflow instead of hanging.
+    """
+    import ast
+    import math
+    import re
+    import types
+    
+    source = text.strip().rstrip(".").replace("^", "**")
+    source = re.sub(r"(\d)\s*([a-z(])", r"\1*\2", source)
+    source = re.sub(r"\)\s*([a-z0-9(])", r")*\1", source)
+    source = re.sub(r"\bx\s*\(", "x*(", source)
+    try:
+        tree = ast.parse(source, mode="eval")
+    except SyntaxError:
+        return None
+    
+    allowed = (ast.Expression, ast.BinOp, ast.UnaryOp, ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Pow, ast.USub, ast.UAdd, ast.Load)
+    for node in ast.walk(tree):
+        if isinstance(node, allowed):
+            continue
+        if isinstance(node, ast.Constant) and type(node.value) in (int, float) and abs(node.value) <= 1e6:
+            continue
+        if isinstance(node, ast.Name) and node.id in ("x", "e", "pi", *TEMPLATE_PLOT_FUNCTIONS):
+            continue
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in TEMPLATE_PLOT_FUNCTIONS and len(node.args) == 1 and not node.keywords:
+            continue
+        return None
+    if not any(isinstance(node, ast.Name) and node.id == "x" for node in ast.walk(tree)):
+        return None
+    
+    class ToNumpy(ast.NodeTransformer):
+        def visit_Name(self, node):
+            if node.id in ("x", "np"):
+                return node
+            return ast.Attribute(value=ast.Name(id="np", ctx=ast.Load()), attr=TEMPLATE_PLOT_FUNCTIONS.get(node.id, f"np.{node.id}")[3:], ctx=ast.Load())
+        
+        def visit_Constant(self, node):
+            return ast.Constant(value=float(node.value)) if self.floats else node
+    
+    converter = ToNumpy()
+    converter.floats = False
+    numpy_code = ast.unparse(converter.visit(tree))
+    converter.floats = True
+    compiled = compile(ast.fix_missing_locations(converter.visit(ast.parse(numpy_code, mode="eval"))), "<plot>", "eval")
+    
+    math_np = types.SimpleNamespace(sin=math.sin, cos=math.cos, tan=math.tan, exp=math.exp, log=math.log, sqrt=math.sqrt, abs=abs, e=math.e, pi=math.pi)
+    
+    def evaluate(x):
+        try:
+            y = eval(compiled, {"__builtins__": {}, "np": math_np, "x": float(x)})
+        except (ArithmeticError, ValueError, TypeError):
+            return None
+        return y if isinstance(y, float) and math.isfinite(y) else None
+    
+    return numpy_code, evaluate
+
+
+def nice_step(span: float) -> float:
+    """Tick spacing giving at most ten ticks over span"""
+    for step in (0.1, 0.2, 0.25, 0.5, 1, 2, 5, 10, 20, 25, 50):
+        if span / step <= 10:
+            return step
+    return 100
+
+
+def match_function_plot_template(title: str, subject: str, blocks: list):
+    """
+    Courses about plotting functions written as "y = ..." or "f(x) = ...", each
+    plotted in the block that introduces it
+    
+    Every definition in the course has to parse and plot, and calculus topics
+    (derivatives, integrals, limits, tangents) go to Gemini.
+    """
+    import math
+    import re
+    
+    text = " ".join([title, subject, *blocks]).lower()
+    if not re.search(r"\b(?:plot|graph)(?:s|ted|ting|ing)?\b|\bparabolas?\b", text):
+        return None
+    if re.search(TEMPLATE_PLOT_UNSUPPORTED, text):
+        return None
+    
+    low, high = -5.0, 5.0
+    interval = re.search(r"\b(?:from|between)\s+(?:x\s*=\s*)?(-?\d+(?:\.\d+)?)\s+(?:to|and)\s+(?:x\s*=\s*)?(-?\d+(?:\.\d+)?)", text)
+    if interval and float(interval.group(1)) < float(interval.group(2)) and float(interval.group(2)) - float(interval.group(1)) <= 100:
+        low, high = float(interval.group(1)), float(interval.group(2))
+    xs = [low + (high - low) * k / TEMPLATE_PLOT_SAMPLES for k in range(TEMPLATE_PLOT_SAMPLES + 1)]
+    
+    functions = []
+    steps = []
+    all_ys = []
+    for block in blocks:
+        introduced = []
+        for match in re.finditer(r"(?:\b[fgh]\s*\(\s*x\s*\)|\by)\s*=\s*([^=;:,\n$]{1,80})", block.lower()):
+            candidate = match.group(1)
+            # Take the longest prefix that is a valid expression, dropping trailing prose
+            for end in range(len(candidate), 0, -1):
+                label = candidate[:end].strip().rstrip(".")
+                parsed = parse_plot_expression(label) if label else None
+                if parsed:
+                    break
+            if not parsed:
+                return None
+            if any(function["expr"] == parsed[0] for function in functions):
+                continue
+            
+            # Plot over the longest run of samples where the function is defined
+            ys = [parsed[1](x) for x in xs]
+            best, run_start = (0, -1), None
+            for k, y in enumerate(ys + [None]):
+                if y is not None and run_start is None:
+                    run_start = k
+                elif y is None and run_start is not None:
+                    best = max(best, (run_start, k - 1), key=lambda run: run[1] - run[0])
+                    run_start = None
+            first, last = best
+            if last - first < TEMPLATE_PLOT_SAMPLES // 4:
+                return None
+            span_ys = ys[first:last + 1]
+            if max(span_ys) - min(span_ys) > TEMPLATE_PLOT_MAX_SPAN:
+                return None
+            
+            all_ys.extend(span_ys)
+            introduced.append(len(functions))
+            functions.append({"label": f"y = {label}", "expr": parsed[0], "x_range": [round(xs[first], 3), round(xs[last], 3)]})
+        steps.append({"plot": introduced})
+    
+    if not functions or len(functions) > TEMPLATE_MAX_PLOTS:
+        return None
+    
+    bottom, top = min(all_ys), max(all_ys)
+    if top - bottom < 1e-6:
+        bottom, top = bottom - 1, top + 1
+    pad = (top - bottom) * 0.1
+    y_step = nice_step(top - bottom + 2 * pad)
+    x_step = nice_step(high - low)
+    axes = {
+        "x_range": [low, high, x_step],
+        "y_range": [round(math.floor((bottom - pad) / y_step) * y_step, 3), round(math.ceil((top + pad) / y_step) * y_step, 3), y_step],
+    }
+    return {"functions": functions, "axes": axes, "steps": steps}
+
+
+def build_function_plot_template(params: dict, blocks: list, shown: list):
+    """Axes with each function drawn in the block that introduces it and a point traced along the latest curve"""
+    colors = ("YELLOW", "GREEN", "RED", "PURPLE", "ORANGE")
+    axes = params["axes"]
+    setup = [
+        "# Axes sized to the sampled range of every function in the course",
+        f"axes = Axes(x_range={axes['x_range']!r}, y_range={axes['y_range']!r}, x_length=10, y_length=5, tips=False).shift(UP * 0.3)",
+        'axis_labels = axes.get_axis_labels(Text("x", font_size=28), Text("y", font_size=28))',
+    ]
+    for k, function in enumerate(params["functions"]):
+        setup += [
+            f"# Plot {function['label']} where it is defined",
+            f"curve_{k} = axes.plot(lambda x: {function['expr']}, x_range={function['x_range']!r}, color={colors[k % len(colors)]})",
+            f"label_{k} = Text({function['label']!r}, font_size=28, color={colors[k % len(colors)]}).to_corner(UR).shift(DOWN * {round(0.6 * k, 1)})",
+        ]
+    
+    plotted = [k for i in range(shown[0]) for k in params["steps"][i]["plot"]]
+    beats = []
+    for n, i in enumerate(shown):
+        introduced = params["steps"][i]["plot"]
+        statements = []
+        if n == 0:
+            statements.append(f"self.play(Create(axes), Write(axis_labels), run_time=RUN_TIME * {0.3 if introduced else 0.5})")
+            if plotted:
+                statements.append(f"self.add({', '.join(f'curve_{k}, label_{k}' for k in plotted)})")
+        for k in introduced:
+            statements.append(f"self.play(Create(curve_{k}), FadeIn(label_{k}), run_time=RUN_TIME * {round(0.6 / len(introduced), 2)})")
+        plotted += introduced
+        
+        if not introduced and plotted:
+            statements += [
+                "# Trace a point along the curve",
+                f"dot = Dot(color=RED).move_to(curve_{plotted[-1]}.get_start())",
+                "self.add(dot)",
+                f"self.play(MoveAlongPath(dot, curve_{plotted[-1]}), run_time=RUN_TIME * 0.6)",
+                "self.play(FadeOut(dot), run_time=RUN_TIME * 0.1)",
+            ]
+        elif not introduced and n > 0:
+            statements.append("self.play(Indicate(axes), run_time=RUN_TIME * 0.5)")
+        beats.append((template_narration(blocks[i]) or f"Part {i + 1}.", statements))
+    return setup, beats
+
+
+# Scene templates in classification priority order: name -> (matcher, builder)
+SCENE_TEMPLATES = {
+    "function_plot": (match_function_plot_template, build_function_plot_template),
+    "graph": (match_graph_template, build_graph_template),
+    "array": (match_array_template, build_array_template),
+    "equation": (match_equation_template, build_equation_template),
+}
+
+
+def classify_course(title: str, subject: str, blocks: list):
+    """
+    Route a course to a scene template, returning {"name", "params"} or None for the Gemini path
+    
+    Matchers run from most to least specific and only accept structured,
+    unambiguous payloads they can fill completely (explicit literals and edge
+    lists, delimited math), so the long tail still goes to Gemini. Only used
+    when a request opts in with use_templates.
+    """
+    blocks = [str(block) for block in blocks]
+    if not blocks:
+        return None
+    
+    for name, (matcher, _) in SCENE_TEMPLATES.items():
+        try:
+            params = matcher(str(title), str(subject), blocks)
+        except Exception as e:
+            print(f"  ✗ {name} template matcher failed: {e}")
+            continue
+        if params:
+            return {"name": name, "params": params}
+    return None
+
+
+def render_scene_template(template: dict, use_voiceover: bool) -> str:
+    """
+    Fill a classify_course match into complete CourseScene code
+    
+    template also carries the course "title" and "blocks", plus "segment"
+    ([index, total]) when only one block is rendered for a parallel render.
+    """
+    import textwrap
+    
+    title = template["title"]
+    blocks = [str(block) for block in template["blocks"]]
+    index, total = template.get("segment") or (None, None)
+    shown = [index - 1] if index else list(range(len(blocks)))
+    setup, beats = SCENE_TEMPLATES[template["name"]][1](template["params"], blocks, shown)
+    
+    if not index or index == 1:
+        beats.insert(0, (f"Let's explore {title}.", [
+            f"title = Text({title!r}, font_size=48)",
+            "title.scale_to_fit_width(min(title.width, config.frame_width - 1))",
+            "self.play(Write(title), run_time=RUN_TIME * 0.6)",
+            "self.play(FadeOut(title), run_time=RUN_TIME * 0.3)",
+        ]))
+    
+    lines = list(setup)
+    for narration, statements in beats:
+        lines.append("")
+        lines += format_template_beat(narration, statements, use_voiceover)
+    lines.append("")
+    if not index or index == total:
+        # The silent beat fades its own caption out afterwards
+        if use_voiceover:
+            fade_out = "if self.mobjects:\n    self.play(*[FadeOut(mobject) for mobject in self.mobjects], run_time=RUN_TIME * 0.5)"
+        else:
+            fade_out = "if len(self.mobjects) > 1:\n    self.play(*[FadeOut(mobject) for mobject in self.mobjects if mobject is not caption], run_time=RUN_TIME * 0.5)"
+        lines += format_template_beat(f"That wraps up {title}.", [fade_out], use_voiceover)
+    else:
+        # Leave an empty screen so the next segment joins cleanly
+        lines.append("if self.mobjects:\n    self.play(*[FadeOut(mobject) for mobject in self.mobjects], run_time=1)")
+    
+    if use_voiceover:
+        return SCENE_TEMPLATE_HEADER + "\n" + textwrap.indent("\n".join(lines), " " * 8) + "\n"
+    return SCENE_TEMPLATE_HEADER_NO_VOICEOVER + textwrap.indent("\n".join(lines), " " * 8) + "\n"
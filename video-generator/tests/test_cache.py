@@ -0,0 +1,135 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from cache import append_tts_index_entry, prune_tts_cache, read_tts_index_entry, result_cache_key, segment_key
+
+
+COURSE = {
+    "title": "Introduction to Arrays",
+    "subject": "Computer Science",
+    "blocks": [
+        "Arrays are fundamental data structures.",
+        "You can perform insertion and deletion operations.",
+        "Searching an array checks each element in turn.",
+    ],
+}
+
+
+class ResultCacheKeyTest(unittest.TestCase):
+    def test_whitespace_changes_hash_the_same(self):
+        spaced = {
+            "title": "  Introduction   to Arrays ",
+            "subject": "Computer\nScience",
+            "blocks": [" ".join(block.split(" ")) + "  " for block in COURSE["blocks"]],
+        }
+        self.assertEqual(result_cache_key(COURSE), result_cache_key(spaced))
+    
+    def test_content_changes_the_key(self):
+        edited = {**COURSE, "blocks": COURSE["blocks"][:2]}
+        self.assertNotEqual(result_cache_key(COURSE), result_cache_key(edited))
+    
+    def test_render_settings_change_the_key(self):
+        base = result_cache_key(COURSE)
+        variants = [
+            result_cache_key(COURSE, render_mode="parallel"),
+            result_cache_key(COURSE, output_format="hls"),
+            result_cache_key(COURSE, render_profile="draft"),
+            result_cache_key(COURSE, use_templates=True),
+            result_cache_key(COURSE, upload_mode="stream"),
+        ]
+        self.assertNotIn(base, variants)
+        self.assertEqual(len(set(variants)), len(variants))
+    
+    def test_unknown_profile_is_rejected(self):
+        with self.assertRaises(KeyError):
+            result_cache_key(COURSE, render_profile="ultra")
+
+
+class SegmentKeyTest(unittest.TestCase):
+    def test_editing_one_block_keeps_the_other_keys(self):
+        edited = {**COURSE, "blocks": [COURSE["blocks"][0], "Arrays store elements contiguously.", COURSE["blocks"][2]]}
+        self.assertEqual(segment_key(COURSE, 1, True), segment_key(edited, 1, True))
+        self.assertNotEqual(segment_key(COURSE, 2, True), segment_key(edited, 2, True))
+        self.assertEqual(segment_key(COURSE, 3, True), segment_key(edited, 3, True))
+    
+    def test_title_only_affects_the_first_segment(self):
+        renamed = {**COURSE, "title": "Arrays 101"}
+        self.assertNotEqual(segment_key(COURSE, 1, True), segment_key(renamed, 1, True))
+        self.assertEqual(segment_key(COURSE, 2, True), segment_key(renamed, 2, True))
+    
+    def test_role_change_changes_the_key(self):
+        # The old last block becomes a middle block once another block is appended
+        extended = {**COURSE, "blocks": COURSE["blocks"] + ["Arrays have a fixed size."]}
+        self.assertEqual(segment_key(COURSE, 2, True), segment_key(extended, 2, True))
+        self.assertNotEqual(segment_key(COURSE, 3, True), segment_key(extended, 3, True))
+    
+    def test_voiceover_and_profile_change_the_key(self):
+        base = segment_key(COURSE, 2, True)
+        self.assertNotEqual(base, segment_key(COURSE, 2, False))
+        self.assertNotEqual(base, segment_key(COURSE, 2, True, render_profile="draft"))
+    
+    def test_template_segments_depend_on_the_whole_course(self):
+        course = {
+            "title": "Arrays",
+            "subject": "Computer Science",
+            "blocks": ["Consider the array [3, 1, 4].", "Insert 5 at index 1.", "Delete the value 3."],
+        }
+        edited = {**course, "blocks": course["blocks"][:2] + ["Delete the value 4."]}
+        self.assertEqual(segment_key(course, 1, True), segment_key(edited, 1, True))
+        self.assertNotEqual(segment_key(course, 1, True, use_templates=True), segment_key(edited, 1, True, use_templates=True))
+
+
+class TtsIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir, ignore_errors=True)
+        patcher = mock.patch("cache.TTS_CACHE_DIR", self.cache_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+    
+    def add_entry(self, text: str, size: int = 10, mtime: float = 0) -> dict:
+        audio = f"{text}.mp3"
+        with open(os.path.join(self.cache_dir, audio), "wb") as f:
+            f.write(b"0" * size)
+        os.utime(os.path.join(self.cache_dir, audio), (mtime, mtime))
+        entry = {"input_text": text, "input_data": {"input_text": text, "service": "elevenlabs"}, "original_audio": audio}
+        append_tts_index_entry(os.path.join(self.cache_dir, "cache.json"), entry)
+        return entry
+    
+    def test_entries_are_found_by_input_data(self):
+        first = self.add_entry("first")
+        self.add_entry("second")
+        self.assertEqual(read_tts_index_entry(self.cache_dir, first["input_data"]), first)
+        self.assertIsNone(read_tts_index_entry(self.cache_dir, {"input_text": "third", "service": "elevenlabs"}))
+    
+    def test_entry_without_its_audio_is_a_miss(self):
+        entry = self.add_entry("first")
+        os.remove(os.path.join(self.cache_dir, "first.mp3"))
+        self.assertIsNone(read_tts_index_entry(self.cache_dir, entry["input_data"]))
+    
+    def test_prune_evicts_the_oldest_audio_and_its_entry(self):
+        old = self.add_entry("old", mtime=100)
+        new = self.add_entry("new", mtime=200)
+        prune_tts_cache(max_bytes=15)
+        self.assertFalse(os.path.exists(os.path.join(self.cache_dir, "old.mp3")))
+        self.assertEqual(len(os.listdir(os.path.join(self.cache_dir, "index"))), 1)
+        self.assertIsNone(read_tts_index_entry(self.cache_dir, old["input_data"]))
+        self.assertEqual(read_tts_index_entry(self.cache_dir, new["input_data"]), new)
+    
+    def test_prune_migrates_a_single_file_index(self):
+        with open(os.path.join(self.cache_dir, "legacy.mp3"), "wb") as f:
+            f.write(b"0")
+        entry = {"input_text": "legacy", "input_data": {"input_text": "legacy"}, "original_audio": "legacy.mp3"}
+        with open(os.path.join(self.cache_dir, "cache.json"), "w") as f:
+            json.dump([entry, entry], f)
+        prune_tts_cache()
+        self.assertFalse(os.path.exists(os.path.join(self.cache_dir, "cache.json")))
+        self.assertEqual(read_tts_index_entry(self.cache_dir, entry["input_data"]), entry)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,60 @@
+import unittest
+from unittest import mock
+
+from jobs import JobEvents, increment_counter, metric_labels, metrics_shard
+
+
+class MetricLabelsTest(unittest.TestCase):
+    def test_labels_are_sorted(self):
+        self.assertEqual(metric_labels(stage="render", outcome="ok"), 'outcome="ok",stage="render"')
+    
+    def test_no_labels(self):
+        self.assertEqual(metric_labels(), "")
+    
+    def test_values_are_stringified(self):
+        self.assertEqual(metric_labels(attempt=2, cached=True), 'attempt="2",cached="True"')
+    
+    def test_special_characters_are_escaped(self):
+        self.assertEqual(metric_labels(error='bad "quote"'), r'error="bad \"quote\""')
+        self.assertEqual(metric_labels(error="C:\\tmp"), r'error="C:\\tmp"')
+        self.assertEqual(metric_labels(error="line one\nline two"), r'error="line one\nline two"')
+    
+    def test_backslash_is_escaped_before_quotes(self):
+        self.assertEqual(metric_labels(error='\\"'), r'error="\\\""')
+
+
+
+class MetricsShardTest(unittest.TestCase):
+    def test_shard_is_a_stamped_copy(self):
+        with mock.patch("jobs._metrics", {"counters": {}, "histograms": {}}):
+            increment_counter("video_jobs_total", status="succeeded")
+            shard = metrics_shard()
+            increment_counter("video_jobs_total", status="succeeded")
+        self.assertEqual(shard["counters"]["video_jobs_total"], {'status="succeeded"': 1})
+        self.assertIn("last_seen", shard)
+
+
+
+class JobEventsTest(unittest.TestCase):
+    def publish_and_close(self, *stages) -> tuple:
+        events_store = {}
+        with mock.patch("jobs.job_events", events_store), mock.patch("jobs.update_job") as update_job:
+            events = JobEvents("job")
+            for stage in stages:
+                events.publish(stage)
+            events.close()
+        return events_store, update_job
+    
+    def test_finished_job_keeps_only_its_final_event(self):
+        events_store, update_job = self.publish_and_close("started", "rendering", "done")
+        self.assertEqual(list(events_store), ["job:2"])
+        update_job.assert_called_once_with("job", final_event_seq=2)
+    
+    def test_events_are_kept_without_a_final_event(self):
+        events_store, update_job = self.publish_and_close("started", "rendering")
+        self.assertEqual(sorted(events_store), ["job:0", "job:1"])
+        update_job.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,105 @@
+import unittest
+
+from main import extract_voiceover_lines, repair_manim_code, strip_stray_markdown
+
+
+SCENE = """from manim import *
+
+class CourseScene(Scene):
+    def construct(self):
+        self.play(Write(Text("Arrays")))"""
+
+
+class StripStrayMarkdownTest(unittest.TestCase):
+    def test_keeps_the_first_fenced_block(self):
+        text = f"Here is the code:\n```python\n{SCENE}\n```\nAnd a second one:\n```python\nprint(1)\n```"
+        self.assertEqual(strip_stray_markdown(text), SCENE)
+    
+    def test_drops_a_lone_fence(self):
+        self.assertEqual(strip_stray_markdown(f"```python\n{SCENE}"), SCENE)
+        self.assertEqual(strip_stray_markdown(f"{SCENE}\n```"), SCENE)
+    
+    def test_drops_surrounding_prose(self):
+        text = f"Here is the corrected scene:\n\n{SCENE}\n\n**Changes:**\n- Fixed the title.\nLet me know if it works!"
+        self.assertEqual(strip_stray_markdown(text), SCENE)
+    
+    def test_keeps_code_that_already_parses(self):
+        self.assertEqual(strip_stray_markdown("x = 1\ny = 2"), "x = 1\ny = 2")
+    
+    def test_never_drops_statements(self):
+        text = "Note: fix this.\nx = 1\nprint(x"
+        self.assertEqual(strip_stray_markdown(text), "x = 1\nprint(x")
+
+
+class RepairManimCodeTest(unittest.TestCase):
+    def test_valid_code_is_unchanged(self):
+        self.assertEqual(repair_manim_code(SCENE), (SCENE, []))
+    
+    def test_strips_markdown(self):
+        code, repairs = repair_manim_code(f"```python\n{SCENE}\n```")
+        self.assertEqual(code, SCENE)
+        self.assertEqual(repairs, ["stripped markdown"])
+    
+    def test_unparseable_code_is_returned_as_is(self):
+        self.assertEqual(repair_manim_code("def broken(:\n    pass"), ("def broken(:\n    pass", []))
+    
+    def test_markdown_without_code_is_left_alone(self):
+        self.assertEqual(repair_manim_code("```\n```"), ("```\n```", []))
+    
+    def test_removes_index_from_get_part_by_tex(self):
+        code, repairs = repair_manim_code(SCENE + '\n        part = eq.get_part_by_tex("x", index=1)')
+        self.assertIn('eq.get_part_by_tex("x")', code.replace("'", '"'))
+        self.assertNotIn("index=", code)
+        self.assertEqual(repairs, ["removed index= from 1 get_part_by_tex call(s)"])
+    
+    def test_replaces_forbidden_mobjects(self):
+        code, repairs = repair_manim_code(SCENE + '\n        logo = SVGMobject("logo.svg")\n        kind = ImageMobject')
+        self.assertIn("logo = Square(side_length=2)", code)
+        self.assertIn("kind = Rectangle", code)
+        self.assertNotIn("SVGMobject", code)
+        self.assertEqual(repairs, ["replaced 2 forbidden mobject reference(s) with primitives"])
+    
+    def test_renames_the_scene_class(self):
+        code, repairs = repair_manim_code(SCENE.replace("CourseScene", "ArraysScene") + "\n\nscene = ArraysScene()")
+        self.assertIn("class CourseScene(Scene):", code)
+        self.assertIn("scene = CourseScene()", code)
+        self.assertEqual(repairs, ["renamed class ArraysScene to CourseScene"])
+
+
+class ExtractVoiceoverLinesTest(unittest.TestCase):
+    def test_service_and_texts_in_source_order(self):
+        code = """class CourseScene(VoiceoverScene):
+    def construct(self):
+        self.set_speech_service(ElevenLabsService(voice_name="Adam", transcription_model=None))
+        with self.voiceover(text="Arrays store values.") as tracker:
+            pass
+        with self.voiceover("Indexes start at zero.") as tracker:
+            pass
+        with self.voiceover(text="Arrays store values.") as tracker:
+            pass"""
+        service_kwargs, texts, skipped = extract_voiceover_lines(code)
+        self.assertEqual(service_kwargs, {"voice_name": "Adam", "transcription_model": None})
+        self.assertEqual(texts, ["Arrays store values.", "Indexes start at zero."])
+        self.assertEqual(skipped, 0)
+    
+    def test_non_literal_lines_are_skipped(self):
+        code = """class CourseScene(VoiceoverScene):
+    def construct(self):
+        self.set_speech_service(ElevenLabsService(**settings))
+        with self.voiceover(text=f"Step {step}") as tracker:
+            pass
+        with self.voiceover(text="<speak>Hi</speak>", ssml=True) as tracker:
+            pass
+        with self.voiceover(text="Plain text.") as tracker:
+            pass"""
+        service_kwargs, texts, skipped = extract_voiceover_lines(code)
+        self.assertIsNone(service_kwargs)
+        self.assertEqual(texts, ["Plain text."])
+        self.assertEqual(skipped, 2)
+    
+    def test_syntax_error(self):
+        self.assertEqual(extract_voiceover_lines("def broken(:"), (None, [], 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
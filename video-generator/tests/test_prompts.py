@@ -0,0 +1,38 @@
+import unittest
+
+from prompts import manimDocs, trim_manim_docs
+
+
+class TrimManimDocsTest(unittest.TestCase):
+    def test_unknown_subject_keeps_everything(self):
+        self.assertEqual(trim_manim_docs("Art History"), manimDocs)
+        self.assertEqual(trim_manim_docs(""), manimDocs)
+    
+    def test_subject_keeps_core_and_matching_modules(self):
+        docs = trim_manim_docs("Calculus")
+        self.assertLess(len(docs), len(manimDocs))
+        self.assertIn("  - [creation]", docs)
+        self.assertIn("  - [graphing]", docs)
+        self.assertIn("  - [value_tracker]", docs)
+        self.assertNotIn("  - [three_d]", docs)
+    
+    def test_members_follow_their_module(self):
+        docs = trim_manim_docs("Computer Science")
+        self.assertIn("[Create](reference/manim.animation.creation.Create.html)", docs)
+        self.assertNotIn("manim.animation.changing.TracedPath", docs)
+    
+    def test_matching_is_case_insensitive_and_combines_subjects(self):
+        docs = trim_manim_docs("BIOPHYSICS")
+        self.assertIn("  - [three_d]", docs)
+        self.assertIn("  - [vector_field]", docs)
+    
+    def test_sections_without_kept_modules_are_dropped(self):
+        docs = trim_manim_docs("Chemistry")
+        sections = [line for line in docs.split("\n") if line.startswith("- [")]
+        for section in sections:
+            following = docs.split(section, 1)[1].lstrip("\n").split("\n", 1)[0]
+            self.assertTrue(following.startswith("  - ["), section)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+import unittest
+
+from templates import classify_course
+
+
+class ClassifyCourseTest(unittest.TestCase):
+    def test_array_operations(self):
+        template = classify_course("Arrays", "Computer Science", [
+            "Consider the array [3, 1, 4].",
+            "Insert 5 at index 1.",
+            "Delete the value 3.",
+        ])
+        self.assertEqual(template["name"], "array")
+        self.assertEqual(template["params"]["values"], [3, 1, 4])
+        self.assertEqual(template["params"]["steps"], [
+            {"op": "show"},
+            {"op": "insert", "index": 1, "value": 5},
+            {"op": "delete", "index": 0},
+        ])
+    
+    def test_array_literal_without_operations_goes_to_gemini(self):
+        self.assertIsNone(classify_course("Arrays", "Computer Science", ["The array [3, 1, 4] holds three numbers."]))
+    
+    def test_code_courses_skip_the_array_template(self):
+        self.assertIsNone(classify_course("Lists", "Computer Science", [
+            "Python list = [1, 2, 3]",
+            "Call items.append(4) to insert 4.",
+        ]))
+    
+    def test_graph_traversal(self):
+        template = classify_course("Graphs", "Computer Science", [
+            "The graph has edges A-B, B-C, A-C.",
+            "Run BFS from A.",
+        ])
+        self.assertEqual(template["name"], "graph")
+        self.assertEqual(template["params"]["edges"], [["A", "B"], ["B", "C"], ["A", "C"]])
+        self.assertEqual(template["params"]["steps"][1]["path"], ["A", "B", "C"])
+    
+    def test_delimited_equations(self):
+        template = classify_course("Quadratics", "Math", ["Solve $x^2 - 4 = 0$.", r"So $x = \pm 2$."])
+        self.assertEqual(template["name"], "equation")
+        self.assertEqual(template["params"]["steps"], [{"equations": ["x^2 - 4 = 0"]}, {"equations": [r"x = \pm 2"]}])
+    
+    def test_function_plot(self):
+        template = classify_course("Sine", "Math", ["Plot y = sin(x) from -3 to 3."])
+        self.assertEqual(template["name"], "function_plot")
+        self.assertEqual(template["params"]["functions"][0]["expr"], "np.sin(x)")
+        self.assertEqual(template["params"]["functions"][0]["x_range"], [-3.0, 3.0])
+    
+    def test_calculus_plots_go_to_gemini(self):
+        self.assertIsNone(classify_course("Derivatives", "Math", ["Plot y = x^2 and its derivative."]))
+    
+    def test_prose_and_empty_courses_go_to_gemini(self):
+        self.assertIsNone(classify_course("Arrays", "Computer Science", ["Arrays are fundamental data structures."]))
+        self.assertIsNone(classify_course("Arrays", "Computer Science", []))
+
+
+if __name__ == "__main__":
+    unittest.main()
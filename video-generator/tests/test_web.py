@@ -0,0 +1,287 @@
+import asyncio
+import time
+import unittest
+from unittest import mock
+
+from fastapi import HTTPException
+
+from jobs import take_over_claim
+from web import AdmissionController, AdmissionRejected, claim_run_slot, create_web_app, rate_limit_key, release_run_slot
+
+
+def endpoint(web_app, path: str, method: str):
+    return next(route.endpoint for route in web_app.routes if getattr(route, "path", None) == path and method in route.methods)
+
+
+class FakeDict:
+    """In-memory stand-in for the .aio methods of a modal.Dict"""
+    
+    def __init__(self, data: dict = None):
+        self.data = dict(data or {})
+        self.get = mock.Mock(aio=mock.AsyncMock(side_effect=lambda key, default=None: self.data.get(key, default)))
+        self.put = mock.Mock(aio=mock.AsyncMock(side_effect=self._put))
+        self.pop = mock.Mock(aio=mock.AsyncMock(side_effect=lambda key, default=None: self.data.pop(key, default)))
+        self.items = mock.Mock(aio=self._items)
+        self.keys = mock.Mock(aio=self._keys)
+    
+    def _put(self, key, value, skip_if_exists=False):
+        if skip_if_exists and key in self.data:
+            return False
+        self.data[key] = value
+        return True
+    
+    async def _items(self):
+        for item in list(self.data.items()):
+            yield item
+    
+    async def _keys(self):
+        for key in list(self.data):
+            yield key
+
+
+class TakeTokenTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch("web.time.time", side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.admission = AdmissionController(rate_per_minute=60, burst=3)
+    
+    def test_burst_then_reject(self):
+        for _ in range(3):
+            self.admission.take_token("key")
+        with self.assertRaises(AdmissionRejected) as rejected:
+            self.admission.take_token("key")
+        self.assertEqual(rejected.exception.retry_after, 1)
+    
+    def test_tokens_refill_over_time(self):
+        for _ in range(3):
+            self.admission.take_token("key")
+        self.now += 2
+        self.admission.take_token("key")
+        self.admission.take_token("key")
+        with self.assertRaises(AdmissionRejected):
+            self.admission.take_token("key")
+    
+    def test_refill_is_capped_at_burst(self):
+        self.admission.take_token("key")
+        self.now += 3600
+        for _ in range(3):
+            self.admission.take_token("key")
+        with self.assertRaises(AdmissionRejected):
+            self.admission.take_token("key")
+    
+    def test_retry_after_rounds_up_the_missing_fraction(self):
+        admission = AdmissionController(rate_per_minute=6, burst=1)
+        admission.take_token("key")
+        self.now += 4
+        with self.assertRaises(AdmissionRejected) as rejected:
+            admission.take_token("key")
+        self.assertEqual(rejected.exception.retry_after, 6)
+    
+    def test_rejected_requests_do_not_spend_tokens(self):
+        admission = AdmissionController(rate_per_minute=60, burst=1)
+        admission.take_token("key")
+        self.now += 0.5
+        with self.assertRaises(AdmissionRejected):
+            admission.take_token("key")
+        self.now += 0.5
+        admission.take_token("key")
+    
+    def test_keys_have_separate_buckets(self):
+        for _ in range(3):
+            self.admission.take_token("first")
+        self.admission.take_token("second")
+        with self.assertRaises(AdmissionRejected):
+            self.admission.take_token("first")
+    
+    def test_client_ids_split_the_api_key_bucket(self):
+        for _ in range(3):
+            self.admission.take_token(rate_limit_key("key", "user-1"))
+        self.admission.take_token(rate_limit_key("key", "user-2"))
+        self.admission.take_token(rate_limit_key("key"))
+        with self.assertRaises(AdmissionRejected):
+            self.admission.take_token(rate_limit_key("key", "user-1"))
+
+
+class RunSlotTest(unittest.TestCase):
+    def setUp(self):
+        self.slots = FakeDict()
+        self.jobs = FakeDict()
+        for name, store in (("admission_slots", self.slots), ("job_store", self.jobs)):
+            patcher = mock.patch(f"web.{name}", store)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+    
+    def test_held_slots_are_skipped(self):
+        self.slots.data["slot-0"] = {"job_id": "running", "claimed_at": time.time()}
+        self.jobs.data["running"] = {"status": "running"}
+        self.assertEqual(asyncio.run(claim_run_slot("new", max_running=2)), "slot-1")
+        self.assertEqual(self.slots.data["slot-0"]["job_id"], "running")
+    
+    def test_slot_of_a_long_finished_job_is_taken_over_once(self):
+        stale = {"job_id": "done", "claimed_at": time.time() - 600}
+        self.slots.data["slot-0"] = stale
+        self.jobs.data["done"] = {"status": "succeeded", "finished_at": time.time() - 300}
+        self.assertEqual(asyncio.run(claim_run_slot("new", max_running=1)), "slot-0")
+        self.assertEqual(self.slots.data["slot-0"]["took_over"], "done")
+        # A second container that also saw the stale claim must not overwrite the new one
+        self.assertFalse(asyncio.run(take_over_claim(self.slots, "slot-0", stale, {"job_id": "other", "claimed_at": time.time()})))
+        self.assertEqual(self.slots.data["slot-0"]["job_id"], "new")
+    
+    def test_release_leaves_a_slot_taken_over_by_another_job(self):
+        self.slots.data["slot-0"] = {"job_id": "new", "claimed_at": time.time(), "took_over": "old"}
+        asyncio.run(release_run_slot("slot-0", "old"))
+        self.assertIn("slot-0", self.slots.data)
+        asyncio.run(release_run_slot("slot-0", "new"))
+        self.assertNotIn("slot-0", self.slots.data)
+
+
+class LoadJobTest(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.dict("os.environ", {"API_AUTH_KEY": "key"})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.job_store = mock.Mock()
+        patcher = mock.patch("web.job_store", self.job_store)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.call = mock.Mock()
+        patcher = mock.patch("web.modal.FunctionCall.from_id", return_value=self.call)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        
+        web_app = create_web_app(mock.Mock())
+        self.get_job = endpoint(web_app, "/jobs/{job_id}", "GET")
+    
+    def load(self, job: dict) -> dict:
+        self.job_store.get.aio = mock.AsyncMock(return_value=dict(job))
+        self.job_store.put.aio = mock.AsyncMock()
+        return asyncio.run(self.get_job("job", api_key="key"))
+    
+    def test_running_job_is_not_failed_by_the_builtin_timeout(self):
+        self.call.get.aio = mock.AsyncMock(side_effect=TimeoutError())
+        job = self.load({"job_id": "job", "status": "running", "call_id": "fc-1"})
+        self.assertEqual(job["status"], "running")
+        self.job_store.put.aio.assert_not_called()
+    
+    def test_finished_call_updates_the_record(self):
+        self.call.get.aio = mock.AsyncMock(return_value={"r2_url": "https://example.com/video.mp4"})
+        job = self.load({"job_id": "job", "status": "running", "call_id": "fc-1"})
+        self.assertEqual(job["status"], "succeeded")
+        self.assertEqual(job["result"], {"r2_url": "https://example.com/video.mp4"})
+        self.job_store.put.aio.assert_called_once()
+
+
+class CancelJobTest(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.dict("os.environ", {"API_AUTH_KEY": "key"})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.jobs = FakeDict({"job": {"job_id": "job", "status": "running", "call_id": "fc-1", "inflight_key": "payload"}})
+        self.inflight = FakeDict({"payload": {"job_id": "job", "claimed_at": time.time()}})
+        self.events = FakeDict({"job:0": {"seq": 0, "stage": "started"}})
+        for name, store in (("job_store", self.jobs), ("inflight_store", self.inflight), ("job_events", self.events)):
+            patcher = mock.patch(f"web.{name}", store)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.call = mock.Mock()
+        self.call.cancel.aio = mock.AsyncMock()
+        patcher = mock.patch("web.modal.FunctionCall.from_id", return_value=self.call)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.cancel = endpoint(create_web_app(mock.Mock()), "/jobs/{job_id}", "DELETE")
+    
+    def test_last_of_the_coalesced_callers_cancels(self):
+        self.inflight.data["payload:waiter:job:1"] = time.time()
+        self.inflight.data["payload:waiter:job:2"] = time.time()
+        for _ in range(2):
+            job = asyncio.run(self.cancel("job", api_key="key"))
+            self.assertTrue(job["detached"])
+            self.assertEqual(self.jobs.data["job"]["status"], "running")
+            self.call.cancel.aio.assert_not_called()
+        
+        job = asyncio.run(self.cancel("job", api_key="key"))
+        self.assertEqual(job["status"], "cancelled")
+        self.call.cancel.aio.assert_called_once()
+        self.assertEqual(self.events.data, {})
+    
+    def test_waiters_of_other_jobs_are_not_counted(self):
+        self.inflight.data["payload:waiter:older-job:1"] = time.time()
+        job = asyncio.run(self.cancel("job", api_key="key"))
+        self.assertEqual(job["status"], "cancelled")
+        self.assertIn("payload:waiter:older-job:1", self.inflight.data)
+
+
+class StreamJobEventsTest(unittest.TestCase):
+    def test_finished_job_streams_its_kept_final_event(self):
+        jobs = FakeDict({"job": {"job_id": "job", "status": "succeeded", "final_event_seq": 2}})
+        events = FakeDict({"job:2": {"seq": 2, "stage": "done", "r2_url": "https://example.com/video.mp4"}})
+        with mock.patch.dict("os.environ", {"API_AUTH_KEY": "key"}), mock.patch("web.job_store", jobs), mock.patch("web.job_events", events):
+            stream = endpoint(create_web_app(mock.Mock()), "/jobs/{job_id}/events", "GET")
+            
+            async def read():
+                response = await stream("job", api_key="key", last_event_id=None)
+                return "".join([chunk async for chunk in response.body_iterator])
+            
+            body = asyncio.run(read())
+        self.assertTrue(body.startswith("id: 2\nevent: done\n"))
+        self.assertIn("https://example.com/video.mp4", body)
+
+
+class MetricsEndpointTest(unittest.TestCase):
+    def test_stale_shards_are_dropped(self):
+        shard = {"counters": {"video_jobs_total": {'status="succeeded"': 2}}, "histograms": {}}
+        store = FakeDict({
+            "live": {**shard, "last_seen": time.time()},
+            "gone": {**shard, "last_seen": time.time() - 2 * 24 * 60 * 60},
+            "unstamped": shard,
+        })
+        with mock.patch.dict("os.environ", {"API_AUTH_KEY": "key"}), mock.patch("web.metrics_store", store):
+            metrics = endpoint(create_web_app(mock.Mock()), "/metrics", "GET")
+            response = asyncio.run(metrics(api_key="key"))
+        self.assertIn('video_jobs_total{status="succeeded"} 2\n', response.body.decode())
+        self.assertEqual(list(store.data), ["live"])
+
+
+class GenerateCacheHitTest(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.dict("os.environ", {"API_AUTH_KEY": "key"})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.stores = {}
+        for name in ("job_store", "result_cache", "metrics_store", "inflight_store", "admission_queue"):
+            store = mock.Mock()
+            store.get.aio = mock.AsyncMock(return_value=None)
+            store.put.aio = mock.AsyncMock(return_value=True)
+            store.pop.aio = mock.AsyncMock(return_value=None)
+            patcher = mock.patch(f"web.{name}", store)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+            self.stores[name] = store
+        self.generator_cls = mock.Mock()
+        self.generate = endpoint(create_web_app(self.generator_cls), "/generate", "POST")
+    
+    def test_cached_course_succeeds_without_a_worker(self):
+        self.stores["result_cache"].get.aio.return_value = {"result": {"r2_url": "https://example.com/video.mp4"}, "cached_at": time.time()}
+        response = asyncio.run(self.generate({"title": "Arrays", "blocks": ["Arrays store values."]}, api_key="key", client_id=None))
+        self.assertEqual(response["status"], "succeeded")
+        self.assertEqual(response["result"]["r2_url"], "https://example.com/video.mp4")
+        self.assertEqual(response["result"]["cache"], "hit")
+        self.generator_cls.assert_not_called()
+        self.stores["inflight_store"].put.aio.assert_not_called()
+        job_id, job = self.stores["job_store"].put.aio.call_args.args
+        self.assertEqual((job_id, job["status"]), (response["job_id"], "succeeded"))
+    
+    def test_expired_entry_and_use_cache_false_are_admitted(self):
+        self.stores["result_cache"].get.aio.return_value = {"result": {"r2_url": "https://example.com/video.mp4"}, "cached_at": 0}
+        with mock.patch("web.AdmissionController.reserve", side_effect=AdmissionRejected("Render queue is full", 1)):
+            for use_cache in (True, False):
+                with self.assertRaises(HTTPException) as rejected:
+                    asyncio.run(self.generate({"title": "Arrays", "blocks": ["Arrays store values."], "use_cache": use_cache}, api_key="key", client_id=None))
+                self.assertEqual(rejected.exception.status_code, 429)
+        self.generator_cls.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,396 @@
+"""R2 uploads: parallel multipart uploads and HLS publishing"""
+
+import hashlib
+import json
+import time
+
+from config import HLS_SEGMENT_SECONDS
+from jobs import update_job
+
+# Multipart upload tuning for R2 (all parts but the last must be the same size, at least 5 MB)
+R2_PART_SIZE = 16 * 1024 * 1024
+R2_MIN_PART_SIZE = 5 * 1024 * 1024
+R2_UPLOAD_CONCURRENCY = 8
+
+
+def create_r2_client():
+    """Create an S3 client for Cloudflare R2"""
+    import os
+    import boto3
+    
+    return boto3.client(
+        's3',
+        endpoint_url=os.environ["R2_STORAGE_ENDPOINT"],
+        aws_access_key_id=os.environ["R2_STORAGE_ACCESS_KEY"],
+        aws_secret_access_key=os.environ["R2_STORAGE_SECRET_KEY"],
+        region_name='auto'
+    )
+
+
+class R2MultipartUpload:
+    """
+    Parallel, resumable multipart upload of one object to R2 with per-part checksums
+    
+    Every part carries a Content-MD5 that R2 verifies on receipt, each part is
+    retried on its own, and the final ETag is checked against the composite MD5
+    of all parts. Upload state is kept in a sidecar file so a retried upload
+    resumes from the parts R2 already has. on_progress, if given, is called
+    with the bytes sent so far after every part.
+    """
+    
+    def __init__(self, s3_client, bucket: str, key: str, content_type: str = "video/mp4", part_size: int = None, concurrency: int = None, state_path: str = None, on_progress=None):
+        import threading
+        
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.content_type = content_type
+        self.part_size = max(part_size or R2_PART_SIZE, R2_MIN_PART_SIZE)
+        self.concurrency = concurrency or R2_UPLOAD_CONCURRENCY
+        self.state_path = state_path
+        self.on_progress = on_progress
+        self.upload_id = None
+        self.parts = {}  # part number -> {"ETag": ..., "md5": hex digest}
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+    
+    def _start(self):
+        """Create the multipart upload, or resume the one already in progress or recorded in the state file"""
+        import os
+        
+        if self.upload_id is None and self.state_path and os.path.exists(self.state_path):
+            with open(self.state_path) as f:
+                state = json.load(f)
+            if state.get("key") == self.key:
+                self.upload_id = state["upload_id"]
+        
+        if self.upload_id:
+            try:
+                parts = {}
+                paginator = self.s3_client.get_paginator("list_parts")
+                for page in paginator.paginate(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id):
+                    for part in page.get("Parts", []):
+                        parts[part["PartNumber"]] = {"ETag": part["ETag"], "md5": None}
+                self.parts = parts
+                print(f"  Resuming multipart upload with {len(self.parts)} part(s) already on R2")
+                return
+            except Exception as e:
+                print(f"  ✗ Could not resume multipart upload ({e}), starting over")
+                self.parts = {}
+        
+        response = self.s3_client.create_multipart_upload(Bucket=self.bucket, Key=self.key, ContentType=self.content_type)
+        self.upload_id = response["UploadId"]
+        self._save_state()
+    
+    def _save_state(self):
+        if not self.state_path:
+            return
+        with open(self.state_path, "w") as f:
+            json.dump({"key": self.key, "upload_id": self.upload_id}, f)
+    
+    def _clear_state(self):
+        import os
+        
+        if self.state_path and os.path.exists(self.state_path):
+            os.remove(self.state_path)
+    
+    def _upload_part(self, part_number: int, data: bytes):
+        """Upload one part with its own retries, skipping parts R2 already has with the same checksum"""
+        import base64
+        
+        digest = hashlib.md5(data)
+        existing = self.parts.get(part_number)
+        if existing and existing["ETag"].strip('"') == digest.hexdigest():
+            existing["md5"] = digest.hexdigest()
+            self._record_sent(len(data))
+            return
+        
+        max_part_retries = 3
+        part_retry_delay = 1
+        
+        for part_retry in range(max_part_retries):
+            try:
+                response = self.s3_client.upload_part(
+                    Bucket=self.bucket,
+                    Key=self.key,
+                    UploadId=self.upload_id,
+                    PartNumber=part_number,
+                    Body=data,
+                    ContentMD5=base64.b64encode(digest.digest()).decode("ascii"),
+                )
+                if response["ETag"].strip('"') != digest.hexdigest():
+                    raise Exception(f"Checksum mismatch for part {part_number}")
+                with self._lock:
+                    self.parts[part_number] = {"ETag": response["ETag"], "md5": digest.hexdigest()}
+                self._record_sent(len(data))
+                return
+            except Exception as part_error:
+                print(f"  ✗ Part {part_number} upload error (attempt {part_retry + 1}/{max_part_retries}): {part_error}")
+                if part_retry < max_part_retries - 1:
+                    time.sleep(part_retry_delay * (2 ** part_retry))
+                else:
+                    raise
+    
+    def _record_sent(self, size: int):
+        with self._lock:
+            self.bytes_sent += size
+            bytes_sent = self.bytes_sent
+        if self.on_progress:
+            self.on_progress(bytes_sent)
+    
+    def _complete(self, expected_size: int) -> dict:
+        """Complete the upload and verify the composite ETag and object size"""
+        part_numbers = sorted(self.parts)
+        expected_count = max(1, -(-expected_size // self.part_size))
+        if part_numbers != list(range(1, expected_count + 1)):
+            raise Exception(f"Multipart upload has parts {part_numbers}, expected 1-{expected_count}")
+        missing = [number for number in part_numbers if not self.parts[number].get("md5")]
+        if missing:
+            raise Exception(f"Parts {missing} have no verified checksum, refusing to complete")
+        
+        response = self.s3_client.complete_multipart_upload(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self.upload_id,
+            MultipartUpload={
+                "Parts": [{"ETag": self.parts[number]["ETag"], "PartNumber": number} for number in part_numbers]
+            },
+        )
+        self._clear_state()
+        
+        # S3-style composite ETag: md5 of the concatenated part digests, suffixed with the part count
+        composite = hashlib.md5(b"".join(bytes.fromhex(self.parts[number]["md5"]) for number in part_numbers))
+        expected_etag = f"{composite.hexdigest()}-{len(part_numbers)}"
+        if response.get("ETag", "").strip('"') != expected_etag:
+            raise Exception(f"Uploaded object ETag {response.get('ETag')} does not match expected {expected_etag}")
+        
+        head = self.s3_client.head_object(Bucket=self.bucket, Key=self.key)
+        if head["ContentLength"] != expected_size:
+            raise Exception(f"Uploaded object is {head['ContentLength']} bytes, expected {expected_size}")
+        
+        return {"parts": len(part_numbers), "bytes": expected_size, "etag": expected_etag, "verified": True}
+    
+    def abort(self):
+        """Abort the multipart upload so R2 discards its parts"""
+        if self.upload_id:
+            try:
+                self.s3_client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+            except Exception as e:
+                print(f"  ✗ Failed to abort multipart upload: {e}")
+        self._clear_state()
+    
+    def upload_file(self, path: str) -> dict:
+        """Upload a finished file with parts sent concurrently"""
+        import os
+        from concurrent.futures import ThreadPoolExecutor
+        
+        self._start()
+        size = os.path.getsize(path)
+        self.bytes_sent = 0
+        # A resumed upload may hold parts past the end of a file that has since shrunk
+        count = max(1, -(-size // self.part_size))
+        self.parts = {number: part for number, part in self.parts.items() if number <= count}
+        
+        def read_and_upload(part_number, offset):
+            with open(path, "rb") as f:
+                f.seek(offset)
+                self._upload_part(part_number, f.read(self.part_size))
+        
+        offsets = range(0, max(size, 1), self.part_size)
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            futures = [executor.submit(read_and_upload, number, offset) for number, offset in enumerate(offsets, 1)]
+            for future in futures:
+                future.result()
+        
+        return self._complete(size)
+
+
+def upload_to_r2(video_path: str, r2_filename: str, content_type: str = "video/mp4", s3_client=None, on_progress=None) -> str:
+    """Upload a file to Cloudflare R2 as a parallel multipart upload, resuming on retries, and return its public URL"""
+    import os
+    
+    # Upload to R2 with retry logic
+    print("Uploading to Cloudflare R2...")
+    if s3_client is None:
+        s3_client = create_r2_client()
+    
+    # Retry logic for R2 upload - parts are retried individually, whole-upload retries resume
+    max_upload_retries = 3
+    upload_retry_delay = 2
+    upload = R2MultipartUpload(
+        s3_client,
+        os.environ["R2_STORAGE_BUCKET_NAME"],
+        r2_filename,
+        content_type=content_type,
+        state_path=f"{video_path}.upload.json",
+        on_progress=on_progress,
+    )
+    
+    for upload_retry in range(max_upload_retries):
+        try:
+            print(f"  Upload attempt {upload_retry + 1}/{max_upload_retries}...")
+            upload_start = time.time()
+            upload_stats = upload.upload_file(video_path)
+            print(f"✓ Uploaded to R2: {r2_filename} ({upload_stats['parts']} part(s) in {time.time() - upload_start:.1f}s)")
+            break
+        except Exception as upload_error:
+            print(f"  ✗ Upload error (attempt {upload_retry + 1}/{max_upload_retries}): {upload_error}")
+            if upload_retry < max_upload_retries - 1:
+                wait_time = upload_retry_delay * (2 ** upload_retry)
+                print(f"  Retrying upload in {wait_time} seconds...")
+                time.sleep(wait_time)
+            else:
+                upload.abort()
+                raise Exception(f"Failed to upload to R2 after {max_upload_retries} attempts: {upload_error}")
+    
+    return f"{os.environ['R2_STORAGE_BASE_URL']}/{r2_filename}"
+
+
+def encode_hls_segments(video_path: str, output_dir: str, prefix: str) -> list:
+    """
+    Split a video into fMP4 HLS segments (stream copy) and return its playlist entries
+    
+    Each entry is a (duration, filename) tuple; the init segment is written to
+    {prefix}_init.mp4 in output_dir.
+    """
+    import os
+    import subprocess
+    
+    os.makedirs(output_dir, exist_ok=True)
+    playlist_path = f"{output_dir}/{prefix}.m3u8"
+    subprocess.run(
+        [
+            "ffmpeg", "-y", "-v", "error",
+            "-i", video_path,
+            "-c", "copy",
+            "-f", "hls",
+            "-hls_time", str(HLS_SEGMENT_SECONDS),
+            "-hls_playlist_type", "vod",
+            "-hls_segment_type", "fmp4",
+            "-hls_fmp4_init_filename", f"{prefix}_init.mp4",
+            "-hls_segment_filename", f"{output_dir}/{prefix}_%03d.m4s",
+            playlist_path,
+        ],
+        check=True,
+    )
+    
+    entries = []
+    duration = None
+    with open(playlist_path) as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith("#EXTINF:"):
+                duration = float(line[len("#EXTINF:"):].split(",")[0])
+            elif line and not line.startswith("#"):
+                entries.append((duration, line))
+    return entries
+
+
+class HlsPublisher:
+    """
+    Publish an fMP4 HLS stream to R2 one rendered video at a time
+    
+    Every added video becomes a discontinuity with its own init segment, its
+    segments are uploaded as soon as they are cut, and the EVENT playlist is
+    re-uploaded so players can start on the first part while later parts
+    are still rendering.
+    """
+    
+    def __init__(self, s3_client, r2_prefix: str, work_dir: str, job_id: str = None):
+        import os
+        
+        self.s3_client = s3_client
+        self.bucket = os.environ["R2_STORAGE_BUCKET_NAME"]
+        self.r2_prefix = r2_prefix
+        self.work_dir = work_dir
+        self.job_id = job_id
+        self.playlist_key = f"{r2_prefix}/playlist.m3u8"
+        self.playlist_url = f"{os.environ['R2_STORAGE_BASE_URL']}/{self.playlist_key}"
+        self.parts = []  # (init filename, [(duration, segment filename), ...]) per added video
+        self.published_at = None
+        self.uploaded_bytes = 0
+    
+    def _put(self, body: bytes, key: str, content_type: str, cache_control: str = None):
+        """Upload a small object with a Content-MD5 and retries"""
+        import base64
+        
+        max_put_retries = 3
+        put_retry_delay = 1
+        extra = {"CacheControl": cache_control} if cache_control else {}
+        
+        for put_retry in range(max_put_retries):
+            try:
+                self.s3_client.put_object(
+                    Bucket=self.bucket,
+                    Key=key,
+                    Body=body,
+                    ContentType=content_type,
+                    ContentMD5=base64.b64encode(hashlib.md5(body).digest()).decode("ascii"),
+                    **extra,
+                )
+                self.uploaded_bytes += len(body)
+                return
+            except Exception as put_error:
+                print(f"  ✗ Upload error for {key} (attempt {put_retry + 1}/{max_put_retries}): {put_error}")
+                if put_retry < max_put_retries - 1:
+                    time.sleep(put_retry_delay * (2 ** put_retry))
+                else:
+                    raise
+    
+    def _playlist(self, finished: bool) -> str:
+        # Keyframe-aligned cuts can overrun hls_time; leave headroom so the target rarely changes between updates
+        max_duration = max([duration for _, entries in self.parts for duration, _ in entries] + [2 * HLS_SEGMENT_SECONDS])
+        lines = [
+            "#EXTM3U",
+            "#EXT-X-VERSION:7",
+            f"#EXT-X-TARGETDURATION:{int(max_duration + 0.999)}",
+            "#EXT-X-MEDIA-SEQUENCE:0",
+            "#EXT-X-PLAYLIST-TYPE:EVENT",
+            "#EXT-X-INDEPENDENT-SEGMENTS",
+        ]
+        for i, (init_filename, entries) in enumerate(self.parts):
+            if i > 0:
+                lines.append("#EXT-X-DISCONTINUITY")
+            lines.append(f'#EXT-X-MAP:URI="{init_filename}"')
+            for duration, filename in entries:
+                lines.append(f"#EXTINF:{duration:.6f},")
+                lines.append(filename)
+        if finished:
+            lines.append("#EXT-X-ENDLIST")
+        return "\n".join(lines) + "\n"
+    
+    def add_video(self, video_path: str):
+        """Cut a finished video into segments, upload them and republish the playlist"""
+        from concurrent.futures import ThreadPoolExecutor
+        
+        prefix = f"part{len(self.parts) + 1:03d}"
+        entries = encode_hls_segments(video_path, self.work_dir, prefix)
+        init_filename = f"{prefix}_init.mp4"
+        
+        def upload_file(filename, content_type):
+            with open(f"{self.work_dir}/{filename}", "rb") as f:
+                self._put(f.read(), f"{self.r2_prefix}/{filename}", content_type)
+        
+        with ThreadPoolExecutor(max_workers=R2_UPLOAD_CONCURRENCY) as executor:
+            futures = [executor.submit(upload_file, init_filename, "video/mp4")]
+            futures += [executor.submit(upload_file, filename, "video/iso.segment") for _, filename in entries]
+            for future in futures:
+                future.result()
+        
+        self.parts.append((init_filename, entries))
+        self._put(self._playlist(finished=False).encode("utf-8"), self.playlist_key, "application/vnd.apple.mpegurl", "no-cache")
+        
+        if self.published_at is None:
+            self.published_at = time.time()
+            update_job(self.job_id, playlist_url=self.playlist_url)
+        print(f"✓ Published HLS {prefix} ({len(entries)} segment(s)): {self.playlist_url}")
+    
+    def finish(self) -> dict:
+        """Mark the playlist as complete"""
+        self._put(self._playlist(finished=True).encode("utf-8"), self.playlist_key, "application/vnd.apple.mpegurl", "no-cache")
+        return {
+            "playlist_url": self.playlist_url,
+            "parts": len(self.parts),
+            "segments": sum(len(entries) for _, entries in self.parts),
+            "uploaded_bytes": self.uploaded_bytes,
+        }
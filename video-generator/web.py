@@ -0,0 +1,996 @@
+"""FastAPI job API with admission control"""
+
+import modal
+import heapq
+import itertools
+import json
+import time
+import uuid
+
+from config import DEFAULT_RENDER_PROFILE, OUTPUT_FORMATS, RENDER_MODES, RENDER_PROFILES
+from cache import RESULT_CACHE_TTL_SECONDS, block_hashes, result_cache, result_cache_key
+from jobs import (
+    INFLIGHT_JOIN_SECONDS, INFLIGHT_TTL_SECONDS, JOB_EVENT_FINAL_STAGES,
+    JOB_EVENT_KEEPALIVE_SECONDS, JOB_EVENT_POLL_SECONDS, JOB_EVENT_STATUS_SECONDS,
+    JOB_TERMINAL_STATUSES, METRICS_SHARD_TTL_SECONDS, increment_counter, inflight_key, inflight_store,
+    job_events, job_store, metric_labels, metrics_shard, metrics_store, observe_histogram, render_prometheus_metrics,
+    take_over_claim, takeover_key, waiter_prefix,
+)
+
+# Batch generation limits
+BATCH_MAX_ITEMS = 1000
+BATCH_DEFAULT_CONCURRENCY = 4
+BATCH_MAX_CONCURRENCY = 20
+BATCH_HEARTBEAT_SECONDS = 30
+BATCH_TIMEOUT_SECONDS = 12 * 60 * 60
+
+# Admission control in the web app. The run cap is global through admission_slots; the queue
+# and rate limits live in the web container, which runs as a single container
+ADMISSION_MAX_RUNNING = 20  # Render jobs running at once across all API keys
+ADMISSION_MAX_QUEUED = 200  # Jobs waiting for a slot before new requests are refused with a 429
+ADMISSION_PRIORITIES = ("interactive", "batch")  # Dispatch order when a slot frees up
+ADMISSION_ORPHAN_SECONDS = 60  # A queued job with no queue entry and no worker for this long is failed
+
+# Jobs admitted but not yet spawned, keyed by job id, so a redeployed web container re-admits them
+admission_queue = modal.Dict.from_name("manim-admission-queue", create_if_missing=True)
+
+# Run slots held by dispatched jobs, keyed "slot-{n}" for n < ADMISSION_MAX_RUNNING, so the cap
+# also counts jobs started by a web container that has since restarted
+admission_slots = modal.Dict.from_name("manim-admission-slots", create_if_missing=True)
+ADMISSION_SLOT_POLL_SECONDS = 2  # How often a job admitted in memory retries while every slot is held
+ADMISSION_SLOT_GRACE_SECONDS = 60  # How long a finished job's holder has to release its own slot
+ADMISSION_SLOT_TTL_SECONDS = 2 * 60 * 60  # Longer than any render, so a slot whose job never finished is reclaimed
+
+RATE_LIMIT_PER_MINUTE = 30  # Token bucket refill rate per client
+RATE_LIMIT_BURST = 10  # Token bucket capacity per client
+
+
+class AdmissionRejected(Exception):
+    """A request was refused by admission control; retry_after is in whole seconds"""
+    
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = max(1, int(retry_after + 0.999))
+
+
+class AdmissionController:
+    """
+    Per-client token buckets and a cap on running jobs with a bounded priority queue
+    
+    Jobs beyond the cap wait for a slot, interactive ahead of batch and first in,
+    first out within a priority. State lives in the web container's event loop;
+    the jobs waiting in it are also persisted in admission_queue, and a job
+    granted a slot here still claims a persisted one (see claim_run_slot).
+    """
+    
+    def __init__(self, max_running: int = ADMISSION_MAX_RUNNING, max_queued: int = ADMISSION_MAX_QUEUED, rate_per_minute: float = RATE_LIMIT_PER_MINUTE, burst: int = RATE_LIMIT_BURST):
+        self.max_running = max_running
+        self.max_queued = max_queued
+        self.rate = rate_per_minute / 60
+        self.burst = burst
+        self.buckets = {}  # Client key (see rate_limit_key) -> (tokens, last refill time)
+        self.running = 0
+        self.queue = []  # Heap of (priority rank, sequence, queued_at, future)
+        self.sequence = itertools.count()
+        self.job_seconds = 120.0  # Moving average of job run time, for Retry-After estimates
+    
+    def take_token(self, client: str):
+        """Spend one request token for client, raising AdmissionRejected when its bucket is empty"""
+        now = time.time()
+        tokens, refilled_at = self.buckets.get(client, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - refilled_at) * self.rate)
+        if tokens < 1:
+            self.buckets[client] = (tokens, now)
+            raise AdmissionRejected("Rate limit exceeded for this client", (1 - tokens) / self.rate)
+        self.buckets[client] = (tokens - 1, now)
+    
+    def reserve(self, priority: str, queued_at: float = None):
+        """
+        Claim a run slot, returning a future that resolves to the seconds spent queued
+        
+        Resolves immediately while under the cap; raises AdmissionRejected when the queue is full.
+        queued_at backdates a job re-admitted after a redeploy.
+        """
+        import asyncio
+        
+        slot = asyncio.get_running_loop().create_future()
+        queued_at = queued_at or time.time()
+        if self.running < self.max_running and not self.queue:
+            self.running += 1
+            slot.set_result(time.time() - queued_at)
+            return slot
+        
+        if len(self.queue) >= self.max_queued:
+            raise AdmissionRejected(
+                "Render queue is full",
+                self.job_seconds * (len(self.queue) + 1) / self.max_running,
+            )
+        heapq.heappush(self.queue, (ADMISSION_PRIORITIES.index(priority), next(self.sequence), queued_at, slot))
+        return slot
+    
+    def release(self, job_seconds: float = None):
+        """Free a run slot and hand it to the highest-priority queued job"""
+        if job_seconds is not None:
+            self.job_seconds = 0.8 * self.job_seconds + 0.2 * job_seconds
+        self.running -= 1
+        while self.queue and self.running < self.max_running:
+            _, _, queued_at, slot = heapq.heappop(self.queue)
+            if slot.cancelled():
+                continue
+            self.running += 1
+            slot.set_result(time.time() - queued_at)
+    
+    def gauges(self) -> dict:
+        """Current queue depth per priority, running jobs and the oldest queued job's wait"""
+        now = time.time()
+        depth = {priority: 0 for priority in ADMISSION_PRIORITIES}
+        for rank, _, _, slot in self.queue:
+            if not slot.cancelled():
+                depth[ADMISSION_PRIORITIES[rank]] += 1
+        return {
+            "video_admission_queue_depth": {metric_labels(priority=priority): count for priority, count in depth.items()},
+            "video_admission_running": {"": self.running},
+            "video_admission_oldest_wait_seconds": {"": round(max([now - queued_at for _, _, queued_at, _ in self.queue] + [0.0]), 3)},
+        }
+
+
+def rate_limit_key(api_key: str, client_id: str = None) -> str:
+    """
+    Token bucket key for a request
+    
+    Every caller shares the one API key, so a bucket per key would be a single
+    global bucket; callers that pass X-Client-Id (e.g. the end user's id) get
+    a bucket of their own under that key.
+    """
+    return f"{api_key}:{client_id}" if client_id else api_key
+
+
+async def slot_is_stale(claim: dict) -> bool:
+    """Whether a persisted run slot's job finished a while ago, was never recorded or outlived any render"""
+    now = time.time()
+    if now - claim["claimed_at"] > ADMISSION_SLOT_TTL_SECONDS:
+        return True
+    job = await job_store.get.aio(claim["job_id"])
+    if not job:
+        return now - claim["claimed_at"] > ADMISSION_SLOT_GRACE_SECONDS
+    return job["status"] in JOB_TERMINAL_STATUSES and now - job.get("finished_at", 0) > ADMISSION_SLOT_GRACE_SECONDS
+
+
+async def claim_run_slot(job_id: str, max_running: int = ADMISSION_MAX_RUNNING) -> str:
+    """
+    Claim one of max_running persisted run slots for job_id, waiting while all are held
+    
+    Free slots are created with skip_if_exists, so two web containers never hold
+    the same one, and a slot left by a dead holder is taken over by exactly one
+    job. Returns the slot's key for release_run_slot.
+    """
+    import asyncio
+    
+    claim = {"job_id": job_id, "claimed_at": time.time()}
+    while True:
+        held = {key: held_claim async for key, held_claim in admission_slots.items.aio()}
+        for n in range(max_running):
+            key = f"slot-{n}"
+            if key not in held:
+                if await admission_slots.put.aio(key, claim, skip_if_exists=True):
+                    return key
+            elif await slot_is_stale(held[key]) and await take_over_claim(admission_slots, key, held[key], claim):
+                print(f"  ⚠ Reclaimed run slot {key} from job {held[key]['job_id']}")
+                return key
+        await asyncio.sleep(ADMISSION_SLOT_POLL_SECONDS)
+
+
+async def release_run_slot(key: str, job_id: str):
+    """Free a persisted run slot unless another job has since taken it over"""
+    try:
+        claim = await admission_slots.get.aio(key)
+        if claim and claim["job_id"] == job_id:
+            await admission_slots.pop.aio(key, None)
+            if claim.get("took_over"):
+                await admission_slots.pop.aio(takeover_key(key, claim["took_over"]), None)
+    except Exception as e:
+        print(f"  ✗ Failed to release run slot {key}: {e}")
+
+
+def create_web_app(generator_cls):
+    """FastAPI job API whose admitted jobs run on generator_cls"""
+    import asyncio
+    import os 
+    from contextlib import asynccontextmanager
+    from fastapi import FastAPI, HTTPException, Header
+    from fastapi.middleware.cors import CORSMiddleware
+    from fastapi.responses import PlainTextResponse, StreamingResponse
+    from typing import Optional
+    
+    @asynccontextmanager
+    async def lifespan(app):
+        # Jobs a previous web container queued but never spawned would otherwise stay "queued" forever
+        task = asyncio.create_task(recover_queued_jobs())
+        admitted_tasks.add(task)
+        task.add_done_callback(admitted_tasks.discard)
+        yield
+    
+    web_app = FastAPI(title="Manim Course Video Generator", lifespan=lifespan)
+    
+    # Enable CORS
+    web_app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+
+    def verify_api_key(x_api_key: Optional[str] = Header(None)):
+        if not x_api_key:
+            raise HTTPException(status_code=401, detail="API key is missing")
+        
+        # Get the valid API key from environment
+        valid_api_key = os.environ.get("API_AUTH_KEY")
+        
+        if x_api_key != valid_api_key:
+            raise HTTPException(status_code=403, detail="Invalid API key")
+        
+        return x_api_key
+    
+    def parse_generate_request(data: dict):
+        """Validate a /generate payload and split it into course data and generation options"""
+        if "title" not in data or "blocks" not in data:
+            raise HTTPException(
+                status_code=400, 
+                detail="Missing required fields: 'title' and 'blocks'"
+            )
+        
+        # Create course_data dict without the generation options
+        course_data = {
+            "title": data["title"],
+            "blocks": data["blocks"],
+            "subject": data.get("subject", "")
+        }
+        
+        render_mode = data.get("render_mode", "single")
+        if render_mode not in RENDER_MODES:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Invalid render_mode '{render_mode}', expected one of: {', '.join(RENDER_MODES)}"
+            )
+        
+        output_format = data.get("output_format", "mp4")
+        if output_format not in OUTPUT_FORMATS:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Invalid output_format '{output_format}', expected one of: {', '.join(OUTPUT_FORMATS)}"
+            )
+        
+        render_profile = data.get("render_profile", DEFAULT_RENDER_PROFILE)
+        if render_profile not in RENDER_PROFILES:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Invalid render_profile '{render_profile}', expected one of: {', '.join(RENDER_PROFILES)}"
+            )
+        
+        if output_format == "hls" and render_mode != "parallel":
+            raise HTTPException(
+                status_code=400,
+                detail="output_format 'hls' requires render_mode 'parallel' (single-mode renders have nothing to publish early)"
+            )
+        
+        stream_upload = bool(data.get("stream_upload", False))
+        if stream_upload and render_mode != "single":
+            raise HTTPException(
+                status_code=400,
+                detail="stream_upload is only supported with render_mode 'single'"
+            )
+        
+        upgrade_to_hq = bool(data.get("upgrade_to_hq", False))
+        if upgrade_to_hq and render_mode != "single":
+            raise HTTPException(
+                status_code=400,
+                detail="upgrade_to_hq is only supported with render_mode 'single'"
+            )
+        
+        options = {
+            "max_retries": data.get("max_retries", 3),
+            "use_cache": bool(data.get("use_cache", True)),
+            "render_mode": render_mode,
+            "speculative_candidates": int(data.get("speculative_candidates", 1)),
+            "stream_upload": stream_upload,
+            "output_format": output_format,
+            "render_profile": render_profile,
+            "upgrade_to_hq": upgrade_to_hq,
+            "use_templates": bool(data.get("use_templates", False)),
+        }
+        return course_data, options
+    
+    def parse_priority(data: dict) -> str:
+        """Validate the optional admission priority of a request"""
+        priority = data.get("priority", "interactive")
+        if priority not in ADMISSION_PRIORITIES:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Invalid priority '{priority}', expected one of: {', '.join(ADMISSION_PRIORITIES)}"
+            )
+        return priority
+    
+    admission = AdmissionController()
+    admitted_tasks = set()  # Strong references so pending dispatch tasks are not garbage collected
+    owner = os.environ.get("MODAL_TASK_ID", "local")  # Marks the admission_queue entries this container dispatches
+    
+    async def publish_metrics():
+        """Publish this container's coalescing and admission metrics as its shard"""
+        try:
+            await metrics_store.put.aio(os.environ.get("MODAL_TASK_ID", "local"), metrics_shard())
+        except Exception as e:
+            print(f"  ✗ Failed to publish metrics: {e}")
+    
+    async def reject(e: AdmissionRejected, reason: str):
+        increment_counter("video_admission_rejected_total", reason=reason)
+        await publish_metrics()
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    
+    async def wait_for_call(job_id: str):
+        """Wait until a job's worker has been spawned and return its function call"""
+        while True:
+            job = await job_store.get.aio(job_id) or {}
+            if job.get("call_id"):
+                return modal.FunctionCall.from_id(job["call_id"])
+            if job.get("status") in JOB_TERMINAL_STATUSES:
+                raise Exception(job.get("error") or f"Job {job_id} was {job['status']} before it started")
+            await asyncio.sleep(1)
+    
+    async def join_inflight_job(key: str):
+        """
+        Return (claim, job record) for the claim on key
+        
+        The claim is None once its owner released it; the job record is None when
+        the claim is stale, i.e. its job finished, was never recorded or is too old.
+        """
+        deadline = time.time() + INFLIGHT_JOIN_SECONDS
+        while True:
+            claim = await inflight_store.get.aio(key)
+            if not claim or time.time() - claim["claimed_at"] > INFLIGHT_TTL_SECONDS:
+                return claim, None
+            
+            job = await job_store.get.aio(claim["job_id"])
+            if job:
+                return claim, None if job["status"] in JOB_TERMINAL_STATUSES else job
+            
+            # The owner claimed the payload but has not recorded its job yet
+            if time.time() > deadline:
+                return claim, None
+            await asyncio.sleep(0.2)
+    
+    async def run_admitted(job_id: str, course_data: dict, options: dict, priority: str, slot, started):
+        """
+        Wait for a run slot, spawn the worker and hold the slot until the job finishes
+        
+        The in-memory slot is followed by a persisted one, which also counts jobs
+        a restarted web container left running. Popping the job's admission_queue
+        entry claims it, so a job re-admitted by another web container during a
+        redeploy is spawned only once.
+        """
+        wait_seconds = await slot
+        run_start = time.time()
+        slot_key = None
+        try:
+            slot_key = await claim_run_slot(job_id, admission.max_running)
+            wait_seconds += time.time() - run_start
+            observe_histogram("video_admission_wait_seconds", wait_seconds, priority=priority)
+            run_start = time.time()
+            
+            if await admission_queue.pop.aio(job_id, None) is None:
+                print(f"Job {job_id} was cancelled or dispatched by another web container")
+                started.set_result(await wait_for_call(job_id))
+                return
+            
+            job = await job_store.get.aio(job_id) or {"job_id": job_id}
+            if job.get("status") == "cancelled":
+                raise Exception(f"Job {job_id} was cancelled while queued")
+            job["dispatched_at"] = time.time()
+            await job_store.put.aio(job_id, job)
+            
+            call = await generator_cls().generate.spawn.aio(course_data, job_id=job_id, **options)
+            
+            # The worker may already have updated the record, so merge rather than overwrite
+            job = await job_store.get.aio(job_id) or job
+            job["call_id"] = call.object_id
+            job["queued_seconds"] = round(wait_seconds, 3)
+            job.pop("queue_position", None)
+            await job_store.put.aio(job_id, job)
+            started.set_result(call)
+            
+            try:
+                await call.get.aio()
+            except Exception:
+                pass  # The job record carries the outcome, this only holds the slot
+        except Exception as e:
+            if not started.done():
+                started.set_exception(e)
+                job = await job_store.get.aio(job_id) or {"job_id": job_id}
+                if job.get("status") not in JOB_TERMINAL_STATUSES:
+                    job.update(status="failed", error=str(e), finished_at=time.time())
+                    await job_store.put.aio(job_id, job)
+        finally:
+            if slot_key:
+                await release_run_slot(slot_key, job_id)
+            admission.release(time.time() - run_start)
+            await publish_metrics()
+    
+    def start_admitted(job_id: str, course_data: dict, options: dict, priority: str, slot):
+        """Run run_admitted in the background, returning the future of the worker's function call"""
+        started = asyncio.get_running_loop().create_future()
+        task = asyncio.create_task(run_admitted(job_id, course_data, options, priority, slot, started))
+        admitted_tasks.add(task)
+        task.add_done_callback(admitted_tasks.discard)
+        return started
+    
+    async def recover_queued_jobs():
+        """Re-admit admission_queue entries left by another web container, oldest first"""
+        try:
+            entries = [(job_id, entry) async for job_id, entry in admission_queue.items.aio() if entry.get("owner") != owner]
+        except Exception as e:
+            print(f"  ✗ Failed to read the admission queue: {e}")
+            return
+        
+        recovered = 0
+        for job_id, entry in sorted(entries, key=lambda item: item[1]["queued_at"]):
+            job = await job_store.get.aio(job_id)
+            if not job or job["status"] != "queued" or job.get("call_id"):
+                await admission_queue.pop.aio(job_id, None)
+                continue
+            try:
+                slot = admission.reserve(entry["priority"], queued_at=entry["queued_at"])
+            except AdmissionRejected as e:
+                await admission_queue.pop.aio(job_id, None)
+                job.update(status="failed", error=f"Could not re-admit job after a redeploy: {e}", finished_at=time.time())
+                await job_store.put.aio(job_id, job)
+                continue
+            await admission_queue.put.aio(job_id, {**entry, "owner": owner})
+            start_admitted(job_id, entry["course_data"], entry["options"], entry["priority"], slot)
+            recovered += 1
+        if recovered:
+            print(f"✓ Re-admitted {recovered} queued job(s) from a previous web container")
+    
+    async def cached_job(course_data: dict, options: dict, batch_id: str = None, priority: str = "interactive"):
+        """Record a succeeded job for a payload whose video is already in the result cache, or return None"""
+        from datetime import datetime
+        
+        if not options["use_cache"]:
+            return None
+        
+        upload_mode = "stream" if options["stream_upload"] else "faststart"
+        cache_key = result_cache_key(course_data, options["render_mode"], options["output_format"], options["render_profile"], options["use_templates"], upload_mode)
+        try:
+            cached = await result_cache.get.aio(cache_key)
+        except Exception as e:
+            print(f"  ✗ Result cache lookup failed: {e}")
+            return None
+        # Expired entries are left for the worker to evict on its own lookup
+        if not cached or time.time() - cached.get("cached_at", 0) > RESULT_CACHE_TTL_SECONDS:
+            return None
+        
+        print(f"✓ Result cache hit: {cache_key[:12]}...")
+        result = dict(cached["result"])
+        result["cache"] = "hit"
+        result["cached_at"] = datetime.fromtimestamp(cached["cached_at"]).isoformat()
+        now = time.time()
+        job = {
+            "job_id": uuid.uuid4().hex,
+            "status": "succeeded",
+            "title": course_data["title"],
+            "created_at": now,
+            "finished_at": now,
+            "priority": priority,
+            "result": result,
+        }
+        if batch_id:
+            job["batch_id"] = batch_id
+        await job_store.put.aio(job["job_id"], job)
+        increment_counter("video_jobs_total", status="succeeded", cache="hit")
+        await publish_metrics()
+        return job
+    
+    async def enqueue_job(course_data: dict, options: dict, batch_id: str = None, priority: str = "interactive"):
+        """
+        Record a job and admit it, returning (job_id, started, job record)
+        
+        started resolves to the worker's function call once the job holds a run
+        slot; the job is queued by priority while all slots are busy, and a full
+        queue is refused with a 429. If an identical payload is already in flight,
+        its job is returned instead (with "coalesced": True in the record) so every
+        caller gets the same result; each joined request is counted as a waiter
+        (see cancel_job). A payload already in the result cache gets a
+        succeeded job carrying the cached result and started is None: nothing is
+        admitted, spawned or polled.
+        """
+        job = await cached_job(course_data, options, batch_id, priority)
+        if job:
+            return job["job_id"], None, job
+        
+        key = inflight_key(course_data, options)
+        job_id = uuid.uuid4().hex
+        claim = {"job_id": job_id, "claimed_at": time.time()}
+        while not await inflight_store.put.aio(key, claim, skip_if_exists=True):
+            existing, job = await join_inflight_job(key)
+            if job:
+                increment_counter("video_requests_coalesced_total")
+                await publish_metrics()
+                existing_job_id = existing["job_id"]
+                await inflight_store.put.aio(waiter_prefix(key, existing_job_id) + uuid.uuid4().hex, time.time())
+                print(f"Coalesced duplicate request onto in-flight job {existing_job_id}")
+                return existing_job_id, asyncio.ensure_future(wait_for_call(existing_job_id)), {**job, "coalesced": True}
+            # The previous owner finished or died: one request takes the claim over, the rest join its job
+            if existing and await take_over_claim(inflight_store, key, existing, claim):
+                break
+            await asyncio.sleep(0.2)
+        
+        try:
+            slot = admission.reserve(priority)
+        except AdmissionRejected as e:
+            await inflight_store.pop.aio(key)
+            await reject(e, "queue_full")
+        
+        # Record the job before spawning so the worker always finds it
+        job = {
+            "job_id": job_id,
+            "status": "queued",
+            "title": course_data["title"],
+            "created_at": time.time(),
+            "inflight_key": key,
+            "priority": priority,
+        }
+        if batch_id:
+            job["batch_id"] = batch_id
+        if not slot.done():
+            job["queue_position"] = len(admission.queue)
+        await job_store.put.aio(job_id, job)
+        await admission_queue.put.aio(job_id, {
+            "course_data": course_data,
+            "options": options,
+            "priority": priority,
+            "queued_at": job["created_at"],
+            "owner": owner,
+        })
+        
+        started = start_admitted(job_id, course_data, options, priority, slot)
+        
+        if slot.done():
+            # Admitted straight away: answer once the worker is spawned, as before
+            await asyncio.shield(started)
+            job = await job_store.get.aio(job_id) or job
+        return job_id, started, job
+    
+
+    @web_app.post("/generate", status_code=202)
+    async def generate_course_video(data: dict, api_key: str = Header(..., alias="X-API-Key"), client_id: Optional[str] = Header(None, alias="X-Client-Id")):
+        """
+        Enqueue an educational video generation job from course content summary
+        
+        Expected body:
+        {
+            "title": "Introduction to Arrays",
+            "subject": "Computer Science",
+            "blocks": [
+                "Block 1 content...",
+                "Block 2 content...",
+                ...
+            ],
+            "max_retries": 3,  // Optional: Maximum retry attempts (1-10, default: 3)
+            "use_cache": true,  // Optional: Reuse a previously rendered identical video (default: true)
+            "render_mode": "single",  // Optional: "single" or "parallel" (one container per block, default: "single")
+            "speculative_candidates": 1,  // Optional: Gemini candidates raced per attempt (1-5, default: 1)
+            "stream_upload": false,  // Optional: Upload Manim's MP4 as written (moov atom last) once the render ends, skipping the faststart remux (single mode only, default: false)
+            "output_format": "mp4",  // Optional: "mp4" or "hls" (parallel mode only, also publishes a playlist_url early, default: "mp4")
+            "render_profile": "standard",  // Optional: "draft" (480p15), "mobile" (720p30), "standard" (1080p60) or "hq" (1440p60)
+            "upgrade_to_hq": false,  // Optional: After a quicker profile succeeds, re-render at "hq" in the background (single mode only)
+            "use_templates": false,  // Optional: Render courses that fit a built-in scene template without Gemini (default: false)
+            "priority": "interactive"  // Optional: "interactive" or "batch" (queued behind interactive jobs, default: "interactive")
+        }
+        
+        Returns immediately with a job id - poll GET /jobs/{job_id} for the result,
+        or follow GET /jobs/{job_id}/events for live progress. Unless use_cache
+        is false, a course whose video is already in the result cache returns a
+        "succeeded" job with its result straight away, without being queued.
+        A payload identical to one still in flight returns that job's id with
+        "coalesced": true instead of starting another render. With upgrade_to_hq
+        the job succeeds with the quick render and its "upgrade" field tracks the
+        background HQ render. While all render slots are busy the job is queued
+        (see queue_position); a full queue or an exhausted rate limit (per
+        X-Client-Id header, or per API key without one) returns 429 with a
+        Retry-After header. With use_templates, courses that fit a built-in
+        scene template (arrays, trees/graphs, equations, function plots) skip
+        Gemini; the result's "route" says which path rendered the video.
+        """
+        verify_api_key(api_key)
+        try:
+            admission.take_token(rate_limit_key(api_key, client_id))
+        except AdmissionRejected as e:
+            await reject(e, "rate_limit")
+
+        try:
+            priority = parse_priority(data)
+            course_data, options = parse_generate_request(data)
+            job_id, started, job = await enqueue_job(course_data, options, priority=priority)
+            
+            response = {
+                "job_id": job_id,
+                "status": job["status"],
+                "status_url": f"/jobs/{job_id}",
+                "coalesced": job.get("coalesced", False),
+            }
+            if "queue_position" in job:
+                response["queue_position"] = job["queue_position"]
+            if "result" in job:
+                response["result"] = job["result"]
+            return response
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+    
+    @web_app.post("/regenerate", status_code=202)
+    async def regenerate_course_video(data: dict, api_key: str = Header(..., alias="X-API-Key"), client_id: Optional[str] = Header(None, alias="X-Client-Id")):
+        """
+        Re-render an edited course, regenerating only the blocks that changed
+        
+        Expected body:
+        {
+            "job_id": "...",  // The succeeded job whose course was edited
+            "blocks": [...],  // The full, edited list of blocks
+            "title": "...",  // Optional: defaults to the previous job's title
+            "subject": "..."  // Optional: defaults to the previous job's subject
+            // Plus any other optional /generate field except render_mode
+        }
+        
+        Always renders in "parallel" mode: each block is its own segment, stored
+        by content, so segments of unchanged blocks are spliced back in with a
+        stream-copy concat and only edited blocks go through Gemini and the
+        renderer. render_profile and output_format default to the previous
+        job's. changed_blocks lists the (0-based) blocks whose hash is not in
+        the previous result's block_hashes; a previous single-mode render has
+        no stored segments, so every block counts as changed once. Poll GET
+        /jobs/{job_id} as for /generate; the result's segment_reuse says how
+        many segments were reused.
+        """
+        verify_api_key(api_key)
+        try:
+            admission.take_token(rate_limit_key(api_key, client_id))
+        except AdmissionRejected as e:
+            await reject(e, "rate_limit")
+        
+        try:
+            previous_job_id = data.get("job_id")
+            if not previous_job_id:
+                raise HTTPException(status_code=400, detail="Missing required field: 'job_id'")
+            if "blocks" not in data:
+                raise HTTPException(status_code=400, detail="Missing required field: 'blocks'")
+            if data.get("render_mode", "parallel") != "parallel":
+                raise HTTPException(status_code=400, detail="Regeneration only supports render_mode 'parallel'")
+            
+            previous = await job_store.get.aio(previous_job_id)
+            if not previous:
+                raise HTTPException(status_code=404, detail=f"Job not found: {previous_job_id}")
+            if previous["status"] != "succeeded":
+                raise HTTPException(status_code=409, detail=f"Job {previous_job_id} has not succeeded (status: {previous['status']})")
+            previous_result = previous.get("result") or {}
+            
+            defaults = {"title": previous["title"], "subject": previous_result.get("subject", "")}
+            for option in ("render_profile", "output_format"):
+                if option in previous_result:
+                    defaults[option] = previous_result[option]
+            priority = parse_priority(data)
+            course_data, options = parse_generate_request({**defaults, **data, "render_mode": "parallel"})
+            
+            previous_hashes = set(previous_result.get("block_hashes") or []) if previous_result.get("render_mode") == "parallel" else set()
+            changed_blocks = [index for index, block_hash in enumerate(block_hashes(course_data)) if block_hash not in previous_hashes]
+            
+            job_id, started, job = await enqueue_job(course_data, options, priority=priority)
+            
+            response = {
+                "job_id": job_id,
+                "status": job["status"],
+                "status_url": f"/jobs/{job_id}",
+                "coalesced": job.get("coalesced", False),
+                "regenerated_from": previous_job_id,
+                "changed_blocks": changed_blocks,
+            }
+            if "queue_position" in job:
+                response["queue_position"] = job["queue_position"]
+            if "result" in job:
+                response["result"] = job["result"]
+            return response
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+    
+    @web_app.post("/generate/batch")
+    async def generate_course_video_batch(data: dict, api_key: str = Header(..., alias="X-API-Key"), client_id: Optional[str] = Header(None, alias="X-Client-Id")):
+        """
+        Generate many videos with bounded fan-out, streaming per-item results as NDJSON
+        
+        Expected body:
+        {
+            "items": [
+                {"title": "...", "subject": "...", "blocks": [...]},  // Same fields as POST /generate
+                ...
+            ],
+            "concurrency": 4,  // Optional: Items generated at once (1-20, default: 4)
+            "max_retries": 3  // Optional: Any other /generate field is a default for every item
+        }
+        
+        Streams one JSON line per event: "accepted", then an "item" line per item
+        as it finishes (with its job_id and result or error), periodic
+        "heartbeat" lines, and a final "summary". A failing item never aborts
+        the rest. Items already started keep running if the client disconnects.
+        Items are admitted at "batch" priority, behind interactive requests, and
+        the whole batch spends one rate limit token.
+        """
+        verify_api_key(api_key)
+        try:
+            admission.take_token(rate_limit_key(api_key, client_id))
+        except AdmissionRejected as e:
+            await reject(e, "rate_limit")
+        
+        items = data.get("items")
+        if not isinstance(items, list) or not items:
+            raise HTTPException(status_code=400, detail="Missing required field: 'items' (a non-empty list)")
+        if len(items) > BATCH_MAX_ITEMS:
+            raise HTTPException(status_code=400, detail=f"Too many items: {len(items)} (max {BATCH_MAX_ITEMS})")
+        
+        concurrency = max(1, min(int(data.get("concurrency", BATCH_DEFAULT_CONCURRENCY)), BATCH_MAX_CONCURRENCY))
+        defaults = {key: value for key, value in data.items() if key not in ("items", "concurrency")}
+        batch_id = uuid.uuid4().hex
+        
+        async def run_item(index: int, item: dict, semaphore):
+            entry = {"event": "item", "index": index}
+            async with semaphore:
+                try:
+                    if not isinstance(item, dict):
+                        raise HTTPException(status_code=400, detail="Each item must be an object")
+                    course_data, options = parse_generate_request({**defaults, **item})
+                    job_id, started, job = await enqueue_job(course_data, options, batch_id=batch_id, priority="batch")
+                    entry["job_id"] = job_id
+                    if job.get("coalesced"):
+                        entry["coalesced"] = True
+                    if started is None:
+                        entry["result"] = job["result"]
+                    else:
+                        call = await started
+                        entry["result"] = await call.get.aio()
+                    entry["status"] = "succeeded"
+                except HTTPException as e:
+                    entry["status"] = "failed"
+                    entry["error"] = e.detail
+                except Exception as e:
+                    entry["status"] = "failed"
+                    entry["error"] = str(e) or type(e).__name__
+            return entry
+        
+        async def stream_results():
+            semaphore = asyncio.Semaphore(concurrency)
+            batch_start = time.time()
+            counts = {"succeeded": 0, "failed": 0}
+            yield json.dumps({"event": "accepted", "batch_id": batch_id, "items": len(items), "concurrency": concurrency}) + "\n"
+            
+            pending = {asyncio.create_task(run_item(index, item, semaphore)) for index, item in enumerate(items)}
+            try:
+                while pending:
+                    done, pending = await asyncio.wait(pending, timeout=BATCH_HEARTBEAT_SECONDS, return_when=asyncio.FIRST_COMPLETED)
+                    if not done:
+                        # Keep idle proxies from dropping the connection while long renders run
+                        yield json.dumps({"event": "heartbeat", "remaining": len(pending)}) + "\n"
+                    for task in done:
+                        entry = task.result()
+                        counts[entry["status"]] += 1
+                        yield json.dumps(entry) + "\n"
+                
+                yield json.dumps({
+                    "event": "summary",
+                    "batch_id": batch_id,
+                    "items": len(items),
+                    **counts,
+                    "seconds": round(time.time() - batch_start, 3),
+                }) + "\n"
+            finally:
+                # Client went away: stop items that have not started, spawned jobs carry on
+                for task in pending:
+                    task.cancel()
+        
+        return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+    
+    async def load_job(job_id: str):
+        """
+        Fetch a job record, reconciling it with its function call in case the worker died without updating it
+        
+        A queued job that has neither a worker nor an admission_queue entry was
+        lost by a web container that stopped between admitting and spawning it,
+        so it is failed once ADMISSION_ORPHAN_SECONDS have passed.
+        """
+        job = await job_store.get.aio(job_id)
+        if not job:
+            raise HTTPException(status_code=404, detail=f"Job not found: {job_id}")
+        
+        if job["status"] == "queued" and not job.get("call_id"):
+            since = job.get("dispatched_at") or job.get("created_at", 0)
+            if time.time() - since > ADMISSION_ORPHAN_SECONDS and await admission_queue.get.aio(job_id) is None:
+                job.update(status="failed", error="Job was lost before it started (web container restarted)", finished_at=time.time())
+                await job_store.put.aio(job_id, job)
+            return job
+        
+        if job["status"] not in JOB_TERMINAL_STATUSES and job.get("call_id"):
+            call = modal.FunctionCall.from_id(job["call_id"])
+            try:
+                job["result"] = await call.get.aio(timeout=0)
+                job["status"] = "succeeded"
+            except (modal.exception.FunctionTimeoutError, modal.exception.OutputExpiredError) as e:
+                job["status"] = "failed"
+                job["error"] = str(e) or type(e).__name__
+            except (TimeoutError, modal.exception.TimeoutError):
+                # Still queued or running (modal raises the builtin TimeoutError for timeout=0)
+                return job
+            except Exception as e:
+                job["status"] = "failed"
+                job["error"] = str(e)
+            
+            job["finished_at"] = job.get("finished_at") or time.time()
+            await job_store.put.aio(job_id, job)
+        
+        return job
+    
+    @web_app.get("/jobs/{job_id}")
+    async def get_job(job_id: str, api_key: str = Header(..., alias="X-API-Key")):
+        """
+        Get the status of a generation job, and its result once it has succeeded
+        
+        Status is one of: queued, running, succeeded, failed, cancelled
+        """
+        verify_api_key(api_key)
+        return await load_job(job_id)
+    
+    @web_app.get("/jobs/{job_id}/events")
+    async def stream_job_events(
+        job_id: str,
+        api_key: str = Header(..., alias="X-API-Key"),
+        last_event_id: Optional[str] = Header(None, alias="Last-Event-ID"),
+    ):
+        """
+        Stream a job's progress as Server-Sent Events until it finishes
+        
+        Each event is named after its stage and carries the stage's details as
+        JSON: started, attempt (attempt / max_attempts), generating, exec (the
+        dry run), rendering (animation / animations and frames written, or
+        segment / segments in parallel mode), encoding, uploading (bytes_sent /
+        bytes_total), then done (with r2_url) or failed (with error). Event ids
+        are sequence numbers, so a client reconnecting with Last-Event-ID
+        resumes after the last event it saw. Once a job has finished only its
+        final event is kept, so a stream opened later gets just that one. A job
+        that ends without a final event from its worker (cancelled, or the
+        worker died) gets one built from the job record.
+        """
+        verify_api_key(api_key)
+        await load_job(job_id)
+        
+        def format_event(stage: str, payload: dict, event_id: int = None) -> str:
+            lines = [f"id: {event_id}"] if event_id is not None else []
+            lines += [f"event: {stage}", f"data: {json.dumps(payload)}"]
+            return "\n".join(lines) + "\n\n"
+        
+        async def stream_events():
+            seq = int(last_event_id) + 1 if (last_event_id or "").isdigit() else 0
+            last_sent = time.time()
+            last_status_check = 0  # Check straight away, the job may have finished and been trimmed
+            job = None
+            while True:
+                event = await job_events.get.aio(f"{job_id}:{seq}")
+                if event:
+                    seq += 1
+                    last_sent = time.time()
+                    yield format_event(event["stage"], event, event["seq"])
+                    if event["stage"] in JOB_EVENT_FINAL_STAGES:
+                        return
+                    continue
+                
+                if job:
+                    if seq < job.get("final_event_seq", -1):
+                        # The events before the final one were trimmed when the job finished
+                        seq = job["final_event_seq"]
+                        continue
+                    
+                    # The job ended and one more look found no final event from the worker
+                    stage = "done" if job["status"] == "succeeded" else job["status"]
+                    payload = {"stage": stage, "status": job["status"]}
+                    if job.get("error"):
+                        payload["error"] = job["error"]
+                    if (job.get("result") or {}).get("r2_url"):
+                        payload["r2_url"] = job["result"]["r2_url"]
+                    yield format_event(stage, payload)
+                    return
+                
+                now = time.time()
+                if now - last_status_check >= JOB_EVENT_STATUS_SECONDS:
+                    last_status_check = now
+                    latest = await load_job(job_id)
+                    if latest["status"] in JOB_TERMINAL_STATUSES:
+                        job = latest
+                if now - last_sent >= JOB_EVENT_KEEPALIVE_SECONDS:
+                    last_sent = now
+                    yield ": keepalive\n\n"
+                await asyncio.sleep(JOB_EVENT_POLL_SECONDS)
+        
+        return StreamingResponse(
+            stream_events(),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+    
+    @web_app.delete("/jobs/{job_id}")
+    async def cancel_job(job_id: str, api_key: str = Header(..., alias="X-API-Key")):
+        """
+        Cancel a queued or running generation job
+        
+        Coalesced requests share one job, so it is only cancelled by the last of
+        its callers: until then a cancel detaches one caller and returns the
+        still running job with "detached": true.
+        """
+        verify_api_key(api_key)
+        
+        job = await job_store.get.aio(job_id)
+        if not job:
+            raise HTTPException(status_code=404, detail=f"Job not found: {job_id}")
+        
+        if job["status"] in JOB_TERMINAL_STATUSES:
+            raise HTTPException(
+                status_code=409,
+                detail=f"Job {job_id} has already finished with status '{job['status']}'"
+            )
+        
+        if job.get("inflight_key"):
+            # Popping is atomic, so concurrent cancels each detach a different waiter
+            prefix = waiter_prefix(job["inflight_key"], job_id)
+            waiters = [key async for key in inflight_store.keys.aio() if key.startswith(prefix)]
+            for key in waiters:
+                if await inflight_store.pop.aio(key, None) is not None:
+                    return {**job, "detached": True}
+        
+        if job.get("call_id"):
+            try:
+                await modal.FunctionCall.from_id(job["call_id"]).cancel.aio()
+            except Exception as e:
+                raise HTTPException(status_code=500, detail=f"Failed to cancel job: {e}")
+        else:
+            await admission_queue.pop.aio(job_id, None)
+        
+        job["status"] = "cancelled"
+        job["finished_at"] = time.time()
+        await job_store.put.aio(job_id, job)
+        
+        # The cancelled worker never publishes a final event or trims its events
+        seq = 0
+        while await job_events.pop.aio(f"{job_id}:{seq}", None) is not None:
+            seq += 1
+        
+        return job
+    
+    @web_app.get("/metrics")
+    async def metrics(api_key: str = Header(..., alias="X-API-Key")):
+        """Job, stage, retry, fallback and admission metrics from every container in Prometheus text format"""
+        verify_api_key(api_key)
+        
+        # Containers are replaced all the time, so drop the shards of those long gone
+        shards, stale = [], []
+        async for task_id, shard in metrics_store.items.aio():
+            if time.time() - shard.get("last_seen", 0) > METRICS_SHARD_TTL_SECONDS:
+                stale.append(task_id)
+            else:
+                shards.append(shard)
+        for task_id in stale:
+            await metrics_store.pop.aio(task_id, None)
+        return PlainTextResponse(render_prometheus_metrics(shards, admission.gauges()), media_type="text/plain; version=0.0.4")
+    
+    @web_app.get("/health")
+    async def health(api_key: str = Header(..., alias="X-API-Key")):
+        verify_api_key(api_key)
+        return {"status": "healthy"}
+    
+    return web_app